@@ -0,0 +1,130 @@
+"""
+Completion matrix of habits × days and the analyses built on it.
+
+tbl_tracker is streamed once into a boolean matrix with one row per habit and one column per day.
+Long ranges are bit-packed (8 days per byte), 10,000 habits over 5 years then take about 2.3 MB.
+Rolling completion rates, weekday histograms and calendar heatmaps are computed from blocks of
+rows with NumPy, so no analysis loops over habits or completions in Python.
+"""
+import numpy as np
+from collections import namedtuple
+from datetime import date, timedelta
+
+from db import CHUNK_SIZE, iter_completion_days
+from periods import day_number
+
+CompletionMatrix = namedtuple("CompletionMatrix", ["habit_ids", "start", "days", "bits", "packed"])
+PACK_DAYS = 366  # ranges longer than this are bit-packed by default
+BLOCK_ROWS = 1_024  # habits unpacked at a time by the analyses
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def completion_matrix(db, start, end, habit_ids=None, packed=None, workers=None):
+    """
+    Build the CompletionMatrix of all habits, or of `habit_ids`, for the days from `start` to `end`.
+    Rows follow the sorted habit ids, column 0 is `start`. With `packed` (default: ranges longer than
+    PACK_DAYS) each row is stored with np.packbits. With `workers`, shards of habits are filled by
+    that many processes (see parallel.py).
+    """
+    if workers and workers > 1:
+        from parallel import parallel_completion_matrix
+        return parallel_completion_matrix(db, workers, start, end, habit_ids, packed)
+    start, end = day_number(start), day_number(end)
+    days = max(end - start + 1, 0)
+    if habit_ids is None:
+        all_ids = np.array([row[0] for row in db.execute("SELECT id FROM tbl_habit ORDER BY id")], dtype=np.int64)
+    else:
+        all_ids = np.unique(np.array(list(habit_ids), dtype=np.int64))
+    packed = days > PACK_DAYS if packed is None else packed
+    bits = np.zeros((len(all_ids), -(-days // 8) if packed else days), dtype=np.uint8 if packed else bool)
+    if not len(all_ids) or not days:
+        return CompletionMatrix(all_ids, start, days, bits, packed)
+
+    for ids, completed in iter_completion_days(db, CHUNK_SIZE, None if habit_ids is None else all_ids.tolist()):
+        keep = (completed >= start) & (completed <= end)
+        rows = np.searchsorted(all_ids, ids[keep])
+        found = all_ids[np.minimum(rows, len(all_ids) - 1)] == ids[keep]
+        rows, columns = rows[found], completed[keep][found] - start
+        if not len(rows):
+            continue
+        # each chunk covers a contiguous range of rows, it is filled densely and packed at once
+        first, last = rows[0], rows[-1] + 1
+        block = np.zeros((last - first, days), dtype=bool)
+        block[rows - first, columns] = True
+        bits[first:last] |= np.packbits(block, axis=1) if packed else block
+    return CompletionMatrix(all_ids, start, days, bits, packed)
+
+
+def dense(matrix, rows=slice(None)):
+    """Return the boolean habits × days block of the given rows."""
+    if matrix.packed:
+        return np.unpackbits(matrix.bits[rows], axis=1, count=matrix.days).astype(bool)
+    return matrix.bits[rows]
+
+
+def iter_blocks(matrix, block_rows=BLOCK_ROWS):
+    """Yield (first row, boolean block) for consecutive blocks of `block_rows` habits."""
+    for first in range(0, len(matrix.habit_ids), block_rows):
+        yield first, dense(matrix, slice(first, first + block_rows))
+
+
+def day_of(matrix, column):
+    """Return the date of a column."""
+    return date(1970, 1, 1) + timedelta(days=int(matrix.start + column))
+
+
+def rolling_rates(matrix, window):
+    """
+    Completion rate of every habit over the `window` days ending with each day, as a float32
+    habits × days array. The first days of the range are divided by the days the window covers so far.
+    """
+    rates = np.empty((len(matrix.habit_ids), matrix.days), dtype=np.float32)
+    covered = np.minimum(np.arange(1, matrix.days + 1), window)
+    for first, block in iter_blocks(matrix):
+        counts = np.cumsum(block, axis=1, dtype=np.int32)
+        if window < matrix.days:
+            counts[:, window:] -= counts[:, :-window].copy()
+        rates[first:first + len(block)] = counts / covered
+    return rates
+
+
+def completion_rates(matrix, windows=(7, 30, 365)):
+    """Completion rate of every habit over the last `window` days of the range, as {window: float array}."""
+    rates = {window: np.empty(len(matrix.habit_ids)) for window in windows}
+    for first, block in iter_blocks(matrix):
+        for window in windows:
+            window_days = min(window, matrix.days)
+            rates[window][first:first + len(block)] = block[:, matrix.days - window_days:].sum(axis=1) / max(window_days, 1)
+    return rates
+
+
+def weekday_histogram(matrix):
+    """Completions of every habit per weekday, as a habits × 7 int array starting on Monday."""
+    # 1970-01-01 was a Thursday, weekday 3 when Monday is 0
+    weekdays = (np.arange(matrix.start, matrix.start + matrix.days) + 3) % 7
+    one_hot = (weekdays[:, None] == np.arange(7)).astype(np.float32)
+    histogram = np.empty((len(matrix.habit_ids), 7), dtype=np.int64)
+    for first, block in iter_blocks(matrix):
+        histogram[first:first + len(block)] = np.rint(block.astype(np.float32) @ one_hot)
+    return histogram
+
+
+def daily_counts(matrix, row=None):
+    """Completions per day of one habit (matrix row `row`) or, by default, summed over all habits."""
+    if row is not None:
+        return dense(matrix, slice(row, row + 1))[0].astype(np.int64)
+    counts = np.zeros(matrix.days, dtype=np.int64)
+    for _, block in iter_blocks(matrix):
+        counts += block.sum(axis=0)
+    return counts
+
+
+def calendar_heatmap(matrix, row=None):
+    """
+    GitHub-style calendar of daily_counts: a 7 × weeks float array with Monday in row 0 and one
+    column per week. Cells before the start and after the end of the range are NaN.
+    """
+    offset = (matrix.start + 3) % 7
+    cells = np.full(offset + matrix.days + (-(offset + matrix.days)) % 7, np.nan)
+    cells[offset:offset + matrix.days] = daily_counts(matrix, row)
+    return cells.reshape(-1, 7).T
@@ -1,90 +1,136 @@
-import matplotlib.pyplot as plt
-from db import get_all_habits, get_habit_tracking_data
-from datetime import datetime, timedelta
-
-def plot_streaks_as_table(db):
-    """Display a table showing total and longest streaks for each habit."""
-    habits = get_all_habits(db)  # get all habits
-    streak_summary = []  # store statistics for each habit
-    congratulations = []
-
-
-    for habit in habits:
-        habit_name = habit[0]
-        frequency = habit[1]
-        data = get_habit_tracking_data(db, habit_name)
-
-
-        if not data:
-            print(f"No completion data for habit: {habit_name}")
-            streak_summary.append([habit_name, 0, 0])  # if no data,0
-            continue
-
-        # Get all completion dates and sort them by date
-        completed_dates = sorted([datetime.strptime(date[0], "%Y-%m-%d").date() for date in data])
-
-        # calculate streak for the habit
-        streaks = []
-        current_streak = 0
-        last_date = None
-
-        for completed_date in completed_dates:
-            if last_date is None or completed_date == last_date + timedelta(days=1):
-                current_streak += 1
-            else:
-                streaks.append(current_streak)
-                current_streak = 1  # 重置 streak
-
-            last_date = completed_date
-
-        # add the last streak
-        streaks.append(current_streak)
-
-        # calculate total streak and longest streak
-        total_streak = sum(streaks)
-        longest_streak = max(streaks)
-
-        # 21 days motivation
-        streak_summary.append([habit_name, total_streak, longest_streak])
-        if frequency == "daily" and longest_streak >= 21:
-            congratulations.append(f"Congratulations! You've developed a daily habit '{habit_name}', keep going!")
-        elif frequency == "weekly" and longest_streak >= 4:
-            congratulations.append(f"Congratulations! You've developed a weekly habit '{habit_name}', keep going!")
-        elif frequency == "monthly" and longest_streak >= 3:
-            congratulations.append(f"Congratulations! You've developed a monthly habit '{habit_name}', keep going!")
-        elif frequency == "yearly" and longest_streak >= 1:
-            congratulations.append(f"Congratulations! You've developed a yearly habit '{habit_name}', keep going!")
-        else:
-            congratulations.append("")
-
-
-
-    if not streak_summary:
+import numpy as np
+from collections import namedtuple
+from datetime import date
+from db import DEFAULT_USER, history_stats
+from periods import current_streaks, day_number, period_of, to_periods
+
+HabitStreaks = namedtuple("HabitStreaks", ["name", "frequency", "total", "current", "longest"])
+NEVER = -(10 ** 6)  # last day of habits without completions, far enough back that their current streak is 0
+
+
+def _current_streak(frequency, streak, last_period, today):
+    """The stored streak ends with the last completion, it is only current if that was in this or the previous period."""
+    if last_period is None or last_period < period_of(frequency, today) - 1:
+        return 0
+    return streak
+
+
+def compute_streaks(db, today=None, workers=None, user_id=DEFAULT_USER):
+    """
+    Compute total, current and longest streak of every habit from the raw tbl_tracker history,
+    with a single query. Streaks are counted in the periods of the habit's frequency:
+    days, ISO weeks, months or years. Returns a list of HabitStreaks of the user's habits ordered by name.
+    With `workers`, the habits are split between that many processes (see parallel.py).
+    """
+    today = day_number(today or date.today())
+    habits = db.execute("SELECT id, name, frequency FROM tbl_habit WHERE user_id = ? ORDER BY name", (user_id,)).fetchall()
+    habit_ids = [habit[0] for habit in habits]
+    if workers and workers > 1:
+        from parallel import parallel_history_stats
+        stats = parallel_history_stats(db, workers, habit_ids)
+    else:
+        stats = history_stats(db, habit_ids)
+    result = []
+    for habit_id, name, frequency in habits:
+        total, streak, longest, _, last_period = stats.get(habit_id, (0, 0, 0, None, None))
+        result.append(HabitStreaks(name, frequency, total, _current_streak(frequency, streak, last_period, today), longest))
+    return result
+
+
+REPORT_SORTS = ["name", "total", "current", "longest"]
+MILESTONES = {"daily": 21, "weekly": 4, "monthly": 3, "yearly": 1}  # longest streak that makes a habit
+PLOT_ROWS = 50  # habits drawn in the matplotlib table, the text table always lists all of them
+
+
+def streak_table(db, frequency=None, today=None, user_id=DEFAULT_USER):
+    """
+    Load the materialized streaks of all habits of a user, or of those with one frequency, into NumPy arrays
+    ordered by habit name: a dict with the fields of HabitStreaks as keys.
+    The current streaks are computed for all habits at once. On a connection with a cache, the table
+    is kept until a habit of the user is written.
+    """
+    today = day_number(today or date.today())
+    query_cache = getattr(db, "query_cache", None)
+    if query_cache is not None:
+        return query_cache.result(db, ("streak_table", user_id, frequency, today), user_id,
+                                  lambda: _streak_table(db, frequency, today, user_id))
+    return _streak_table(db, frequency, today, user_id)
+
+
+def _streak_table(db, frequency, today, user_id):
+    where, params = ("WHERE user_id = ? AND frequency = ?", (user_id, frequency)) if frequency else ("WHERE user_id = ?", (user_id,))
+    rows = db.execute(f"""
+        SELECT name, frequency, COALESCE(total_completions, 0), COALESCE(streak, 0), COALESCE(longest_streak, 0),
+               COALESCE(CAST(julianday(last_completed) - 2440587.5 AS INTEGER), ?)
+        FROM tbl_habit {where} ORDER BY name""", (NEVER,) + params).fetchall()
+    names, frequencies, totals, streaks, longests, last_days = zip(*rows) if rows else ([],) * 6
+    frequencies = np.array(frequencies, dtype=str)
+    last_days = np.array(last_days, dtype=np.int64)
+    today = np.full(len(rows), today, dtype=np.int64)
+    current = current_streaks(np.array(streaks, dtype=np.int64), to_periods(frequencies, last_days), to_periods(frequencies, today))
+    return {"name": np.array(names, dtype=object), "frequency": frequencies, "total": np.array(totals, dtype=np.int64),
+            "current": current, "longest": np.array(longests, dtype=np.int64)}
+
+
+def select_streaks(table, sort="name", top=None, page=1, page_size=None):
+    """
+    Order the rows of a streak_table by name or by a streak (highest first, ties by name), keep the
+    `top` best and return page `page` of `page_size` rows as a list of HabitStreaks.
+    """
+    if sort == "name":
+        order = np.arange(len(table["name"]))
+    else:
+        order = np.argsort(-table[sort], kind="stable")
+    if top is not None:
+        order = order[:top]
+    if page_size:
+        order = order[(page - 1) * page_size:page * page_size]
+    columns = [table[field][order].tolist() for field in HabitStreaks._fields]
+    return [HabitStreaks(*row) for row in zip(*columns)]
+
+
+def page_count(rows, page_size):
+    """Number of pages needed for `rows` rows."""
+    return max(1, -(-rows // page_size)) if page_size else 1
+
+
+def get_streaks(db, today=None, user_id=DEFAULT_USER):
+    """
+    Read the streaks of every habit from the columns materialized in tbl_habit, without touching tbl_tracker.
+    Returns the same list of HabitStreaks as compute_streaks.
+    """
+    return select_streaks(streak_table(db, today=today, user_id=user_id))
+
+
+def plot_streaks_as_table(db, path=None, max_rows=PLOT_ROWS, user_id=DEFAULT_USER):
+    """
+    Display a table showing total and longest streaks for each habit.
+    With `path`, the table is rendered headless and saved to that PNG/SVG file instead of shown.
+    Only the first `max_rows` habits are drawn, so the figure stays readable with thousands of habits.
+    """
+    table = streak_table(db, user_id=user_id)
+    count = len(table["name"])
+    if not count:
         print("No streak data to display.")
         return
 
-    # print congratulations information
-    print(f"{'Habit':<20} {'Total Streak (Days)':<20} {'Longest Streak (Days)':<20}")
-    print("=" * 60)
-    for i, (habit_name, total_streak, longest_streak) in enumerate(streak_summary):
-        print(f"{habit_name:<20} {total_streak:<20} {longest_streak:<20}")
-        if congratulations[i]:
-            print(f"  → {congratulations[i]}")
-
-    #  Matplotlib
-    fig, ax = plt.subplots(figsize=(8, len(streak_summary) * 0.5))
-    ax.axis("tight")
-    ax.axis("off")
-
-    # table content
-    table_data = [["Habit", "Total Streak (Days)", "Longest Streak (Days)"]]
-    table_data.extend(streak_summary)
-
-    table = ax.table(cellText=table_data, colLabels=None, loc="center", cellLoc="center")
-    table.auto_set_font_size(False)
-    table.set_fontsize(10)
-    table.auto_set_column_width(col=list(range(len(table_data[0]))))
-
-    plt.title("Habit Streak Summary", pad=10)
-    plt.show()
+    lines = [f"No completion data for habit: {name}" for name in table["name"][table["total"] == 0]]
+    # 21 days motivation
+    milestone = np.array([MILESTONES.get(frequency, np.inf) for frequency in table["frequency"]])
+    developed = (table["total"] > 0) & (table["longest"] >= milestone)
 
+    # print congratulations information
+    lines.append(f"{'Habit':<20} {'Total Streak (Days)':<20} {'Longest Streak (Days)':<20}")
+    lines.append("=" * 60)
+    for name, frequency, total, longest, congratulate in zip(table["name"], table["frequency"].tolist(),
+                                                             table["total"].tolist(), table["longest"].tolist(), developed.tolist()):
+        lines.append(f"{name:<20} {total:<20} {longest:<20}")
+        if congratulate:
+            lines.append(f"  → Congratulations! You've developed a {frequency} habit '{name}', keep going!")
+    print("\n".join(lines))
+
+    #  Matplotlib, imported only when a table is drawn
+    from render import render_table
+    title = "Habit Streak Summary" if count <= max_rows else f"Habit Streak Summary (first {max_rows} of {count:,} habits)"
+    rows = zip(table["name"][:max_rows], table["total"][:max_rows].tolist(), table["longest"][:max_rows].tolist())
+    render_table(list(rows), ["Habit", "Total Streak (Days)", "Longest Streak (Days)"], title, path)
@@ -0,0 +1,837 @@
+"""
+Benchmarks for the habit tracker database layer.
+
+Run with: python benchmark.py
+Every benchmark works on temporary database files, the real habits.db is never touched.
+
+The suite times the hot paths on data from synthetic.generate at several scales and writes JSON,
+which a later run compares against to find regressions:
+
+    python benchmark.py suite --rows 1000 100000 1000000 --json before.json
+    python benchmark.py suite --rows 1000 100000 1000000 --json after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+from io import StringIO
+
+import profiling
+import synthetic
+from analyse import HabitStreaks, compute_streaks, select_streaks, streak_table
+from habit import Habit
+from periods import day_number, period_of
+from db import (STORAGE_ENGINES, archive_completions, bulk_record_completions, check_in, delete_habit, delete_habits,
+                due_habits, get_all_habits, get_db, get_due_habits, get_habit_tracking_data, history_stats, increment_habit, purge_in_background,
+                rebuild_streaks, record_completions, set_storage, verify_streaks)
+
+
+def _timeit(func, repeat=200):
+    """Return the mean runtime of func() in microseconds."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def _fill_tracker(db, habits, days, start=date(2020, 1, 1)):
+    """Insert `habits` daily habits with `days` consecutive completions each."""
+    cur = db.cursor()
+    dates = [(start + timedelta(days=offset)).isoformat() for offset in range(days)]
+    for number in range(habits):
+        name = f"habit {number}"
+        cur.execute("INSERT INTO tbl_habit (name, frequency) VALUES (?, 'daily')", (name,))
+        habit_id = cur.lastrowid
+        cur.executemany("INSERT INTO tbl_tracker (habitname, completed_date, habit_id) VALUES (?, ?, ?)",
+                        ((name, day, habit_id) for day in dates))
+    db.commit()
+
+
+def bench_tracker_lookups(scales=(10_000, 100_000, 1_000_000), days=365):
+    """
+    Time the per-habit lookups while the total number of tracker rows grows.
+    The probed habit always has the same history, so the timings should stay flat.
+    """
+    print(f"{'tracker rows':>14} {'get_habit_tracking_data (us)':>30} {'increment_habit duplicate (us)':>32}")
+    for rows in scales:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = get_db(os.path.join(tmp, "bench.db"))
+            _fill_tracker(db, max(rows // days, 1), days)
+            today = date.today().isoformat()
+            db.execute("INSERT INTO tbl_tracker (habitname, completed_date, habit_id) SELECT name, ?, id FROM tbl_habit WHERE name = 'habit 0'", (today,))
+            db.commit()
+
+            lookup = _timeit(lambda: get_habit_tracking_data(db, "habit 0"))
+            with redirect_stdout(StringIO()):
+                duplicate = _timeit(lambda: increment_habit(db, "habit 0"))
+            print(f"{rows:>14,} {lookup:>30.1f} {duplicate:>32.1f}")
+            db.close()
+
+
+def _fill_random_tracker(db, habits, days, completion_rate=0.8, start=date(2022, 1, 1), seed=1):
+    """Insert `habits` daily habits, each completed on a random `completion_rate` share of `days` days."""
+    rng = random.Random(seed)
+    cur = db.cursor()
+    dates = [(start + timedelta(days=offset)).isoformat() for offset in range(days)]
+    cur.executemany("INSERT INTO tbl_habit (name, frequency) VALUES (?, 'daily')", ((f"habit {n}",) for n in range(habits)))
+    for habit_id, name in cur.execute("SELECT id, name FROM tbl_habit").fetchall():
+        cur.executemany("INSERT INTO tbl_tracker (habitname, completed_date, habit_id) VALUES (?, ?, ?)",
+                        ((name, day, habit_id) for day in dates if rng.random() < completion_rate))
+    db.commit()
+
+
+def _legacy_streaks(db):
+    """The former per-habit loop of plot_streaks_as_table, kept as the baseline."""
+    result = []
+    for habit in get_all_habits(db):
+        data = get_habit_tracking_data(db, habit[0])
+        if not data:
+            result.append((habit[0], 0, 0))
+            continue
+        completed_dates = sorted(datetime.strptime(row[0], "%Y-%m-%d").date() for row in data)
+        streaks, current, last = [], 0, None
+        for completed_date in completed_dates:
+            if last is None or completed_date == last + timedelta(days=1):
+                current += 1
+            else:
+                streaks.append(current)
+                current = 1
+            last = completed_date
+        streaks.append(current)
+        result.append((habit[0], sum(streaks), max(streaks)))
+    return result
+
+
+def bench_streak_engine(habits=10_000, days=3 * 365):
+    """Compare the single-pass streak engine with the former N+1 query loop."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db = get_db(os.path.join(tmp, "bench.db"))
+        _fill_random_tracker(db, habits, days)
+        rows = db.execute("SELECT COUNT(*) FROM tbl_tracker").fetchone()[0]
+
+        start = time.perf_counter()
+        engine = compute_streaks(db)
+        engine_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        legacy = _legacy_streaks(db)
+        legacy_time = time.perf_counter() - start
+
+        assert [(h.name, h.total, h.longest) for h in engine] == legacy
+        print(f"streaks for {habits:,} habits / {rows:,} completions: "
+              f"engine {engine_time:.2f}s, per-habit loop {legacy_time:.2f}s")
+        db.close()
+
+
+def bench_bulk_ingest(habits=1_000, days=1_000):
+    """Events per second of bulk_record_completions compared with one increment_habit call per event."""
+    start_day = date(2022, 1, 1)
+    events = [(f"habit {n}", (start_day + timedelta(days=offset)).isoformat()) for n in range(habits) for offset in range(days)]
+    with tempfile.TemporaryDirectory() as tmp:
+        db = get_db(os.path.join(tmp, "bench.db"))
+        db.executemany("INSERT INTO tbl_habit (name, frequency) VALUES (?, 'daily')", ((f"habit {n}",) for n in range(habits)))
+        db.commit()
+        start = time.perf_counter()
+        inserted = bulk_record_completions(db, events)
+        bulk_time = time.perf_counter() - start
+        db.close()
+        print(f"bulk_record_completions: {inserted:,} events in {bulk_time:.2f}s, {inserted / bulk_time:,.0f} events/s")
+
+        db = get_db(os.path.join(tmp, "single.db"))
+        db.executemany("INSERT INTO tbl_habit (name, frequency) VALUES (?, 'daily')", ((f"habit {n}",) for n in range(habits)))
+        db.commit()
+        sample = events[:2_000]
+        start = time.perf_counter()
+        with redirect_stdout(StringIO()):
+            for name, day in sample:
+                increment_habit(db, name, day)
+        single_time = time.perf_counter() - start
+        db.close()
+        print(f"increment_habit per event: {len(sample):,} events in {single_time:.2f}s, {len(sample) / single_time:,.0f} events/s")
+
+
+class _ListHabit:
+    """The former Habit layout: a regular object with a list of datetime.date."""
+
+    def __init__(self, name, frequency, streak=0, last_completed=None, completed=0):
+        self.name = name
+        self.frequency = frequency
+        self.streak = streak
+        self.last_completed = last_completed
+        self.completed_tasks = completed
+        self.completed_dates = []
+
+
+def _habit_footprint(make, habits, histories):
+    """Bytes allocated by `habits` objects created with make(name, history)."""
+    tracemalloc.start()
+    objects = [make(f"habit {n}", histories[n % len(histories)]) for n in range(habits)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return size
+
+
+def bench_habit_memory(habits=10_000, days=3 * 365, completion_rate=0.8, report_for=100_000):
+    """
+    Memory of Habit objects with multi-year histories, array-backed __slots__ layout versus the former one.
+    Measured on `habits` objects and scaled linearly to `report_for` habits.
+    """
+    rng = random.Random(1)
+    start = date(2022, 1, 1)
+    histories = [[start + timedelta(days=offset) for offset in range(days) if rng.random() < completion_rate]
+                 for _ in range(100)]
+
+    def make_list_habit(name, history):
+        habit = _ListHabit(name, "daily", completed=len(history))
+        habit.completed_dates = [date.fromordinal(day.toordinal()) for day in history]  # one date object per row, as when loaded
+        return habit
+
+    def make_array_habit(name, history):
+        habit = Habit(name, "daily", completed=len(history))
+        habit.completed_dates = history
+        return habit
+
+    scale = report_for / habits
+    old = _habit_footprint(make_list_habit, habits, histories) * scale
+    new = _habit_footprint(make_array_habit, habits, histories) * scale
+    print(f"{report_for:,} habits with ~{int(days * completion_rate)} completions each: "
+          f"list of dates {old / 2**20:,.0f} MiB, array of ordinals {new / 2**20:,.0f} MiB ({old / new:.1f}x smaller)")
+
+
+def bench_report(habits=100_000, page_size=50):
+    """Time a sorted, paginated streak report over many habits, data preparation and rendering separately."""
+    from analyse import select_streaks, streak_table
+    from render import render_html, render_text
+    with tempfile.TemporaryDirectory() as tmp:
+        db = get_db(os.path.join(tmp, "report.db"))
+        random.seed(1)
+        db.executemany("INSERT INTO tbl_habit (name, frequency, streak, longest_streak, total_completions, last_completed) "
+                       "VALUES (?, ?, ?, ?, ?, ?)",
+                       ((f"habit {number}", random.choice(["daily", "weekly", "monthly", "yearly"]), random.randint(0, 50),
+                         random.randint(50, 500), random.randint(50, 1000), (date(2024, 1, 1) + timedelta(days=random.randint(0, 365))).isoformat())
+                        for number in range(habits)))
+        db.commit()
+        start = time.perf_counter()
+        table = streak_table(db, today=date(2024, 12, 31))
+        loaded = time.perf_counter()
+        rows = select_streaks(table, sort="longest", top=1_000, page=3, page_size=page_size)
+        selected = time.perf_counter()
+        render_text(rows, HabitStreaks._fields)
+        render_html(rows, HabitStreaks._fields, "report")
+        rendered = time.perf_counter()
+        db.close()
+    print(f"report over {habits:,} habits: load {(loaded - start) * 1e3:,.0f} ms, sort and page {(selected - loaded) * 1e3:,.1f} ms, "
+          f"render {page_size} rows as text and HTML {(rendered - selected) * 1e3:,.2f} ms")
+
+
+def bench_activity(habits=10_000, years=5, completion_rate=0.5, sample=200):
+    """
+    Time the completion matrix and its analyses over `years` of history of `habits` habits, next to a
+    per-habit loop over get_habit_tracking_data for `sample` habits, extrapolated to all of them.
+    """
+    import activity
+    days = years * 365 + 1
+    start_day = date(2020, 1, 1)
+    end_day = start_day + timedelta(days=days - 1)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = get_db(os.path.join(tmp, "activity.db"))
+        _fill_random_tracker(db, habits, days, completion_rate, start=start_day)
+        rows = db.execute("SELECT COUNT(*) FROM tbl_tracker").fetchone()[0]
+
+        timings = {}
+        start = time.perf_counter()
+        matrix = activity.completion_matrix(db, start_day, end_day)
+        timings["matrix"] = time.perf_counter() - start
+        for window in (7, 30, 365):
+            start = time.perf_counter()
+            activity.rolling_rates(matrix, window)
+            timings[f"rolling {window}d"] = time.perf_counter() - start
+        start = time.perf_counter()
+        activity.weekday_histogram(matrix)
+        timings["weekdays"] = time.perf_counter() - start
+        start = time.perf_counter()
+        activity.calendar_heatmap(matrix)
+        timings["heatmap"] = time.perf_counter() - start
+
+        # the loop a caller would write today: one query and Python date arithmetic per habit
+        start = time.perf_counter()
+        for number in range(sample):
+            completed = {datetime.strptime(row[0], "%Y-%m-%d").date() for row in get_habit_tracking_data(db, f"habit {number}")}
+            last_week = [end_day - timedelta(days=offset) in completed for offset in range(7)]
+            weekdays = [0] * 7
+            for day in completed:
+                weekdays[day.weekday()] += 1
+            sum(last_week) / 7
+        loop = (time.perf_counter() - start) * habits / sample
+        db.close()
+
+    print(f"activity over {habits:,} habits x {days:,} days ({rows:,} completions), matrix {matrix.bits.nbytes / 2**20:.1f} MiB packed: "
+          + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items())
+          + f"; per-habit loop for 7d rate and weekdays ~{loop:.1f}s")
+
+
+def bench_parallel(habits=10_000, days=3 * 365, workers=(1, 2, 4, 8)):
+    """Scaling of compute_streaks and the completion matrix with the number of worker processes."""
+    import activity
+    start_day = date(2022, 1, 1)
+    end_day = start_day + timedelta(days=days - 1)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = get_db(os.path.join(tmp, "parallel.db"))
+        _fill_random_tracker(db, habits, days, start=start_day)
+        rebuild_streaks(db)  # shards are balanced by the stored total_completions
+        print(f"{'workers':>8} {'compute_streaks (s)':>20} {'completion_matrix (s)':>22} (of {os.cpu_count()} cores)")
+        baseline = None
+        for count in workers:
+            start = time.perf_counter()
+            streaks = compute_streaks(db, workers=count)
+            streak_time = time.perf_counter() - start
+            start = time.perf_counter()
+            matrix = activity.completion_matrix(db, start_day, end_day, workers=count)
+            matrix_time = time.perf_counter() - start
+            result = (streaks, matrix.habit_ids.tolist(), matrix.bits.tobytes())
+            baseline = baseline or result
+            assert result == baseline, f"{count} workers give a different result"
+            print(f"{count:>8} {streak_time:>20.2f} {matrix_time:>22.2f}")
+        db.close()
+
+
+def bench_multi_user(users=100_000, habits_per_user=10, writers=4, completions=2_000):
+    """
+    Per-user get_all_habits with `users` users next to a full table scan, and concurrent completions
+    of `writers` threads on one database file next to one shard per writer.
+    """
+    from db import UserShards
+    with tempfile.TemporaryDirectory() as tmp:
+        db = get_db(os.path.join(tmp, "users.db"))
+        db.executemany("INSERT INTO tbl_habit (name, frequency, user_id) VALUES (?, 'daily', ?)",
+                       ((f"habit {number}", user) for user in range(users) for number in range(habits_per_user)))
+        db.commit()
+        sample = random.Random(1).sample(range(users), 200)
+        indexed = _timeit(lambda: [get_all_habits(db, user) for user in sample], repeat=5) / len(sample)
+        scan = _timeit(lambda: [db.execute("SELECT name FROM tbl_habit NOT INDEXED WHERE user_id = ? ORDER BY name", (user,)).fetchall()
+                                for user in sample[:20]], repeat=1) / 20
+        plan = db.execute("EXPLAIN QUERY PLAN SELECT name FROM tbl_habit WHERE user_id = ? ORDER BY name", (0,)).fetchall()
+        print(f"get_all_habits of one of {users:,} users: {indexed:,.0f} µs with the (user_id, name) index, "
+              f"{scan:,.0f} µs scanning ({plan[-1][-1]})")
+        db.close()
+
+        for shards in (1, writers):
+            store = UserShards(os.path.join(tmp, f"writes{shards}.db"), shards, check_same_thread=False)
+            for user in range(writers):
+                conn = store.for_user(user)
+                conn.execute("INSERT INTO tbl_habit (name, frequency, user_id) VALUES ('Reading', 'daily', ?)", (user,))
+                conn.commit()
+            locks = {id(conn): threading.Lock() for conn in store}  # one connection per file is shared by its writers
+
+            def write(user):
+                conn = store.for_user(user)
+                for offset in range(completions):
+                    with locks[id(conn)]:
+                        increment_habit(conn, "Reading", date(2020, 1, 1) + timedelta(days=offset), user_id=user)
+
+            threads = [threading.Thread(target=write, args=(user,)) for user in range(writers)]
+            start = time.perf_counter()
+            with redirect_stdout(StringIO()):
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            elapsed = time.perf_counter() - start
+            print(f"{writers} writers on {shards} file(s): {writers * completions / elapsed:,.0f} completions/s")
+            store.close()
+
+
+async def _load_test(port, clients, requests_per_client, habits, done_share):
+    """Run keep-alive clients against the API. Returns the latency of every request in seconds and the elapsed time."""
+    import asyncio
+    latencies = []
+
+    async def client(number):
+        rng = random.Random(number)
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        for request in range(requests_per_client):
+            if rng.random() < done_share:
+                day = (date(2020, 1, 1) + timedelta(days=number * requests_per_client + request)).isoformat()
+                body = f'{{"date": "{day}"}}'.encode()
+                head = f"POST /habits/habit%20{rng.randrange(habits)}/done HTTP/1.1\r\nContent-Length: {len(body)}\r\n\r\n"
+            else:
+                body, head = b"", "GET /habits HTTP/1.1\r\n\r\n"
+            start = time.perf_counter()
+            writer.write(head.encode() + body)
+            headers = await reader.readuntil(b"\r\n\r\n")
+            length = int(headers.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(number) for number in range(clients)))
+    return latencies, time.perf_counter() - start
+
+
+def bench_server(clients=50, requests_per_client=200, habits=100, done_share=0.8):
+    """
+    Load test of the asyncio API: `clients` concurrent keep-alive connections, `done_share` of the requests
+    mark a habit as done, the others list the habits. Reports requests/s and p50/p99 latency, with group
+    commit and with one transaction per completion (batch_size=1).
+    """
+    import asyncio
+    from server import HabitServer
+
+    async def run(db_name, batch_size):
+        app = HabitServer(db_name, batch_size=batch_size)
+        server = await app.start(port=0)
+        try:
+            return await _load_test(server.sockets[0].getsockname()[1], clients, requests_per_client, habits, done_share), app.batches
+        finally:
+            await app.stop(server)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for batch_size in (1_000, 1):
+            db_name = os.path.join(tmp, f"server{batch_size}.db")
+            db = get_db(db_name)
+            db.executemany("INSERT INTO tbl_habit (name, frequency) VALUES (?, 'daily')", ((f"habit {n}",) for n in range(habits)))
+            db.commit()
+            db.close()
+            (latencies, elapsed), batches = asyncio.run(run(db_name, batch_size))
+            latencies.sort()
+            p50, p99 = (latencies[int(len(latencies) * q)] * 1e3 for q in (0.5, 0.99))
+            print(f"{'group commit' if batch_size > 1 else 'one commit per completion':<26} {clients} clients: "
+                  f"{len(latencies) / elapsed:,.0f} requests/s, p50 {p50:.1f} ms, p99 {p99:.1f} ms, {batches:,} write transactions")
+
+
+def bench_write_behind(habits=100, events=20_000, interval=0.05):
+    """
+    Completions/s of increment_habit (one transaction per completion) next to a WriteBehindQueue
+    (journal append per completion, group commits in the background), including the final flush.
+    """
+    from writebehind import WriteBehindQueue
+    dates = [date(2020, 1, 1) + timedelta(days=offset) for offset in range(events // habits)]
+    completions = [(f"habit {number}", day) for day in dates for number in range(habits)]
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("direct", "write-behind"):
+            db_name = os.path.join(tmp, f"{mode}.db")
+            db = get_db(db_name)
+            db.executemany("INSERT INTO tbl_habit (name, frequency) VALUES (?, 'daily')", ((f"habit {n}",) for n in range(habits)))
+            db.commit()
+            start = time.perf_counter()
+            if mode == "direct":
+                with redirect_stdout(StringIO()):
+                    for name, day in completions:
+                        increment_habit(db, name, day)
+                flushes = len(completions)
+            else:
+                with WriteBehindQueue(db_name, interval=interval) as queue:
+                    for name, day in completions:
+                        queue.submit(name, day)
+                flushes = queue.flushes
+            elapsed = time.perf_counter() - start
+            assert verify_streaks(db) == []
+            db.close()
+            print(f"{mode:<13} {len(completions):,} completions: {len(completions) / elapsed:,.0f}/s, {flushes:,} transactions")
+
+
+def bench_archive(habits=2_000, days=3 * 365, completion_rate=0.9, keep_days=90):
+    """
+    Rows, file size (after VACUUM) and read times before and after archive_completions compressed
+    all but the last `keep_days` days into runs. The results must be identical.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "archive.db")
+        db = get_db(path)
+        _fill_random_tracker(db, habits, days, completion_rate)
+        rebuild_streaks(db)
+        before = date(2022, 1, 1) + timedelta(days=days - keep_days)
+        results = []
+        for label in ("row per day", "archived"):
+            if label == "archived":
+                start = time.perf_counter()
+                archived, runs = archive_completions(db, before)
+                print(f"archive_completions: {archived:,} completions into {runs:,} runs in {time.perf_counter() - start:.2f}s")
+            db.execute("VACUUM")
+            db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            rows = db.execute("SELECT COUNT(*) FROM tbl_tracker").fetchone()[0]
+            start = time.perf_counter()
+            results.append(history_stats(db))
+            stats_time = time.perf_counter() - start
+            lookup = _timeit(lambda: get_habit_tracking_data(db, "habit 7"), repeat=50)
+            print(f"{label:<12} {rows:,} tracker rows, {os.path.getsize(path) / 2**20:.1f} MB, "
+                  f"history_stats {stats_time:.2f}s, get_habit_tracking_data {lookup:,.0f} µs")
+        assert results[0] == results[1]
+        db.close()
+
+
+def bench_storage(habits=2_000, days=3 * 365, completion_rate=0.9, writes=1_000):
+    """
+    File size (after VACUUM), read times and write latency of the "rows" and "runs" storage engines on the
+    same history. Writes append the next day, or backdate a day before the history, to `writes` habits.
+    """
+    first_day = date(2022, 1, 1)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage in STORAGE_ENGINES:
+            path = os.path.join(tmp, f"{storage}.db")
+            db = get_db(path)
+            _fill_random_tracker(db, habits, days, completion_rate, first_day)
+            rebuild_streaks(db)
+            set_storage(db, storage)
+            db.execute("VACUUM")
+            db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            size = os.path.getsize(path) / 2**20
+            start = time.perf_counter()
+            results.append(history_stats(db))
+            stats_time = time.perf_counter() - start
+            lookup = _timeit(lambda: get_habit_tracking_data(db, "habit 7"), repeat=50)
+            latencies = {}
+            for label, day in (("append", first_day + timedelta(days=days)), ("backdated", first_day - timedelta(days=2))):
+                start = time.perf_counter()
+                with redirect_stdout(StringIO()):
+                    for number in range(writes):
+                        increment_habit(db, f"habit {number}", day)
+                latencies[label] = (time.perf_counter() - start) / writes * 1e6
+            assert verify_streaks(db) == []
+            db.close()
+            print(f"{storage:<5} {size:.1f} MB, history_stats {stats_time:.2f}s, get_habit_tracking_data {lookup:,.0f} µs, "
+                  f"increment_habit append {latencies['append']:,.0f} µs, backdated {latencies['backdated']:,.0f} µs")
+    assert results[0] == results[1]
+
+
+def bench_query_cache(habits=10_000):
+    """get_all_habits and streak_table without cache, served from a warm cache, and after a write to one habit."""
+    from analyse import streak_table
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.db")
+        db = get_db(path)
+        _fill_random_tracker(db, habits, 30)
+        rebuild_streaks(db)
+        db.close()
+        for cache in (False, True):
+            db = get_db(path, cache=cache)
+            label = "cached" if cache else "uncached"
+            get_all_habits(db), streak_table(db)  # the first reads fill the cache
+            rows = _timeit(lambda: get_all_habits(db), repeat=50)
+            table = _timeit(lambda: streak_table(db), repeat=50)
+            line = f"{label:<8} get_all_habits {rows:,.0f} µs, streak_table {table:,.0f} µs"
+            if cache:
+                day = iter(date(2030, 1, 1) + timedelta(days=offset) for offset in range(10_000))
+                with redirect_stdout(StringIO()):
+                    write = _timeit(lambda: increment_habit(db, "habit 7", next(day)), repeat=50)
+                    refresh = _timeit(lambda: (increment_habit(db, "habit 7", next(day)), get_all_habits(db)), repeat=50) - write
+                line += f", get_all_habits after writing one habit {refresh:,.0f} µs, {db.query_cache.stats()}"
+            print(line)
+            db.close()
+
+
+def bench_profiling(habits=10_000, writes=1_000):
+    """Cost of the instrumentation: hot paths with profiling disabled and enabled."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "profile.db")
+        db = get_db(path)
+        _fill_random_tracker(db, habits, 30)
+        rebuild_streaks(db)
+        db.close()
+        for enabled in (False, True):
+            profiler = profiling.enable() if enabled else None
+            db = get_db(path)
+            day = iter(date(2030, 1, 1) + timedelta(days=offset) for offset in range(writes))
+            with redirect_stdout(StringIO()):
+                write = _timeit(lambda: increment_habit(db, f"habit {int(enabled)}", next(day)), repeat=writes)
+            db.commit()
+            rows = _timeit(lambda: get_all_habits(db), repeat=50)
+            tracking = _timeit(lambda: get_habit_tracking_data(db, "habit 7"), repeat=200)
+            db.close()
+            profiling.disable()
+            print(f"profiling {'enabled' if enabled else 'disabled':<8} increment_habit {write:,.0f} µs, "
+                  f"get_all_habits {rows:,.0f} µs, get_habit_tracking_data {tracking:,.0f} µs")
+        print(profiler.report(top=5))
+
+
+def _hard_delete(db, name):
+    """The former delete_habit: the habit and all its completions in one transaction."""
+    habit_id = db.execute("SELECT id FROM tbl_habit WHERE user_id = 0 AND name = ?", (name,)).fetchone()[0]
+    db.execute("DELETE FROM tbl_tracker WHERE habit_id = ?", (habit_id,))
+    db.execute("DELETE FROM tbl_completion_runs WHERE habit_id = ?", (habit_id,))
+    db.execute("DELETE FROM tbl_habit WHERE id = ?", (habit_id,))
+    db.commit()
+
+
+def _writer_latencies(path, stop):
+    """Record one completion per transaction on its own connection until `stop` is set, returns the latencies in ms."""
+    db = get_db(path)
+    latencies, day = [], date(2030, 1, 1)
+    while not stop.is_set():
+        start = time.perf_counter()
+        record_completions(db, [(0, "habit 1", day)])
+        db.commit()
+        latencies.append((time.perf_counter() - start) * 1e3)
+        day += timedelta(days=1)
+        time.sleep(0.001)
+    db.close()
+    return latencies
+
+
+def bench_delete(rows=10_000_000, share=0.1):
+    """
+    Delete `share` of the habits of a synthetic tracker with `rows` completions, with the former
+    delete_habit per habit and with delete_habits followed by purge_in_background, while another
+    connection keeps writing completions.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    with tempfile.TemporaryDirectory() as tmp:
+        base = os.path.join(tmp, "base.db")
+        db = get_db(base)
+        habits = synthetic.generate(db, rows)
+        db.close()
+        names = [f"habit {n}" for n in range(0, habits, round(1 / share))]
+        print(f"{rows:,} completions, deleting {len(names):,} of {habits:,} habits")
+        for method in ("hard", "soft"):
+            path = os.path.join(tmp, f"{method}.db")
+            shutil.copy(base, path)
+            db = get_db(path)
+            stop = threading.Event()
+            with ThreadPoolExecutor(1) as pool:
+                writer = pool.submit(_writer_latencies, path, stop)
+                time.sleep(0.1)
+                start = time.perf_counter()
+                if method == "hard":
+                    for name in names:
+                        _hard_delete(db, name)
+                    line = f"delete_habit per habit {time.perf_counter() - start:.2f} s"
+                else:
+                    delete_habits(db, names)
+                    hidden = time.perf_counter() - start
+                    left = db.execute("SELECT COUNT(*) FROM tbl_habit_tombstones d JOIN tbl_tracker t ON t.habit_id = d.habit_id").fetchone()[0]
+                    purge_in_background(path).join()
+                    line = (f"delete_habits {hidden * 1e3:,.0f} ms, "
+                            f"purge_in_background of {left:,} rows {time.perf_counter() - start - hidden:.2f} s")
+                stop.set()
+                latencies = sorted(writer.result())
+            print(f"{method}: {line}, concurrent writes {len(latencies):,}, "
+                  f"p99 {latencies[int(len(latencies) * 0.99)]:,.1f} ms, max {latencies[-1]:,.1f} ms")
+            db.close()
+
+
+def bench_check_in(habits=50, days=100):
+    """A day of `habits` check-ins: one increment_habit per habit against one check_in call."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db = get_db(os.path.join(tmp, "check_in.db"))
+        names = [f"habit {n}" for n in range(habits)]
+        db.executemany("INSERT INTO tbl_habit (name, frequency) VALUES (?, 'daily')", ((name,) for name in names))
+        db.commit()
+        day = iter(date(2024, 1, 1) + timedelta(days=offset) for offset in range(2 * days))
+        with redirect_stdout(StringIO()):
+            single = _timeit(lambda: [increment_habit(db, name, today) for today in [next(day)] for name in names], repeat=days)
+        batch = _timeit(lambda: check_in(db, names, next(day)), repeat=days)
+        print(f"{habits} check-ins per day: increment_habit per habit {single / 1e3:,.2f} ms, check_in {batch / 1e3:,.2f} ms")
+        db.close()
+
+
+def _scan_due(db, today, user_id=None):
+    """Due habits as found before next_due: every habit of the user (or of all users) is read and checked in Python."""
+    today = day_number(today)
+    rows = db.execute("SELECT name, frequency, last_completed FROM tbl_habit" + ("" if user_id is None else " WHERE user_id = ?"),
+                      () if user_id is None else (user_id,))
+    return [name for name, frequency, last_completed in rows
+            if last_completed is None or period_of(frequency, day_number(last_completed)) < period_of(frequency, today)]
+
+
+def bench_due(users=100_000, habits_per_user=10, due_share=0.02, writes=1_000):
+    """
+    Due habits of all users and of one user from the next_due index against reading every habit,
+    and increment_habit with and without the next_due indexes.
+    """
+    today = date(2024, 6, 12)
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = get_db(os.path.join(tmp, "due.db"))
+        db.executemany("INSERT INTO tbl_habit (user_id, name, frequency, last_completed) VALUES (?, ?, 'daily', ?)",
+                       ((user, f"habit {n}", (today - timedelta(days=rng.randint(1, 30) if rng.random() < due_share else 0)).isoformat())
+                        for user in range(users) for n in range(habits_per_user)))
+        db.commit()
+        due = len(get_due_habits(db, today, user_id=None))
+        assert sorted(name for _, name, *_ in get_due_habits(db, today, user_id=None)) == sorted(_scan_due(db, today))
+        indexed = _timeit(lambda: get_due_habits(db, today, user_id=None), repeat=20)
+        scan = _timeit(lambda: _scan_due(db, today), repeat=3)
+        print(f"{due:,} of {users * habits_per_user:,} habits due: next_due index {indexed / 1e3:,.2f} ms, "
+              f"reading every habit {scan / 1e3:,.0f} ms")
+        user = _timeit(lambda: due_habits(db, today, user_id=42), repeat=200)
+        user_scan = _timeit(lambda: _scan_due(db, today, 42), repeat=200)
+        print(f"one user: due_habits {user:,.0f} µs, reading the user's habits {user_scan:,.0f} µs")
+        day = iter(today + timedelta(days=offset) for offset in range(1, 3 * writes))
+        with redirect_stdout(StringIO()):
+            write = _timeit(lambda: increment_habit(db, "habit 3", next(day), 7), repeat=writes)
+            db.execute("DROP INDEX idx_habit_user_due")
+            db.execute("DROP INDEX idx_habit_due")
+            unindexed = _timeit(lambda: increment_habit(db, "habit 3", next(day), 7), repeat=writes)
+        print(f"increment_habit with the next_due indexes {write:,.0f} µs, without {unindexed:,.0f} µs")
+        db.close()
+
+
+def _import_times(statement, repeat=5):
+    """
+    Run `statement` in fresh interpreters with -X importtime.
+    Returns the best total import time in ms and the set of imported top-level packages.
+    """
+    best, packages = None, set()
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                                capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        total = 0
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if not name.startswith("  "):  # top level import, its cumulative time includes all nested ones
+                total += int(cumulative)
+            packages.add(name.strip().split(".")[0])
+        best = total if best is None else min(best, total)
+    return best / 1000, packages
+
+
+def bench_startup(budget_ms=None):
+    """
+    Import time of the tracker (what every CLI command pays) next to matplotlib's.
+    Raises AssertionError if starting the tracker imports matplotlib, or takes longer than `budget_ms`.
+    """
+    startup, packages = _import_times("import main, cli")
+    plotting, _ = _import_times("import matplotlib.pyplot")
+    print(f"startup imports: {startup:,.0f} ms (matplotlib.pyplot alone: {plotting:,.0f} ms)")
+    assert "matplotlib" not in packages, "starting the tracker imports matplotlib"
+    if budget_ms is not None:
+        assert startup <= budget_ms, f"startup imports took {startup:.0f} ms, budget {budget_ms} ms"
+    return startup
+
+
+SUITE_SCALES = (1_000, 100_000, 1_000_000)  # completions, up to 10M with --rows 10000000
+REGRESSION_RATIO = 1.25  # a median this much slower than in the baseline is reported,
+REGRESSION_MIN_US = 100  # if it also lost at least this many µs, sub-millisecond timings are noisy
+
+
+def _samples(func, repeat):
+    """Runtimes of func(0) ... func(repeat - 1) in microseconds."""
+    samples = []
+    for number in range(repeat):
+        start = time.perf_counter()
+        func(number)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return samples
+
+
+def _summary(samples):
+    samples = sorted(samples)
+    return {"runs": len(samples), "mean_us": sum(samples) / len(samples), "median_us": samples[len(samples) // 2],
+            "min_us": samples[0], "p95_us": samples[min(int(len(samples) * 0.95), len(samples) - 1)]}
+
+
+def suite_scale(rows, repeat=20, seed=1):
+    """
+    Time the hot paths on a database generated with `rows` completions. Writes go to distinct habits,
+    increment_habit appends the day after the generated history. Returns {operation: summary}.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        db = get_db(os.path.join(tmp, "suite.db"))
+        habits = synthetic.generate(db, rows, seed)
+        names = [row[0] for row in db.execute("SELECT name FROM tbl_habit ORDER BY total_completions, id")]
+        typical = names[len(names) // 2]  # median history length
+        day = date(2025, 1, 1)
+        results = {"habits": habits}
+        timings = {
+            "get_all_habits": lambda _: get_all_habits(db),
+            "get_habit_tracking_data": lambda _: get_habit_tracking_data(db, typical),
+            "streak_table": lambda _: select_streaks(streak_table(db)),  # the data of plot_streaks_as_table
+            "increment_habit": lambda n: increment_habit(db, names[n % habits], day + timedelta(days=n // habits)),
+            "delete_habit": lambda n: delete_habit(db, names[-1 - n % habits]),
+        }
+        with redirect_stdout(StringIO()):
+            for operation, func in timings.items():
+                results[operation] = _summary(_samples(func, min(repeat, habits) if operation == "delete_habit" else repeat))
+        db.close()
+    return results
+
+
+def compare_results(baseline, results, ratio=REGRESSION_RATIO):
+    """
+    Operations whose median got more than `ratio` times and REGRESSION_MIN_US slower,
+    as (rows, operation, before µs, after µs) tuples.
+    """
+    regressions = []
+    for rows, operations in results["scales"].items():
+        for operation, summary in operations.items():
+            before = baseline.get("scales", {}).get(rows, {}).get(operation)
+            if (isinstance(summary, dict) and before and summary["median_us"] > before["median_us"] * ratio
+                    and summary["median_us"] - before["median_us"] >= REGRESSION_MIN_US):
+                regressions.append((int(rows), operation, before["median_us"], summary["median_us"]))
+    return regressions
+
+
+def run_suite(scales=SUITE_SCALES, repeat=20, seed=1, output=None, baseline=None):
+    """
+    Run suite_scale for every scale and print the medians. With `output`, the results are written
+    there as JSON; with `baseline`, a JSON file of an earlier run, regressions are printed and returned.
+    """
+    results = {"created": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+               "sqlite": sqlite3.sqlite_version, "seed": seed, "repeat": repeat, "scales": {}}
+    for rows in scales:
+        scale = suite_scale(rows, repeat, seed)
+        results["scales"][str(rows)] = scale
+        print(f"{rows:>12,} rows, {scale['habits']:,} habits: " +
+              ", ".join(f"{operation} {summary['median_us']:,.0f} µs" for operation, summary in scale.items() if operation != "habits"))
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    regressions = []
+    if baseline:
+        with open(baseline, encoding="utf-8") as f:
+            regressions = compare_results(json.load(f), results)
+        for rows, operation, before, after in regressions:
+            print(f"regression at {rows:,} rows: {operation} {before:,.0f} µs -> {after:,.0f} µs")
+    return results, regressions
+
+
+def bench_all():
+    bench_tracker_lookups()
+    bench_streak_engine()
+    bench_bulk_ingest()
+    bench_habit_memory()
+    bench_report()
+    bench_activity()
+    bench_parallel()
+    bench_multi_user()
+    bench_server()
+    bench_write_behind()
+    bench_archive()
+    bench_storage()
+    bench_query_cache()
+    bench_profiling()
+    bench_delete()
+    bench_check_in()
+    bench_due()
+    bench_startup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Habit tracker benchmarks")
+    parser.add_argument("command", nargs="?", choices=["all", "suite"], default="all",
+                        help="all: every bench_* function (default), suite: the hot path suite")
+    parser.add_argument("--rows", type=int, nargs="+", default=SUITE_SCALES, help="completions per suite scale")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per operation and scale (default: 20)")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the synthetic data (default: 1)")
+    parser.add_argument("--json", metavar="FILE", help="write the suite results to FILE")
+    parser.add_argument("--compare", metavar="FILE", help="report regressions against the results in FILE")
+    args = parser.parse_args()
+    if args.command == "suite":
+        _, regressions = run_suite(args.rows, args.repeat, args.seed, args.json, args.compare)
+        sys.exit(1 if regressions else 0)
+    bench_all()
@@ -0,0 +1,127 @@
+"""
+In-memory cache of read results for one connection, invalidated by data versions.
+
+Caching is enabled with get_db(cache=True). Every write of db.py, and Habit.reset_streak, bumps the
+version of the habits it changed, and the version of the user's habit list when habits are added or
+deleted. get_all_habits then re-reads only the rows of the habits whose version changed, and streak
+summaries (analyse.streak_table) are computed again once a habit of their user changed.
+Commits of other connections, in other threads or processes, are detected with PRAGMA data_version
+and drop everything that is cached. Writes with plain SQL on a cached connection must call touch(db).
+
+    db = get_db(cache=True)
+    get_all_habits(db)  # reads the table
+    get_all_habits(db)  # served from memory
+    db.query_cache.stats()
+"""
+from collections import OrderedDict, defaultdict
+
+
+class QueryCache:
+    """The cached results of one connection and the versions they were read at."""
+
+    def __init__(self, db, max_results=256):
+        self.max_results = max_results
+        self.hits = 0  # reads served from memory only
+        self.misses = 0  # reads that had to query the database
+        self.refreshed = 0  # habits re-read by get_all_habits after they were written
+        self._data_version = self._external_version(db)
+        self._clear()
+
+    def _clear(self):
+        self._habit_versions = defaultdict(int)  # habit_id -> version
+        self._list_versions = defaultdict(int)  # user_id -> version of the set of habits of the user
+        self._user_versions = defaultdict(int)  # user_id -> version of any habit of the user
+        self._stale = set()  # habit ids written since their cached row was read
+        self._rows = {}  # user_id -> (list version, {habit_id: position}, rows ordered by name)
+        self._results = OrderedDict()  # key -> (user version, value), least recently used first
+
+    @staticmethod
+    def _external_version(db):
+        return db.execute("PRAGMA data_version").fetchone()[0]
+
+    def _sync(self, db):
+        """Drop everything if another connection committed since the last read."""
+        version = self._external_version(db)
+        if version != self._data_version:
+            self._data_version = version
+            self._clear()
+
+    def habit_version(self, habit_id):
+        """Number of writes to a habit seen by this cache."""
+        return self._habit_versions[habit_id]
+
+    def touch(self, habit_ids=None, user_id=None, listing=False):
+        """
+        Record a write to `habit_ids` of `user_id`. None stands for all habits or all users.
+        `listing` marks writes that add or delete habits.
+        """
+        if habit_ids is None or (listing and user_id is None):
+            self._clear()
+            return
+        for habit_id in habit_ids:
+            self._habit_versions[habit_id] += 1
+            self._stale.add(habit_id)
+        for user in self._user_versions.keys() | self._list_versions.keys() if user_id is None else (user_id,):
+            self._user_versions[user] += 1
+            if listing:
+                self._list_versions[user] += 1
+        if user_id is None:
+            self._results.clear()  # the users of the habits are not known
+
+    def habit_rows(self, db, user_id, load_all, load_ids):
+        """
+        The habit rows of a user ordered by name, as tuples without their leading habit id.
+        load_all() returns all rows of the user, load_ids(ids) those of the given habits, both with the id first.
+        """
+        self._sync(db)
+        entry = self._rows.get(user_id)
+        if entry is None or entry[0] != self._list_versions[user_id]:
+            self.misses += 1
+            rows = sorted((tuple(row) for row in load_all()), key=lambda row: row[1])
+            positions = {row[0]: position for position, row in enumerate(rows)}
+            self._stale -= positions.keys()
+            entry = (self._list_versions[user_id], positions, [row[1:] for row in rows])
+            self._rows[user_id] = entry
+        else:
+            _, positions, rows = entry
+            stale = [habit_id for habit_id in self._stale if habit_id in positions]
+            if stale:
+                self.misses += 1
+                self.refreshed += len(stale)
+                for row in load_ids(stale):
+                    rows[positions[row[0]]] = tuple(row)[1:]
+                self._stale.difference_update(stale)
+            else:
+                self.hits += 1
+        return list(entry[2])
+
+    def result(self, db, key, user_id, compute):
+        """Return the cached value of `key`, a summary of the habits of `user_id`, or compute() and cache it."""
+        self._sync(db)
+        version = self._user_versions[user_id]
+        cached = self._results.get(key)
+        if cached is not None and cached[0] == version:
+            self.hits += 1
+            self._results.move_to_end(key)
+            return cached[1]
+        self.misses += 1
+        value = compute()
+        self._results[key] = (version, value)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+        return value
+
+    def stats(self):
+        """Hit and miss counters, for monitoring."""
+        reads = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "refreshed_habits": self.refreshed,
+                "hit_rate": self.hits / reads if reads else 0.0, "cached_results": len(self._results),
+                "cached_users": len(self._rows)}
+
+
+def touch(db, habit_ids=None, user_id=None, listing=False):
+    """Record a write on `db` in its cache, if it has one. See QueryCache.touch."""
+    cache = getattr(db, "query_cache", None)
+    if cache is not None:
+        cache.touch(habit_ids, user_id, listing)
@@ -0,0 +1,357 @@
+"""
+Non-interactive command line interface for scripts and cron jobs.
+
+    python main.py add "Reading" "Gym training" --frequency daily
+    python main.py done "Reading" "Gym training"
+    python main.py done "Reading" --date 2024-11-30
+    python main.py done --due
+    python main.py due --overdue
+    python main.py list --json
+    python main.py stats
+    python main.py stats --plot streaks.png
+    python main.py report --sort longest --top 100 --frequency daily --page 2
+    python main.py report --output report.html
+    python main.py activity "Reading" --days 730 --heatmap reading.png
+    python main.py delete "Gym training"
+    python main.py export tracker tracker.csv.gz
+    python main.py import tracker tracker.csv.gz
+    python main.py verify
+    python main.py serve --port 8080
+    python main.py rebuild --workers 8
+    python main.py archive --days 365
+    python main.py storage runs
+    python main.py purge
+    python main.py stats --profile --profile-output profile.prom
+
+Every command accepts --db (default: habits.db) and --json for machine readable output, and
+--user to work on the habits of one user. With --shards N, users are spread over N database files
+and each command opens the file of --user; verify and rebuild check that whole file.
+--profile prints where the command spent its time in the database to stderr, --profile-output writes it to a file.
+Commands that take several habits handle them in one process and one transaction.
+Without arguments, main.py starts the interactive menu.
+"""
+import argparse
+import json
+import sys
+from contextlib import redirect_stdout
+from datetime import date, timedelta
+
+import profiling
+from db import (ARCHIVE_DAYS, DEFAULT_USER, PURGE_CHUNK_SIZE, STORAGE_ENGINES, archive_completions, bulk_add_habits, check_in,
+                delete_habits, due_habits, get_db, get_due_habits, get_habit, get_habit_rows, get_storage, purge_deleted, rebuild_streaks,
+                set_storage, shard_name, verify_streaks)
+
+FREQUENCIES = ["daily", "weekly", "monthly", "yearly"]
+RATE_WINDOWS = (7, 30, 365)
+WORKERS_HELP = "analyse the habits in N processes (default: 1)"
+
+
+def _output(args, data, lines):
+    """Print `data` as JSON with --json, otherwise the text `lines`."""
+    if args.json:
+        print(json.dumps(data, ensure_ascii=False, default=str), file=args.out)
+    else:
+        for line in lines:
+            print(line, file=args.out)
+
+
+def cmd_add(db, args):
+    existing = [name for name in args.names if get_habit(db, name=name, user_id=args.user) is not None]
+    added = bulk_add_habits(db, [(name, args.frequency) for name in args.names], user_id=args.user)
+    _output(args, {"added": added, "existing": existing},
+            [f"Habit '{name}' already exists." for name in existing] + [f"Added {added} habits with frequency '{args.frequency}'."])
+    return 0
+
+
+def cmd_done(db, args):
+    names = args.names + [name for name in due_habits(db, args.date, "daily", args.user) if name not in args.names] if args.due else args.names
+    completed_date = args.date or date.today()
+    results = check_in(db, names, completed_date, args.user)
+    unknown = [name for name, streak in results.items() if streak is False]
+    recorded = sum(streak is not None and streak is not False for streak in results.values())
+    _output(args, {"date": completed_date, "recorded": recorded, "unknown": unknown},
+            [f"Habit '{name}' does not exist." for name in unknown] + [f"Marked {recorded} habits as completed on {completed_date}."])
+    return 1 if unknown else 0
+
+
+def cmd_list(db, args):
+    habits = [dict(zip(["id", "name", "frequency", "streak", "completed", "last_completed"], row)) for row in get_habit_rows(db, args.user)]
+    _output(args, habits,
+            [f"Habit: {h['name']}, Frequency: {h['frequency']}, Completed: {h['completed']}, Streak: {h['streak']}, "
+             f"Last Completed: {h['last_completed']}" for h in habits])
+    return 0
+
+
+def cmd_due(db, args):
+    rows = get_due_habits(db, args.date, args.overdue, None if args.all_users else args.user, args.frequency)
+    habits = [dict(zip(["user_id", "name", "frequency", "last_completed", "next_due"], row)) for row in rows]
+    _output(args, habits,
+            [f"Habit: {h['name']}, Frequency: {h['frequency']}, "
+             + (f"Due since: {h['next_due']}" if h["next_due"] else "Never completed")
+             + (f", User: {h['user_id']}" if args.all_users else "") for h in habits])
+    return 0
+
+
+def cmd_stats(db, args):
+    from analyse import PLOT_ROWS, get_streaks
+    streaks = get_streaks(db, user_id=args.user)
+    _output(args, [habit._asdict() for habit in streaks],
+            [f"{'Habit':<20} {'Total':<10} {'Current':<10} {'Longest':<10}", "=" * 50] +
+            [f"{habit.name:<20} {habit.total:<10} {habit.current:<10} {habit.longest:<10}" for habit in streaks])
+    if args.plot is not None:
+        from render import render_table
+        # the figure grows with its rows, draw the first PLOT_ROWS habits like plot_streaks_as_table
+        title = "Habit Streak Summary" if len(streaks) <= PLOT_ROWS else \
+            f"Habit Streak Summary (first {PLOT_ROWS} of {len(streaks):,} habits)"
+        render_table([(habit.name, habit.total, habit.current, habit.longest) for habit in streaks[:PLOT_ROWS]],
+                     ["Habit", "Total", "Current", "Longest"], title, args.plot or None)
+    return 0
+
+
+def cmd_report(db, args):
+    from analyse import page_count, select_streaks, streak_table
+    from render import render_report
+    table = streak_table(db, frequency=args.frequency, user_id=args.user)
+    matched = len(table["name"]) if args.top is None else min(args.top, len(table["name"]))
+    pages = page_count(matched, args.page_size)
+    streaks = select_streaks(table, sort=args.sort, top=args.top, page=args.page, page_size=args.page_size)
+    footer = f"Page {args.page} of {pages} ({matched:,} habits)"
+    if args.json:
+        _output(args, {"page": args.page, "pages": pages, "habits": matched, "rows": [habit._asdict() for habit in streaks]}, [])
+        return 0
+    report = render_report([tuple(habit) for habit in streaks], ["Habit", "Frequency", "Total", "Current", "Longest"],
+                           "Habit Streak Report", args.output, footer)
+    _output(args, None, [f"Wrote {len(streaks)} habits to {args.output}." if args.output else report])
+    return 0
+
+
+def cmd_activity(db, args):
+    import activity
+    end = args.end or date.today()
+    start = end - timedelta(days=args.days - 1)
+    habits = [get_habit(db, name=name, user_id=args.user) for name in args.names] or get_habit_rows(db, args.user)
+    unknown = [name for name, habit in zip(args.names, habits) if habit is None]
+    habit_ids = [habit[0] for habit in habits if habit is not None]
+    names = {habit[0]: habit[1] for habit in habits if habit is not None}
+    matrix = activity.completion_matrix(db, start, end, habit_ids, workers=args.workers)
+    rates = activity.completion_rates(matrix, RATE_WINDOWS)
+    histogram = activity.weekday_histogram(matrix)
+    rows = [{"name": names[habit_id], **{f"rate_{window}d": round(float(rates[window][row]), 3) for window in RATE_WINDOWS},
+             "weekdays": dict(zip(activity.WEEKDAYS, histogram[row].tolist()))}
+            for row, habit_id in enumerate(matrix.habit_ids.tolist())]
+    _output(args, {"start": start, "end": end, "habits": rows, "unknown": unknown},
+            [f"Habit '{name}' does not exist." for name in unknown] +
+            [f"Completion rates and weekdays from {start} to {end}:"] +
+            [f"{row['name']:<20} " + " ".join(f"{window}d {row[f'rate_{window}d']:>6.1%}" for window in RATE_WINDOWS) + "  " +
+             " ".join(f"{day} {count}" for day, count in row["weekdays"].items()) for row in rows])
+    if args.heatmap is not None:
+        from render import render_heatmap
+        single = len(matrix.habit_ids) == 1 and args.names
+        title = f"{rows[0]['name']}, {start} to {end}" if single else f"All habits, {start} to {end}"
+        render_heatmap(activity.calendar_heatmap(matrix, 0 if single else None), start, title, args.heatmap or None)
+    return 1 if unknown else 0
+
+
+def cmd_delete(db, args):
+    unknown = [name for name in args.names if get_habit(db, name=name, user_id=args.user) is None]
+    deleted = delete_habits(db, args.names, args.user)
+    purge_deleted(db)  # in small transactions, other writers are not blocked by long histories
+    _output(args, {"deleted": deleted, "unknown": unknown},
+            [f"Habit '{name}' does not exist." for name in unknown] + [f"Deleted {deleted} habits."])
+    return 1 if unknown else 0
+
+
+def cmd_transfer(db, args):
+    import transfer
+    progress = transfer.Progress(f"{args.command} {args.table}")
+    if args.command == "export":
+        count = transfer.export_table(db, args.table, args.path, progress, args.user)
+        lines = [f"Exported {count:,} rows to {args.path}."]
+    else:
+        count = transfer.import_table(db, args.table, args.path, progress, args.user)
+        lines = [f"Imported {count:,} new rows from {args.path}."]
+    progress.report()
+    _output(args, {"rows": count, "path": args.path}, lines)
+    return 0
+
+
+def cmd_verify(db, args):
+    mismatches = verify_streaks(db, workers=args.workers)
+    _output(args, [{"name": name, "stored": stored, "expected": expected} for name, stored, expected in mismatches],
+            [f"{name}: stored {stored}, expected {expected}" for name, stored, expected in mismatches] +
+            [f"{len(mismatches)} habits with inconsistent streaks."])
+    return 1 if mismatches else 0
+
+
+def cmd_rebuild(db, args):
+    rebuilt = rebuild_streaks(db, workers=args.workers)
+    _output(args, {"rebuilt": rebuilt}, [f"Rebuilt the streaks of {rebuilt} habits."])
+    return 0
+
+
+def cmd_archive(db, args):
+    before = date.today() - timedelta(days=args.days)
+    archived, runs = archive_completions(db, before)
+    _output(args, {"archived": archived, "runs": runs, "before": before},
+            [f"Archived {archived} completions before {before} into {runs} runs."])
+    return 0
+
+
+def cmd_purge(db, args):
+    purged = purge_deleted(db, args.chunk_size)
+    _output(args, {"purged": purged}, [f"Removed {purged} rows of completions of deleted habits."])
+    return 0
+
+
+def cmd_storage(db, args):
+    converted = set_storage(db, args.engine) if args.engine else 0
+    rows, runs = (db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in ("tbl_tracker", "tbl_completion_runs"))
+    storage = get_storage(db)
+    _output(args, {"storage": storage, "converted": converted, "rows": rows, "runs": runs},
+            [f"Storage: {storage}, {rows} completion rows and {runs} runs."])
+    return 0
+
+
+def _positive(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+    return number
+
+
+def cmd_serve(db, args):
+    import asyncio
+    from server import serve
+    db.close()  # the server opens its own connections
+    try:
+        asyncio.run(serve(args.db, args.host, args.port, args.readers))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--db", default="habits.db", help="database file (default: habits.db)")
+    common.add_argument("--json", action="store_true", help="print JSON instead of text")
+    common.add_argument("--user", type=int, default=DEFAULT_USER, help="id of the user whose habits are used (default: 0)")
+    common.add_argument("--shards", type=_positive, default=1,
+                        help="users are spread over N database files named after --db, e.g. habits.3.db (default: 1)")
+    common.add_argument("--profile", action="store_true", help="print the time spent in db.py and in each SQL statement to stderr")
+    common.add_argument("--profile-output", metavar="FILE",
+                        help="write the profile to FILE, as JSON if it ends in .json, otherwise in the Prometheus text format")
+
+    parser = argparse.ArgumentParser(prog="habit", description="Track habits from the command line.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", parents=[common], help="add habits")
+    add.add_argument("names", nargs="+")
+    add.add_argument("--frequency", choices=FREQUENCIES, default="daily")
+    add.set_defaults(func=cmd_add)
+
+    done = commands.add_parser("done", parents=[common], help="mark habits as completed")
+    done.add_argument("names", nargs="*")
+    done.add_argument("--date", type=date.fromisoformat, help="YYYY-MM-DD, default: today")
+    done.add_argument("--due", action="store_true", help="also every daily habit that is not completed on that day yet")
+    done.set_defaults(func=cmd_done)
+
+    commands.add_parser("list", parents=[common], help="list all habits").set_defaults(func=cmd_list)
+    due = commands.add_parser("due", parents=[common], help="list the habits not completed in their current period")
+    due.add_argument("--date", type=date.fromisoformat, help="YYYY-MM-DD, default: today")
+    due.add_argument("--overdue", action="store_true", help="only habits that missed a whole period")
+    due.add_argument("--frequency", choices=FREQUENCIES)
+    due.add_argument("--all-users", action="store_true", help="the habits of every user in the database file")
+    due.set_defaults(func=cmd_due)
+    stats = commands.add_parser("stats", parents=[common], help="show total, current and longest streaks")
+    stats.add_argument("--plot", nargs="?", const="", metavar="FILE",
+                       help="also draw the table, saved to FILE (.png, .svg) if given, otherwise shown in a window")
+    stats.set_defaults(func=cmd_stats)
+
+    report = commands.add_parser("report", parents=[common], help="paginated streak report for many habits")
+    report.add_argument("--sort", choices=["name", "total", "current", "longest"], default="name",
+                        help="order by name or by a streak, highest first (default: name)")
+    report.add_argument("--top", type=_positive, help="only the N first habits in that order")
+    report.add_argument("--frequency", choices=FREQUENCIES, help="only habits with this frequency")
+    report.add_argument("--page", type=_positive, default=1)
+    report.add_argument("--page-size", type=_positive, default=50)
+    report.add_argument("--output", metavar="FILE", help="write to FILE, .html, .png or .svg render HTML or an image, default: text on stdout")
+    report.set_defaults(func=cmd_report)
+
+    activity = commands.add_parser("activity", parents=[common], help="completion rates, weekdays and calendar heatmap")
+    activity.add_argument("names", nargs="*", help="habits to analyse (default: all)")
+    activity.add_argument("--days", type=_positive, default=365, help="length of the range in days (default: 365)")
+    activity.add_argument("--end", type=date.fromisoformat, help="last day of the range, YYYY-MM-DD, default: today")
+    activity.add_argument("--heatmap", nargs="?", const="", metavar="FILE",
+                          help="draw a calendar heatmap of one habit or of all, saved to FILE (.png, .svg) if given")
+    activity.add_argument("--workers", type=_positive, default=1, help=WORKERS_HELP)
+    activity.set_defaults(func=cmd_activity)
+
+    delete = commands.add_parser("delete", parents=[common], help="delete habits and their completions")
+    delete.add_argument("names", nargs="+")
+    delete.set_defaults(func=cmd_delete)
+
+    for command in ("import", "export"):
+        sub = commands.add_parser(command, parents=[common], help=f"{command} habits or completions as CSV/JSONL")
+        sub.add_argument("table", choices=["habits", "tracker"])
+        sub.add_argument("path", help="file name ending in .csv or .jsonl, optionally followed by .gz")
+        sub.set_defaults(func=cmd_transfer)
+
+    verify = commands.add_parser("verify", parents=[common], help="check the stored streaks against the history")
+    verify.add_argument("--workers", type=_positive, default=1, help=WORKERS_HELP)
+    verify.set_defaults(func=cmd_verify)
+    rebuild = commands.add_parser("rebuild", parents=[common], help="recompute the stored streaks")
+    rebuild.add_argument("--workers", type=_positive, default=1, help=WORKERS_HELP)
+    rebuild.set_defaults(func=cmd_rebuild)
+    archive = commands.add_parser("archive", parents=[common], help="compress old completions into runs of days")
+    archive.add_argument("--days", type=_positive, default=ARCHIVE_DAYS,
+                         help=f"keep the completions of the last N days as they are (default: {ARCHIVE_DAYS})")
+    archive.set_defaults(func=cmd_archive)
+    purge = commands.add_parser("purge", parents=[common], help="remove the completions left by deleted habits")
+    purge.add_argument("--chunk-size", type=_positive, default=PURGE_CHUNK_SIZE,
+                       help=f"rows removed per transaction (default: {PURGE_CHUNK_SIZE})")
+    purge.set_defaults(func=cmd_purge)
+    storage = commands.add_parser("storage", parents=[common], help="show or change how completions are stored")
+    storage.add_argument("engine", nargs="?", choices=STORAGE_ENGINES,
+                         help="rows: one row per completion, runs: one row per run of consecutive days")
+    storage.set_defaults(func=cmd_storage)
+    serve = commands.add_parser("serve", parents=[common], help="run the JSON API over HTTP")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8080)
+    serve.add_argument("--readers", type=_positive, default=4, help="threads and connections for reads (default: 4)")
+    serve.set_defaults(func=cmd_serve)
+    return parser
+
+
+def main(argv=None):
+    """Run one command, returns the exit code."""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "done" and not args.names and not args.due:
+        parser.error("give the names of the habits or --due")
+    if args.command in ("import", "export"):
+        import transfer
+        try:
+            transfer.file_format(args.path)
+        except ValueError as e:
+            parser.error(str(e))
+
+    args.out = sys.stdout
+    if args.profile or args.profile_output:
+        profiling.enable()
+    db = get_db(shard_name(args.db, args.user, args.shards))
+    try:
+        # with --json stdout only carries the JSON document, messages of db.py go to stderr
+        with redirect_stdout(sys.stderr if args.json else sys.stdout):
+            return args.func(db, args)
+    finally:
+        db.close()
+        profiler = profiling.disable()
+        if profiler is not None:
+            if args.profile:
+                print(profiler.report(), file=sys.stderr)
+            if args.profile_output:
+                profiler.dump(args.profile_output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,114 +1,1189 @@
+import heapq
+import json
+import os
+import queue
 import sqlite3
-from datetime import datetime
+import threading
+import time
+import numpy as np
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from itertools import groupby, islice
+from cache import QueryCache, touch
+from profiling import ProfiledConnection, active, profiled
+from periods import day_number, get_calendar, habit_streaks, period_of, streaks_from_periods, to_periods
 
-def get_db(db_name="habits.db"):
+# day number (days since 1970-01-01) of a stored completion date
+DAY_NUMBER_SQL = "CAST(julianday(completed_date) - 2440587.5 AS INTEGER)"
+
+# Applied to every connection. WAL lets readers run while one writer commits,
+# and with WAL synchronous=NORMAL only syncs at checkpoints instead of on every commit.
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "foreign_keys": "ON",  # 确保外键约束开启
+    "busy_timeout": 5000,  # ms to wait for a lock instead of failing with "database is locked"
+    "cache_size": -65536,  # 64 MiB page cache
+    "mmap_size": 268435456,  # 256 MiB
+    "temp_store": "MEMORY",
+}
+
+_schema_ready = set()  # database files whose tables were created or migrated by this process
+_schema_lock = threading.Lock()
+
+
+class Connection(sqlite3.Connection):
+    """sqlite3.Connection that can carry a cache.QueryCache, see get_db."""
+    query_cache = None
+
+
+def connect(db_name="habits.db", check_same_thread=True):
     """
-    Connect to the SQLite database. By default, it creates a database file called "habits.db".
+    Open a connection with the pragmas above, without touching the schema.
+    While profiling is enabled (profiling.enable), the connection records its statements and commits.
     """
-    conn = sqlite3.connect(db_name)
+    conn = sqlite3.connect(db_name, timeout=PRAGMAS["busy_timeout"] / 1000, check_same_thread=check_same_thread,
+                           factory=Connection if active() is None else ProfiledConnection)
     conn.row_factory = sqlite3.Row  # Use Row to access columns by name
-    conn.execute("PRAGMA foreign_keys = ON")  # 确保外键约束开启
-    create_tables(conn)  # Ensure tables are created
+    for pragma, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
     return conn
 
+
+def _ensure_schema(conn, db_name, new_file=False):
+    """Create and migrate the tables once per database file and process."""
+    key = db_name if db_name == ":memory:" else os.path.abspath(db_name)
+    with _schema_lock:
+        if key in _schema_ready and not new_file:
+            return
+        create_tables(conn)  # Ensure tables are created
+        if key != ":memory:":  # every in-memory connection is a new database
+            _schema_ready.add(key)
+
+
+@profiled
+def get_db(db_name="habits.db", check_same_thread=True, cache=False):
+    """
+    Connect to the SQLite database. By default, it creates a database file called "habits.db".
+    With `cache`, get_all_habits and the streak summaries are cached in memory until a write changes them (see cache.py).
+    """
+    new_file = not os.path.exists(db_name)
+    conn = connect(db_name, check_same_thread)
+    _ensure_schema(conn, db_name, new_file)
+    if cache:
+        conn.query_cache = QueryCache(conn)
+    return conn
+
+
+class ConnectionPool:
+    """
+    A small thread-safe pool for one database file: several reader connections that
+    worker threads borrow in turn, and a single writer connection used under a lock.
+    With WAL, readers see the last committed state while the writer records completions.
+
+        pool = ConnectionPool("habits.db", readers=4)
+        with pool.reader() as db:
+            get_all_habits(db)
+        with pool.writer() as db:
+            increment_habit(db, "Reading")
+    """
+
+    def __init__(self, db_name="habits.db", readers=4):
+        self.db_name = db_name
+        self._writer = get_db(db_name, check_same_thread=False)
+        self._write_lock = threading.Lock()
+        self._readers = queue.Queue()
+        for _ in range(readers):
+            conn = connect(db_name, check_same_thread=False)
+            conn.execute("PRAGMA query_only = ON")
+            self._readers.put(conn)
+        self._size = readers
+
+    @contextmanager
+    def reader(self, timeout=None):
+        """Borrow a read-only connection, waits until one is free."""
+        conn = self._readers.get(timeout=timeout)
+        try:
+            yield conn
+        finally:
+            conn.rollback()  # end any open read transaction so the WAL can be checkpointed
+            self._readers.put(conn)
+
+    @contextmanager
+    def writer(self):
+        """Use the writer connection exclusively. Uncommitted changes are committed on exit, or rolled back on error."""
+        with self._write_lock:
+            try:
+                yield self._writer
+                self._writer.commit()
+            except Exception:
+                self._writer.rollback()
+                raise
+
+    def close(self):
+        """Close all connections, the pool can not be used afterwards."""
+        with self._write_lock:
+            self._writer.close()
+        for _ in range(self._size):
+            self._readers.get().close()
+
+
+def shard_name(db_name, user_id, shards):
+    """
+    The database file that holds the data of `user_id` when users are spread over `shards` files:
+    habits.db becomes habits.0.db ... habits.<shards - 1>.db. With a single shard it is `db_name`.
+    """
+    if shards <= 1:
+        return db_name
+    root, extension = os.path.splitext(db_name)
+    return f"{root}.{user_id % shards}{extension}"
+
+
+class UserShards:
+    """
+    Users spread over several database files, so that writes of different users do not wait for
+    the lock of one file. All habits and completions of a user live in the same shard, which
+    is opened on first use.
+
+        shards = UserShards("habits.db", shards=8)
+        increment_habit(shards.for_user(42), "Reading", user_id=42)
+    """
+
+    def __init__(self, db_name="habits.db", shards=4, check_same_thread=True):
+        self.db_name = db_name
+        self.shards = shards
+        self.check_same_thread = check_same_thread
+        self._connections = {}
+
+    def _open(self, shard):
+        if shard not in self._connections:
+            self._connections[shard] = get_db(shard_name(self.db_name, shard, self.shards), self.check_same_thread)
+        return self._connections[shard]
+
+    def for_user(self, user_id):
+        """Return the connection of the shard that holds `user_id`."""
+        return self._open(user_id % self.shards)
+
+    def __iter__(self):
+        """Iterate over the connections of all shards, e.g. to rebuild or verify every file."""
+        return (self._open(shard) for shard in range(self.shards))
+
+    def close(self):
+        for conn in self._connections.values():
+            conn.close()
+        self._connections.clear()
+
+SCHEMA_VERSION = 7
+DEFAULT_USER = 0  # user of single-user databases and of all rows created before user_id existed
+
+CHUNK_SIZE = 1_000  # habits fetched per round trip when streaming the whole history
+BULK_CHUNK_SIZE = 50_000  # completions written per transaction by bulk_record_completions
+ARCHIVE_DAYS = 365  # archive_completions keeps the exact rows of this many days
+STORAGE_ENGINES = ("rows", "runs")  # one tbl_tracker row per completion, or runs of days in tbl_completion_runs
+PURGE_CHUNK_SIZE = 1_000  # completions of deleted habits removed per transaction by purge_deleted
+
+
+# Habit names are unique per user. Indexes lead with user_id, so per-user queries only read that user's pages.
+HABIT_TABLE = """
+CREATE TABLE IF NOT EXISTS {table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    frequency TEXT NOT NULL,
+    streak INTEGER DEFAULT 0,
+    last_completed DATE,
+    longest_streak INTEGER DEFAULT 0,
+    total_completions INTEGER DEFAULT 0,
+    user_id INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (user_id, name)
+)
+"""
+TRACKER_TABLE = """
+CREATE TABLE IF NOT EXISTS {table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    habitname TEXT NOT NULL,
+    completed_date DATE NOT NULL,
+    habit_id INTEGER REFERENCES tbl_habit (id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+
+@profiled
 def create_tables(db):
     """
-    Create the necessary tables for the habit tracker.
+    Create the necessary tables for the habit tracker and bring older database files up to date.
     """
     cur = db.cursor()
+    cur.execute(HABIT_TABLE.format(table="tbl_habit"))
+    cur.execute(TRACKER_TABLE.format(table="tbl_tracker"))
+    cur.execute(RUNS_TABLE)  # read by the rebuild in _migrate_v2 already
+    cur.execute(TOMBSTONES_TABLE)
+    migrate(db)
+    db.commit()
+
+
+def _table_columns(db, table):
+    """Return the column names of a table."""
+    return [row[1] for row in db.execute(f"PRAGMA table_info({table})")]
+
+
+def _migrate_v1(db):
+    """
+    Key tbl_tracker by an integer habit_id instead of the free-text habit name.
+    Existing rows are backfilled from tbl_habit and duplicate completions of the same day are dropped,
+    so that (habit_id, completed_date) can be indexed as unique.
+    """
+    cur = db.cursor()
+    if "id" not in _table_columns(db, "tbl_habit"):
+        # very old files keyed tbl_habit by name only, reuse the rowid as the integer key
+        cur.execute("ALTER TABLE tbl_habit ADD COLUMN id INTEGER")
+        cur.execute("UPDATE tbl_habit SET id = rowid")
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_habit_id ON tbl_habit (id)")
+        cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_habit_id AFTER INSERT ON tbl_habit WHEN NEW.id IS NULL
+        BEGIN
+            UPDATE tbl_habit SET id = NEW.rowid WHERE rowid = NEW.rowid;
+        END
+        """)
+    if "habit_id" not in _table_columns(db, "tbl_tracker"):
+        cur.execute("ALTER TABLE tbl_tracker ADD COLUMN habit_id INTEGER REFERENCES tbl_habit (id) ON DELETE CASCADE")
     cur.execute("""
-    CREATE TABLE IF NOT EXISTS tbl_habit (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT UNIQUE NOT NULL,
-        frequency TEXT NOT NULL,
-        streak INTEGER DEFAULT 0,
-        last_completed DATE
-    )
+    UPDATE tbl_tracker SET habit_id = (SELECT h.id FROM tbl_habit h WHERE h.name = tbl_tracker.habitname)
+    WHERE habit_id IS NULL
     """)
     cur.execute("""
-    CREATE TABLE IF NOT EXISTS tbl_tracker (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        habitname TEXT NOT NULL,
-        completed_date DATE NOT NULL,
-        FOREIGN KEY (habitname) REFERENCES tbl_habit (name) ON DELETE CASCADE
-    )
-    """) # could also just delete from tbl_tracker first to not have a problem with the foreign key constraint
+    DELETE FROM tbl_tracker
+    WHERE habit_id IS NOT NULL
+      AND rowid NOT IN (SELECT MIN(rowid) FROM tbl_tracker GROUP BY habit_id, completed_date)
+    """)
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_tracker_habit_date ON tbl_tracker (habit_id, completed_date)")
+
+
+def _migrate_v2(db):
+    """
+    Materialize the streak statistics in tbl_habit: streak is the length of the run ending with
+    last_completed, next to longest_streak and total_completions. All values are rebuilt from tbl_tracker.
+    """
+    columns = _table_columns(db, "tbl_habit")
+    if "longest_streak" not in columns:
+        db.execute("ALTER TABLE tbl_habit ADD COLUMN longest_streak INTEGER DEFAULT 0")
+    if "total_completions" not in columns:
+        db.execute("ALTER TABLE tbl_habit ADD COLUMN total_completions INTEGER DEFAULT 0")
+    rebuild_streaks(db)
+
+
+def _rebuild_with_user_id(db, table, constraints=""):
+    """
+    Recreate `table` with its columns in their current order and user_id appended, without the old
+    name based keys: id becomes the INTEGER PRIMARY KEY and habit_id references tbl_habit (id).
+    """
+    definitions, names = [], []
+    for _, name, type_, notnull, default, _ in db.execute(f"PRAGMA table_info({table})").fetchall():
+        names.append(name)
+        if name == "id":
+            definitions.append("id INTEGER PRIMARY KEY AUTOINCREMENT")
+        elif name == "habit_id":
+            definitions.append("habit_id INTEGER REFERENCES tbl_habit (id) ON DELETE CASCADE")
+        else:
+            definitions.append(f"{name} {type_}" + (" NOT NULL" if notnull or name in ("name", "habitname") else "") +
+                               (f" DEFAULT {default}" if default is not None else ""))
+    definitions.append("user_id INTEGER NOT NULL DEFAULT 0")
+    columns = ", ".join(names)
+    db.execute(f"CREATE TABLE {table}_v3 ({', '.join(definitions + ([constraints] if constraints else []))})")
+    db.execute(f"INSERT INTO {table}_v3 ({columns}) SELECT {columns} FROM {table}")
+    db.execute(f"DROP TABLE {table}")
+    db.execute(f"ALTER TABLE {table}_v3 RENAME TO {table}")
+
+
+def _migrate_v3(db):
+    """
+    Add the user_id dimension, existing rows belong to DEFAULT_USER.
+    The global UNIQUE(name) of tbl_habit and the foreign key of tbl_tracker on the habit name can not be
+    dropped with ALTER TABLE, so files created before have both tables rebuilt, keeping their column order.
+    """
+    if "user_id" not in _table_columns(db, "tbl_habit"):
+        foreign_keys = db.execute("PRAGMA foreign_keys").fetchone()[0]
+        db.commit()
+        db.execute("PRAGMA foreign_keys = OFF")  # dropping tbl_habit must not cascade into tbl_tracker
+        try:
+            _rebuild_with_user_id(db, "tbl_tracker")
+            _rebuild_with_user_id(db, "tbl_habit", "UNIQUE (user_id, name)")
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.execute(f"PRAGMA foreign_keys = {foreign_keys}")
+    db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_tracker_habit_date ON tbl_tracker (habit_id, completed_date)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_tracker_user_date ON tbl_tracker (user_id, completed_date)")
+
+
+# Completions older than the archive horizon, as runs of consecutive days (day numbers, both ends included).
+# A day is either in tbl_tracker or in a run, never in both.
+RUNS_TABLE = """
+CREATE TABLE IF NOT EXISTS tbl_completion_runs (
+    habit_id INTEGER NOT NULL REFERENCES tbl_habit (id) ON DELETE CASCADE,
+    start_day INTEGER NOT NULL,
+    end_day INTEGER NOT NULL,
+    PRIMARY KEY (habit_id, start_day)
+) WITHOUT ROWID
+"""
+
+
+def _migrate_v4(db):
+    """Add tbl_completion_runs, filled by archive_completions."""
+    db.execute(RUNS_TABLE)
+
+
+def _migrate_v5(db):
+    """Add tbl_settings, which holds the storage engine of the file ("rows" unless set_storage changed it)."""
+    db.execute("CREATE TABLE IF NOT EXISTS tbl_settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+
+# Deleted habits whose completions are still in tbl_tracker or tbl_completion_runs, until purge_deleted removes them.
+TOMBSTONES_TABLE = """
+CREATE TABLE IF NOT EXISTS tbl_habit_tombstones (
+    habit_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    deleted_at TEXT NOT NULL
+)
+"""
+
+
+def _migrate_v6(db):
+    """Add tbl_habit_tombstones, filled by delete_habits."""
+    db.execute(TOMBSTONES_TABLE)
+
+
+# First day of the first period after last_completed, in the calendar of the habit's frequency.
+# Frequencies without a calendar here are treated as daily, like periods.get_calendar does.
+NEXT_DUE_SQL = """
+CASE frequency
+    WHEN 'weekly' THEN date(last_completed, '+1 day', 'weekday 1')
+    WHEN 'monthly' THEN date(last_completed, 'start of month', '+1 month')
+    WHEN 'yearly' THEN date(last_completed, 'start of year', '+1 year')
+    ELSE date(last_completed, '+1 day')
+END"""
+# First day of the period after that one: from then on a whole period was missed and the streak is broken.
+OVERDUE_FROM_SQL = """
+CASE frequency
+    WHEN 'weekly' THEN date(last_completed, '+1 day', 'weekday 1', '+7 days')
+    WHEN 'monthly' THEN date(last_completed, 'start of month', '+2 months')
+    WHEN 'yearly' THEN date(last_completed, 'start of year', '+2 years')
+    ELSE date(last_completed, '+2 days')
+END"""
+
+
+def _migrate_v7(db):
+    """
+    Add next_due and overdue_from to tbl_habit, computed from frequency and last_completed (NULL for
+    habits never completed). They are VIRTUAL generated columns, so every write, also plain SQL, keeps
+    them current. next_due is indexed per user and for all users, for get_due_habits.
+    """
+    columns = [row[1] for row in db.execute("PRAGMA table_xinfo(tbl_habit)")]
+    if "next_due" not in columns:
+        db.execute(f"ALTER TABLE tbl_habit ADD COLUMN next_due TEXT GENERATED ALWAYS AS ({NEXT_DUE_SQL}) VIRTUAL")
+    if "overdue_from" not in columns:
+        db.execute(f"ALTER TABLE tbl_habit ADD COLUMN overdue_from TEXT GENERATED ALWAYS AS ({OVERDUE_FROM_SQL}) VIRTUAL")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_habit_user_due ON tbl_habit (user_id, next_due)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_habit_due ON tbl_habit (next_due)")
+
+
+# Schema migrations in order, migration n brings a database from user_version n-1 to n.
+MIGRATIONS = [_migrate_v1, _migrate_v2, _migrate_v3, _migrate_v4, _migrate_v5, _migrate_v6, _migrate_v7]
+
+
+@profiled
+def migrate(db):
+    """
+    Apply all pending schema migrations. The schema version is kept in PRAGMA user_version,
+    so every migration runs exactly once per database file.
+    """
+    version = db.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(db)
+        db.execute(f"PRAGMA user_version = {number}")
     db.commit()
 
 
-def add_habit(db, name, frequency):
+@profiled
+def add_habit(db, name, frequency, user_id=DEFAULT_USER):
     """
-    Add a new habit to the database.
+    Add a new habit to the database. Returns its id.
     """
     try:
         cur = db.cursor()
-        cur.execute("INSERT INTO tbl_habit (name, frequency) VALUES (?, ?)", (name, frequency))
+        cur.execute("INSERT INTO tbl_habit (name, frequency, user_id) VALUES (?, ?, ?)", (name, frequency, user_id))
         db.commit()
+        touch(db, [cur.lastrowid], user_id, listing=True)
+        return cur.lastrowid
     except sqlite3.IntegrityError as e:
         print(f"Habit '{name}' already exists in the database.")
         raise e
 
-def increment_habit(db, name):
+@profiled
+def bulk_add_habits(db, habits, chunk_size=BULK_CHUNK_SIZE, user_id=DEFAULT_USER):
+    """
+    Add many habits of one user at once, `habits` is an iterable of (name, frequency) pairs.
+    Habits that already exist are kept as they are. Writes one transaction per chunk.
+    Returns the number of habits added.
+    """
+    added = 0
     cur = db.cursor()
-    today = datetime.now().date()
+    habits = iter(habits)
+    while True:
+        rows = [(name, frequency, user_id) for _, (name, frequency) in zip(range(chunk_size), habits)]
+        if not rows:
+            break
+        before = db.total_changes
+        cur.executemany("INSERT OR IGNORE INTO tbl_habit (name, frequency, user_id) VALUES (?, ?, ?)", rows)
+        added += db.total_changes - before
+        db.commit()
+    if added:
+        touch(db, (), user_id, listing=True)
+    return added
 
+def _get_habit_id(db, name, user_id=DEFAULT_USER):
+    """Return the integer id of a habit, or None if it does not exist."""
+    row = db.execute("SELECT id FROM tbl_habit WHERE user_id = ? AND name = ?", (user_id, name)).fetchone()
+    return row[0] if row else None
 
-    cur.execute("SELECT COUNT(*) FROM tbl_tracker WHERE habitname = ? AND completed_date = ?", (name, today))
-    count = cur.fetchone()[0]
+def _habit_days(db, habit_id):
+    """Return the sorted day numbers of all completions of a habit, archived ones included."""
+    days = [day for start, end in db.execute("SELECT start_day, end_day FROM tbl_completion_runs WHERE habit_id = ?", (habit_id,))
+            for day in range(start, end + 1)]
+    days += [row[0] for row in db.execute(f"SELECT {DAY_NUMBER_SQL} FROM tbl_tracker WHERE habit_id = ?", (habit_id,))]
+    return sorted(days)
 
-    if count > 0:
-        print(f"Habit '{name}' has already been marked as completed today ({today}).")
-        return  # Avoid duplicates
+def _is_archived(db, habit_id, day):
+    """Whether day number `day` lies in an archived run of the habit, one index lookup."""
+    row = db.execute("SELECT end_day FROM tbl_completion_runs WHERE habit_id = ? AND start_day <= ? "
+                     "ORDER BY start_day DESC LIMIT 1", (habit_id, day)).fetchone()
+    return row is not None and row[0] >= day
 
-    try:
+@profiled
+def repair_habit(db, habit_id, frequency):
+    """
+    Recompute the materialized streak columns of one habit from its history.
+    Used after backdated inserts and deletes, which can split or join runs anywhere. The caller commits.
+    """
+    days = _habit_days(db, habit_id)
+    if not days:
+        db.execute("UPDATE tbl_habit SET streak = 0, longest_streak = 0, total_completions = 0, last_completed = NULL WHERE id = ?", (habit_id,))
+        return 0
+    # the streak as of the last completion is the length of the run ending there
+    total, streak, longest = habit_streaks(frequency, days, today=days[-1])
+    db.execute("UPDATE tbl_habit SET streak = ?, longest_streak = ?, total_completions = ?, last_completed = ? WHERE id = ?",
+               (streak, longest, total, str(np.datetime64(days[-1], "D")), habit_id))
+    return streak
 
-        completed_time = datetime.now()
-        cur.execute("INSERT INTO tbl_tracker (habitname, completed_date) VALUES (?, ?)", (name, today))
+def next_streak(frequency, streak, last_completed, completed_date):
+    """
+    The streak after appending a completion on `completed_date` to a habit whose run of `streak`
+    periods ended with `last_completed` (None if it was never completed). Dates are dates or ISO strings.
+    """
+    period = period_of(frequency, day_number(completed_date))
+    last_period = period_of(frequency, day_number(last_completed)) if last_completed else None
+    if last_period == period:
+        return streak or 0  # another completion in the same period does not extend the streak
+    if last_period == period - 1:
+        return (streak or 0) + 1
+    return 1
 
-        # update streak
-        cur.execute("SELECT streak FROM tbl_habit WHERE name = ?", (name,))
-        habit = cur.fetchone()
-        if habit:
-            new_streak = habit[0] + 1
-            cur.execute("UPDATE tbl_habit SET streak = ? WHERE name = ?", (new_streak, name))
-        else:
+def _record_completion(db, habit, completed_date):
+    """
+    Insert one completion and update the materialized streak columns of the habit in the same transaction.
+    `habit` is a tbl_habit row with id, name, frequency, streak, longest_streak, total_completions, last_completed and user_id.
+    Appending after last_completed is O(1), a backdated completion repairs the habit from its history.
+    Returns the new streak, or None if the habit was already completed that day. The caller commits.
+    """
+    if get_storage(db) == "runs":
+        return _record_run_completion(db, habit, completed_date)
+    habit_id, name, frequency, streak, longest, total, last_completed, user_id = habit
+    if last_completed and completed_date <= last_completed and _is_archived(db, habit_id, day_number(completed_date)):
+        return None
+    cur = db.cursor()
+    # the unique (habit_id, completed_date) index rejects a second completion on the same day
+    cur.execute("INSERT OR IGNORE INTO tbl_tracker (habitname, completed_date, habit_id, user_id) VALUES (?, ?, ?, ?)",
+                (name, completed_date, habit_id, user_id))
+    if cur.rowcount == 0:
+        return None
+    if last_completed and completed_date < last_completed:
+        return repair_habit(db, habit_id, frequency)
 
-            cur.execute("INSERT INTO tbl_habit (name, streak) VALUES (?, ?)", (name, 1))
-            print(f"Habit '{name}' added to the habit table with a streak of 1.")
+    streak = next_streak(frequency, streak, last_completed, completed_date)
+    cur.execute("UPDATE tbl_habit SET streak = ?, longest_streak = ?, total_completions = ?, last_completed = ? WHERE id = ?",
+                (streak, max(longest or 0, streak), (total or 0) + 1, completed_date, habit_id))
+    return streak
 
+def _add_run_day(db, habit_id, day):
+    """
+    Add day number `day` to the runs of a habit, extending the run that ends the day before and
+    joining the run that starts the day after. Two index lookups and at most two writes, O(log n).
+    Returns (start_day, end_day) of the run that now contains the day, or None if it was already there.
+    """
+    before = db.execute("SELECT start_day, end_day FROM tbl_completion_runs WHERE habit_id = ? AND start_day <= ? "
+                        "ORDER BY start_day DESC LIMIT 1", (habit_id, day)).fetchone()
+    if before is not None and before[1] >= day:
+        return None
+    after = db.execute("SELECT end_day FROM tbl_completion_runs WHERE habit_id = ? AND start_day = ?", (habit_id, day + 1)).fetchone()
+    start = before[0] if before is not None and before[1] == day - 1 else day
+    end = after[0] if after is not None else day
+    if after is not None:
+        db.execute("DELETE FROM tbl_completion_runs WHERE habit_id = ? AND start_day = ?", (habit_id, day + 1))
+    db.execute("INSERT OR REPLACE INTO tbl_completion_runs (habit_id, start_day, end_day) VALUES (?, ?, ?)", (habit_id, start, end))
+    return start, end
+
+def _record_run_completion(db, habit, completed_date):
+    """
+    _record_completion for the "runs" storage engine. A daily streak is a run of days, so even a
+    backdated completion of a daily habit updates the streak columns from the run it extended, in O(log n).
+    Other frequencies count periods and repair the habit from its history after a backdated completion.
+    """
+    habit_id, name, frequency, streak, longest, total, last_completed, user_id = habit
+    run = _add_run_day(db, habit_id, day_number(completed_date))
+    if run is None:
+        return None
+    if not last_completed or completed_date > last_completed:
+        streak = next_streak(frequency, streak, last_completed, completed_date)
+        length, last_completed = streak, completed_date
+    elif get_calendar(frequency) is get_calendar("daily"):
+        length = run[1] - run[0] + 1
+        if run[1] == day_number(last_completed):  # joined the last run
+            streak = length
+    else:
+        return repair_habit(db, habit_id, frequency)
+    db.execute("UPDATE tbl_habit SET streak = ?, longest_streak = ?, total_completions = ?, last_completed = ? WHERE id = ?",
+               (streak, max(longest or 0, length), (total or 0) + 1, last_completed, habit_id))
+    return streak
+
+@profiled
+def get_storage(db):
+    """Return the storage engine of the database, one of STORAGE_ENGINES."""
+    row = db.execute("SELECT value FROM tbl_settings WHERE key = 'storage'").fetchone()
+    return row[0] if row else "rows"
+
+@profiled
+def set_storage(db, storage):
+    """
+    Convert the completions of the database to `storage` and use it for all further writes.
+    "runs" keeps every run of consecutive days as one row of tbl_completion_runs, completions extend
+    and join runs instead of adding rows. "rows" expands all runs into tbl_tracker again, archived ones too.
+    Results of all readers are the same for both. Returns the number of rows converted.
+    """
+    if storage not in STORAGE_ENGINES:
+        raise ValueError(f"unknown storage engine {storage!r}, expected one of {STORAGE_ENGINES}")
+    if storage == "runs":
+        converted, _ = archive_completions(db, date.max)
+    else:
+        cur = db.execute("""
+        WITH RECURSIVE archived (habit_id, day, end_day) AS (
+            SELECT habit_id, start_day, end_day FROM tbl_completion_runs
+            UNION ALL
+            SELECT habit_id, day + 1, end_day FROM archived WHERE day < end_day
+        )
+        INSERT INTO tbl_tracker (habitname, completed_date, habit_id, user_id)
+        SELECT h.name, date(a.day + 2440587.5), h.id, h.user_id FROM archived a JOIN tbl_habit h ON h.id = a.habit_id
+        ORDER BY a.habit_id, a.day
+        """)
+        converted = cur.rowcount
+        db.execute("DELETE FROM tbl_completion_runs")
+    db.execute("INSERT OR REPLACE INTO tbl_settings (key, value) VALUES ('storage', ?)", (storage,))
+    db.commit()
+    return converted
+
+def _get_habit_row(db, name, user_id=DEFAULT_USER):
+    return db.execute("SELECT id, name, frequency, streak, longest_streak, total_completions, last_completed, user_id "
+                      "FROM tbl_habit WHERE user_id = ? AND name = ?", (user_id, name)).fetchone()
+
+@profiled
+def increment_habit(db, name, completed_date=None, user_id=DEFAULT_USER):
+    """
+    Record a completion of a habit, today unless `completed_date` is given, and update its streak.
+    Returns the new streak, or None if nothing was recorded.
+    """
+    today = _to_date(completed_date) if completed_date else datetime.now().date()
+
+    habit = _get_habit_row(db, name, user_id)
+    if habit is None:
+        print(f"Habit '{name}' does not exist.")
+        return
+
+    try:
+        streak = _record_completion(db, habit, today.isoformat())
+        if streak is None:
+            print(f"Habit '{name}' has already been marked as completed on {today}.")
+            return  # Avoid duplicates
 
         db.commit()
+        touch(db, [habit[0]], user_id)
         print(f"Habit '{name}' marked as completed on {today}.")
+        return streak
     except Exception as e:
         db.rollback()
         print(f"Error updating habit '{name}': {e}")
 
+@profiled
+def record_completions(db, completions):
+    """
+    Record several completions in one transaction, e.g. the check-ins that arrive while the previous
+    transaction commits. `completions` is a list of (user_id, habit name, date) tuples.
+    Returns one result per completion: the new streak, None if it was already recorded that day,
+    or False if the habit does not exist. The caller commits.
+    """
+    results = []
+    for user_id, name, completed_date in completions:
+        habit = _get_habit_row(db, name, user_id)
+        if habit is None:
+            results.append(False)
+        else:
+            results.append(_record_completion(db, habit, _to_date(completed_date).isoformat()))
+            if results[-1] is not None:
+                touch(db, [habit[0]], user_id)
+    return results
 
-def get_habit_tracking_data(db, name):
+@profiled
+def check_in(db, names, completed_date=None, user_id=DEFAULT_USER):
     """
-    Get all completion dates for a given habit.
+    Record a completion of every habit in `names` on `completed_date` (default: today) in one transaction.
+    One query loads the habits and tells which of them are already completed that day, only the others
+    are written. Returns {name: result} with the new streak, None if the habit was already completed
+    that day, or False if it does not exist.
+    """
+    completed_date = _to_date(completed_date) if completed_date else datetime.now().date()
+    day = completed_date.isoformat()
+    rows = db.execute("""
+    SELECT id, name, frequency, streak, longest_streak, total_completions, last_completed, user_id,
+           EXISTS (SELECT 1 FROM tbl_tracker t WHERE t.habit_id = h.id AND t.completed_date = :day)
+           OR EXISTS (SELECT 1 FROM tbl_completion_runs r WHERE r.habit_id = h.id AND r.start_day <= :number AND r.end_day >= :number)
+    FROM tbl_habit h WHERE user_id = :user AND name IN (SELECT value FROM json_each(:names))
+    """, {"day": day, "number": day_number(completed_date), "user": user_id, "names": json.dumps(list(names))}).fetchall()
+    results = dict.fromkeys(names, False)
+    try:
+        for row in rows:
+            results[row[1]] = None if row[8] else _record_completion(db, tuple(row)[:8], day)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    written = [row[0] for row in rows if results[row[1]] is not None]
+    if written:
+        touch(db, written, user_id)
+    return results
+
+
+DUE_COLUMNS = "user_id, name, frequency, last_completed, next_due"
+
+
+@profiled
+def get_due_habits(db, today=None, overdue=False, user_id=DEFAULT_USER, frequency=None):
+    """
+    The habits whose current period (day, ISO week, month, year) has no completion on `today` (default: today),
+    as (user_id, name, frequency, last_completed, next_due) rows, longest due first and habits never completed last.
+    With `overdue`, only habits that missed a whole period. `user_id` None selects the habits of all users.
+    Both follow the next_due index, so they take time proportional to the due habits, not to all habits.
+    """
+    params = {"today": (_to_date(today) if today else datetime.now().date()).isoformat(), "user": user_id, "frequency": frequency}
+    filters = ("" if user_id is None else " AND user_id = :user") + ("" if frequency is None else " AND frequency = :frequency")
+    if overdue:
+        # overdue_from comes after next_due, so the overdue habits are among those due before today
+        return db.execute(f"SELECT {DUE_COLUMNS} FROM tbl_habit WHERE next_due < :today AND overdue_from <= :today{filters} "
+                          "ORDER BY next_due", params).fetchall()
+    rows = db.execute(f"SELECT {DUE_COLUMNS} FROM tbl_habit WHERE next_due <= :today{filters} ORDER BY next_due", params).fetchall()
+    return rows + db.execute(f"SELECT {DUE_COLUMNS} FROM tbl_habit WHERE next_due IS NULL{filters}", params).fetchall()
+
+
+@profiled
+def due_habits(db, today=None, frequency=None, user_id=DEFAULT_USER):
+    """
+    Names of the habits of a user that are not completed in the current period of their frequency,
+    optionally only those with `frequency`, ordered by name. See get_due_habits.
     """
+    return sorted(row[1] for row in get_due_habits(db, today, False, user_id, frequency))
+
+
+def _to_date(value):
+    """Accept a date, a datetime or an ISO date string."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(value)
+
+@profiled
+def bulk_record_completions(db, events, chunk_size=BULK_CHUNK_SIZE, user_id=DEFAULT_USER):
+    """
+    Record many completions of one user at once, e.g. when importing history or syncing from a device.
+    `events` is an iterable of (habit name, date) pairs, dates may lie in the past.
+    Completions that are already stored or repeated in `events` are ignored by the unique
+    (habit_id, completed_date) index. Events are written in transactions of `chunk_size`, the streak
+    columns of the affected habits are rebuilt once at the end, in the transaction of the last chunk.
+    So a batch that fits into one chunk is a single transaction. If a larger import is interrupted,
+    the committed completions stay and `rebuild_streaks` fixes the streaks.
+    Returns the number of completions inserted.
+    """
+    habit_ids = {}  # name -> id, looked up once per name
+    unknown = set()
+    affected = set()
+    inserted = 0
     cur = db.cursor()
-    cur.execute("SELECT completed_date FROM tbl_tracker WHERE habitname = ? ORDER BY completed_date", (name,))
-    return cur.fetchall()
+    events = iter(events)
+    try:
+        while True:
+            rows = []
+            for name, completed_date in events:
+                if name not in habit_ids:
+                    habit_ids[name] = _get_habit_id(db, name, user_id)
+                habit_id = habit_ids[name]
+                if habit_id is None:
+                    unknown.add(name)
+                else:
+                    rows.append((name, _to_date(completed_date).isoformat(), habit_id, user_id))
+                if len(rows) == chunk_size:
+                    break
+            if not rows:
+                break
+            if affected:
+                db.commit()  # the previous chunk
+            rows.sort(key=lambda row: (row[2], row[1]))  # insert in index order
+            before = db.total_changes
+            cur.executemany("INSERT OR IGNORE INTO tbl_tracker (habitname, completed_date, habit_id, user_id) VALUES (?, ?, ?, ?)", rows)
+            inserted += db.total_changes - before
+            if _has_runs(db):
+                # completions that are already archived were inserted again, take them out
+                cur.execute(f"""
+                DELETE FROM tbl_tracker WHERE habit_id IN (SELECT value FROM json_each(?)) AND EXISTS (
+                    SELECT 1 FROM tbl_completion_runs r WHERE r.habit_id = tbl_tracker.habit_id
+                    AND r.start_day <= {DAY_NUMBER_SQL} AND r.end_day >= {DAY_NUMBER_SQL})
+                """, (json.dumps(sorted({row[2] for row in rows})),))
+                inserted -= cur.rowcount
+            affected.update(row[2] for row in rows)
+        if affected:
+            if get_storage(db) == "runs":
+                archive_completions(db, date.max)  # commits, turns the new rows into runs
+            rebuild_streaks(db, affected)  # commits
+    except Exception:
+        db.rollback()
+        raise
+    for name in sorted(unknown):
+        print(f"Habit '{name}' does not exist, its completions were skipped.")
+    return inserted
 
-def get_all_habits(db):
+@profiled
+def remove_completion(db, name, completed_date, user_id=DEFAULT_USER):
     """
-    Get all habits from the database.
+    Delete one completion of a habit and repair its streak columns.
+    Returns True if a completion was deleted.
     """
+    habit = _get_habit_row(db, name, user_id)
+    if habit is None:
+        return False
     cur = db.cursor()
-    cur.execute("SELECT h.name, h.frequency, h.streak, COALESCE(COUNT(DISTINCT t.completed_date),0) AS completed, MAX(COALESCE(t.completed_date,0)) AS last_completed FROM tbl_habit h LEFT JOIN tbl_tracker t ON h.name = t.habitname GROUP BY h.name, h.frequency, h.streak") #hasi: h.streak, last_completed and completed added to the SELECT clause, LEFT JOIN tbl_tracker added in the FROM clause, GROUP BY clause added (required when using aggregate function like MAX)
-    return cur.fetchall()
+    cur.execute("DELETE FROM tbl_tracker WHERE habit_id = ? AND completed_date = ?", (habit[0], completed_date))
+    removed = cur.rowcount > 0 or _unarchive_day(db, habit[0], day_number(completed_date))
+    if removed:
+        repair_habit(db, habit[0], habit[2])
+    db.commit()
+    if removed:
+        touch(db, [habit[0]], user_id)
+    return removed
+
+def _unarchive_day(db, habit_id, day):
+    """Remove one day from the archived run that contains it, splitting the run. Returns True if it was archived."""
+    row = db.execute("SELECT start_day, end_day FROM tbl_completion_runs WHERE habit_id = ? AND start_day <= ? "
+                     "ORDER BY start_day DESC LIMIT 1", (habit_id, day)).fetchone()
+    if row is None or row[1] < day:
+        return False
+    start, end = row
+    db.execute("DELETE FROM tbl_completion_runs WHERE habit_id = ? AND start_day = ?", (habit_id, start))
+    db.executemany("INSERT INTO tbl_completion_runs (habit_id, start_day, end_day) VALUES (?, ?, ?)",
+                   [(habit_id, first, last) for first, last in ((start, day - 1), (day + 1, end)) if first <= last])
+    return True
+
+
+def _has_runs(db):
+    """Whether any completions are archived, readers skip tbl_completion_runs otherwise."""
+    return db.execute("SELECT 1 FROM tbl_completion_runs LIMIT 1").fetchone() is not None
 
-def delete_habit(db, name):
+def _has_tombstones(db):
+    """Whether deleted habits still have completions, readers of whole tables skip them."""
+    return db.execute("SELECT 1 FROM tbl_habit_tombstones LIMIT 1").fetchone() is not None
+
+def _habit_filter(habit_ids, db=None):
+    """
+    WHERE clause and parameters selecting all habits or only `habit_ids`.
+    With `db`, all habits leaves out the completions of deleted habits that were not purged yet.
     """
-    Delete a habit and its associated tracker data from the database.
+    if habit_ids is None:
+        if db is not None and _has_tombstones(db):
+            return "habit_id IS NOT NULL AND habit_id NOT IN (SELECT habit_id FROM tbl_habit_tombstones)", ()
+        return "habit_id IS NOT NULL", ()
+    return "habit_id IN (SELECT value FROM json_each(?))", (json.dumps(sorted(habit_ids)),)
+
+def _run_days(starts, ends):
+    """Expand runs of days into (run index, day) int64 arrays."""
+    lengths = ends - starts + 1
+    runs = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return runs, starts[runs] + offsets
+
+def iter_completion_days(db, chunk_size=CHUNK_SIZE, habit_ids=None):
     """
+    Stream all completions in one query ordered by habit, optionally only those of `habit_ids`.
+    Every row carries the whole history of one habit as a comma separated list of day numbers
+    (days since 1970-01-01), which NumPy parses without creating a Python object per completion.
+    Archived runs are read the same way and expanded next to the live rows of their habit.
+    Yields (habit_ids, days) int64 arrays sorted by habit and day.
+    """
+    where, params = _habit_filter(habit_ids, db)
     cur = db.cursor()
-    cur.execute("DELETE FROM tbl_tracker WHERE habitname = ?", (name,))
-    cur.execute("DELETE FROM tbl_habit WHERE name = ?", (name,))
+    cur.row_factory = None
+    # the scan follows the (habit_id, completed_date) index, so each list comes out in date order
+    cur.execute(f"SELECT habit_id, COUNT(*), group_concat({DAY_NUMBER_SQL}) FROM tbl_tracker WHERE {where} "
+                "GROUP BY habit_id ORDER BY habit_id", params)
+    if not _has_runs(db):
+        while rows := cur.fetchmany(chunk_size):
+            yield _parse_days(rows)
+        return
+
+    runs = db.cursor()
+    runs.row_factory = None
+    runs.execute(f"SELECT habit_id, COUNT(*), group_concat(start_day), group_concat(end_day) FROM tbl_completion_runs "
+                 f"WHERE {where} GROUP BY habit_id ORDER BY habit_id", params)
+    # both streams are ordered by habit, merge them and cut chunks at habit boundaries
+    merged = heapq.merge(((row[0], 0, row) for row in cur), ((row[0], 1, row) for row in runs))
+    habits = (list(items) for _, items in groupby(merged, key=lambda item: item[0]))
+    while chunk := list(islice(habits, chunk_size)):
+        live, archived = [], []
+        for items in chunk:
+            for _, kind, row in items:
+                (archived if kind else live).append(row)
+        ids, days = _parse_days(live) if live else (np.empty(0, dtype=np.int64),) * 2
+        if archived:
+            run_ids, counts, starts, ends = zip(*archived)
+            starts = np.fromstring(",".join(starts), dtype=np.int64, sep=",")
+            ends = np.fromstring(",".join(ends), dtype=np.int64, sep=",")
+            run, run_days = _run_days(starts, ends)
+            ids = np.concatenate([ids, np.repeat(np.array(run_ids, dtype=np.int64), counts)[run]])
+            days = np.concatenate([days, run_days])
+            order = np.lexsort((days, ids))
+            ids, days = ids[order], days[order]
+        yield ids, days
+
+def _parse_days(rows):
+    """Turn (habit_id, count, day list) rows into (habit_ids, days) arrays sorted by habit and day."""
+    habit_ids, counts, day_lists = zip(*rows)
+    ids = np.repeat(np.array(habit_ids, dtype=np.int64), counts)
+    days = np.fromstring(",".join(day_lists), dtype=np.int64, sep=",")
+    if np.any((np.diff(days) < 0) & (ids[1:] == ids[:-1])):
+        order = np.lexsort((days, ids))
+        ids, days = ids[order], days[order]
+    return ids, days
+
+@profiled
+def archive_completions(db, before=None, chunk_size=CHUNK_SIZE):
+    """
+    Move the completions before `before` (default: ARCHIVE_DAYS ago) from tbl_tracker into runs of
+    consecutive days in tbl_completion_runs, merged with the runs archived before. All readers in this
+    module union both tables, so streaks and statistics do not change. Writes one transaction per
+    chunk of habits. Returns (completions archived, runs of those habits afterwards).
+    """
+    before = _to_date(before) if before else date.today() - timedelta(days=ARCHIVE_DAYS)
+    where, params = _habit_filter(None, db)
+    habit_ids = [row[0] for row in db.execute(
+        f"SELECT DISTINCT habit_id FROM tbl_tracker WHERE {where} AND completed_date < ? ORDER BY habit_id",
+        params + (before.isoformat(),))]
+    archived = runs = 0
+    for first in range(0, len(habit_ids), chunk_size):
+        chunk = json.dumps(habit_ids[first:first + chunk_size])
+        cur = db.cursor()
+        cur.row_factory = None
+        cur.execute(f"SELECT habit_id, COUNT(*), group_concat({DAY_NUMBER_SQL}) FROM tbl_tracker "
+                    "WHERE habit_id IN (SELECT value FROM json_each(?)) AND completed_date < ? GROUP BY habit_id",
+                    (chunk, before.isoformat()))
+        ids, days = _parse_days(cur.fetchall())
+        cur.execute("SELECT habit_id, start_day, end_day FROM tbl_completion_runs WHERE habit_id IN (SELECT value FROM json_each(?))", (chunk,))
+        old_runs = np.array(cur.fetchall(), dtype=np.int64).reshape(-1, 3)
+        ids, starts, ends = (np.concatenate(pair) for pair in zip((ids, days, days), old_runs.T))
+        order = np.lexsort((starts, ids))
+        ids, starts, ends = ids[order], starts[order], ends[order]
+        # days and runs are disjoint, a run continues where the previous one ends
+        new = np.ones(len(ids), dtype=bool)
+        new[1:] = (ids[1:] != ids[:-1]) | (starts[1:] != ends[:-1] + 1)
+        first_rows = np.flatnonzero(new)
+        last_rows = np.append(first_rows[1:], len(ids)) - 1
+        try:
+            db.execute("DELETE FROM tbl_completion_runs WHERE habit_id IN (SELECT value FROM json_each(?))", (chunk,))
+            db.executemany("INSERT INTO tbl_completion_runs (habit_id, start_day, end_day) VALUES (?, ?, ?)",
+                           zip(ids[first_rows].tolist(), starts[first_rows].tolist(), ends[last_rows].tolist()))
+            cur = db.execute("DELETE FROM tbl_tracker WHERE habit_id IN (SELECT value FROM json_each(?)) AND completed_date < ?",
+                             (chunk, before.isoformat()))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        archived += cur.rowcount
+        runs += len(first_rows)
+    return archived, runs
+
+@profiled
+def history_stats(db, habit_ids=None):
+    """
+    Compute the streak statistics of every habit (or only of `habit_ids`) from the raw completion history,
+    counted in periods of the habit's frequency. Returns {habit_id: (total, streak, longest, last_day, last_period)},
+    habits without completions are left out.
+    """
+    stats = {}
+    for ids, days in iter_completion_days(db, CHUNK_SIZE, habit_ids):
+        habit_ids, rows_of_habit = np.unique(ids, return_inverse=True)
+        # only the frequencies of the habits in this chunk, so a few habits do not read all users' habits
+        frequency_of = {row[0]: row[1] or "daily" for row in db.execute(
+            "SELECT id, frequency FROM tbl_habit WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(habit_ids.tolist()),))}
+        frequencies = np.array([frequency_of.get(int(habit_id), "daily") for habit_id in habit_ids])[rows_of_habit]
+        last_days = days[np.append(np.flatnonzero(ids[1:] != ids[:-1]), len(ids) - 1)]
+        result = streaks_from_periods(ids, to_periods(frequencies, days))
+        for habit_id, total, streak, longest, last_period, last_day in zip(*result, last_days):
+            stats[int(habit_id)] = (int(total), int(streak), int(longest), int(last_day), int(last_period))
+    return stats
+
+def _history_stats(db, habit_ids=None, workers=None):
+    """history_stats, computed by `workers` processes if more than one is asked for."""
+    if workers and workers > 1:
+        from parallel import parallel_history_stats
+        return parallel_history_stats(db, workers, habit_ids)
+    return history_stats(db, habit_ids)
 
+@profiled
+def rebuild_streaks(db, habit_ids=None, workers=None):
+    """
+    Recompute the materialized streak columns of all habits, or only of `habit_ids`, from tbl_tracker.
+    With `workers`, the history is analysed by that many processes and written back here.
+    """
+    stats = _history_stats(db, habit_ids, workers)
+    if habit_ids is None:
+        habit_ids = [row[0] for row in db.execute("SELECT id FROM tbl_habit")]
+    rows = []
+    for habit_id in habit_ids:
+        total, streak, longest, last_day, _ = stats.get(habit_id, (0, 0, 0, None, None))
+        last_completed = str(np.datetime64(last_day, "D")) if last_day is not None else None
+        rows.append((streak, longest, total, last_completed, habit_id))
+    db.executemany("UPDATE tbl_habit SET streak = ?, longest_streak = ?, total_completions = ?, last_completed = ? WHERE id = ?", rows)
     db.commit()
+    touch(db, habit_ids)
+    return len(rows)
+
+@profiled
+def verify_streaks(db, workers=None):
+    """
+    Check the materialized streak columns against the raw tbl_tracker history.
+    Returns a list of (name, stored, expected) tuples for every habit that differs,
+    both values being (streak, longest_streak, total_completions, last_completed).
+    """
+    stats = _history_stats(db, workers=workers)
+    mismatches = []
+    for habit_id, name, streak, longest, total, last_completed in db.execute(
+            "SELECT id, name, streak, longest_streak, total_completions, last_completed FROM tbl_habit ORDER BY name"):
+        expected_total, expected_streak, expected_longest, last_day, _ = stats.get(habit_id, (0, 0, 0, None, None))
+        expected = (expected_streak, expected_longest, expected_total,
+                    str(np.datetime64(last_day, "D")) if last_day is not None else None)
+        stored = (streak, longest, total, last_completed)
+        if stored != expected:
+            mismatches.append((name, stored, expected))
+    return mismatches
 
 
+def iter_habit_rows(db, chunk_size=BULK_CHUNK_SIZE, user_id=DEFAULT_USER):
+    """Stream all habits of a user with their streak columns, ordered by name."""
+    cur = db.cursor()
+    cur.row_factory = None
+    cur.execute("SELECT name, frequency, streak, longest_streak, total_completions, last_completed FROM tbl_habit "
+                "WHERE user_id = ? ORDER BY name", (user_id,))
+    while rows := cur.fetchmany(chunk_size):
+        yield from rows
+
+def _stream(db, sql, params, chunk_size):
+    cur = db.cursor()
+    cur.row_factory = None
+    cur.execute(sql, params)
+    while rows := cur.fetchmany(chunk_size):
+        yield from rows
+
+
+def iter_completion_rows(db, chunk_size=BULK_CHUNK_SIZE, user_id=DEFAULT_USER):
+    """
+    Stream all completions of a user as (habit name, completed_date), ordered by name and date along the indexes.
+    Archived runs are expanded day by day and merged with the live rows of their habit.
+    """
+    # CROSS JOIN keeps tbl_habit outside: its (user_id, name) index hands out the habits in name order and
+    # idx_tracker_habit_date the dates of each, so nothing is sorted before the first row
+    live = _stream(db, "SELECT h.name, t.completed_date FROM tbl_habit h CROSS JOIN tbl_tracker t ON t.habit_id = h.id "
+                       "WHERE h.user_id = ? ORDER BY h.name, t.completed_date", (user_id,), chunk_size)
+    if not _has_runs(db):
+        yield from live
+        return
+    runs = _stream(db, "SELECT h.name, r.start_day, r.end_day FROM tbl_habit h CROSS JOIN tbl_completion_runs r "
+                       "ON r.habit_id = h.id WHERE h.user_id = ? ORDER BY h.name, r.start_day", (user_id,), chunk_size)
+    epoch = date(1970, 1, 1).toordinal()
+    archived = ((name, date.fromordinal(epoch + day).isoformat()) for name, start, end in runs for day in range(start, end + 1))
+    yield from heapq.merge(live, archived)
+
+
+@profiled
+def get_habit_tracking_data(db, name, user_id=DEFAULT_USER):
+    """
+    Get all completion dates for a given habit.
+    """
+    habit_id = _get_habit_id(db, name, user_id)
+    if habit_id is None:
+        return []
+    rows = db.execute("SELECT completed_date FROM tbl_tracker WHERE habit_id = ? ORDER BY completed_date", (habit_id,)).fetchall()
+    runs = db.execute("SELECT start_day, end_day FROM tbl_completion_runs WHERE habit_id = ?", (habit_id,)).fetchall()
+    if not runs:
+        return rows
+    epoch = date(1970, 1, 1).toordinal()
+    archived = [(date.fromordinal(epoch + day).isoformat(),) for start, end in runs for day in range(start, end + 1)]
+    return sorted(archived + [tuple(row) for row in rows])
+
+HABIT_COLUMNS = "id, name, frequency, streak, total_completions, last_completed"
+
+@profiled
+def get_habit(db, name=None, habit_id=None, user_id=DEFAULT_USER):
+    """
+    Get one habit of a user by name or by id, as a row with the columns of HABIT_COLUMNS, or None.
+    """
+    if habit_id is not None:
+        return db.execute(f"SELECT {HABIT_COLUMNS} FROM tbl_habit WHERE id = ? AND user_id = ?", (habit_id, user_id)).fetchone()
+    return db.execute(f"SELECT {HABIT_COLUMNS} FROM tbl_habit WHERE user_id = ? AND name = ?", (user_id, name)).fetchone()
+
+@profiled
+def get_habit_rows(db, user_id=DEFAULT_USER):
+    """
+    Get all habits of a user ordered by name, as rows with the columns of HABIT_COLUMNS.
+    """
+    return db.execute(f"SELECT {HABIT_COLUMNS} FROM tbl_habit WHERE user_id = ? ORDER BY name", (user_id,)).fetchall()
+
+ALL_HABITS_COLUMNS = ("name, frequency, streak, COALESCE(total_completions, 0) AS completed, "
+                      "COALESCE(last_completed, 0) AS last_completed")
 
+@profiled
+def get_all_habits(db, user_id=DEFAULT_USER):
+    """
+    Get all habits of a user from the database.
+    On a connection with a cache, repeated calls are served from memory and only habits written since are read again.
+    """
+    # completed and last_completed are maintained on every write, so no join with tbl_tracker is needed.
+    # The (user_id, name) index returns the rows of one user already ordered by name.
+    query_cache = getattr(db, "query_cache", None)
+    if query_cache is not None:
+        return query_cache.habit_rows(
+            db, user_id, lambda: db.execute(f"SELECT id, {ALL_HABITS_COLUMNS} FROM tbl_habit WHERE user_id = ?", (user_id,)),
+            lambda ids: db.execute(f"SELECT id, {ALL_HABITS_COLUMNS} FROM tbl_habit WHERE id IN (SELECT value FROM json_each(?))",
+                                   (json.dumps(ids),)))
+    cur = db.cursor()
+    cur.execute(f"SELECT {ALL_HABITS_COLUMNS} FROM tbl_habit WHERE user_id = ? ORDER BY name", (user_id,))
+    return cur.fetchall()
+
+@profiled
+def delete_habit(db, name, user_id=DEFAULT_USER):
+    """
+    Delete a habit. It disappears at once, its completions are removed later by purge_deleted.
+    Like delete_habits, it commits work pending on `db` first.
+    """
+    delete_habits(db, [name], user_id)
+
+
+@profiled
+def delete_habits(db, names, user_id=DEFAULT_USER):
+    """
+    Delete several habits of a user in one transaction. Returns the number of habits deleted.
+    Only the tbl_habit rows are deleted, each leaves a tombstone in tbl_habit_tombstones, so the
+    transaction does not depend on the length of the histories. Readers no longer see the habits and
+    their names can be used again right away. purge_deleted removes the completions in small transactions.
+    Deleting the rows must not cascade into the completions, and PRAGMA foreign_keys can only be
+    switched off outside a transaction: with foreign keys on, work pending on `db` is committed first.
+    """
+    rows = db.execute("SELECT id FROM tbl_habit WHERE user_id = ? AND name IN (SELECT value FROM json_each(?))",
+                      (user_id, json.dumps(list(names)))).fetchall()
+    habit_ids = json.dumps([row[0] for row in rows])
+    foreign_keys = db.execute("PRAGMA foreign_keys").fetchone()[0]
+    if foreign_keys:
+        db.commit()  # the pragma is a no-op inside a transaction
+        db.execute("PRAGMA foreign_keys = OFF")
+    try:
+        db.execute("INSERT INTO tbl_habit_tombstones (habit_id, user_id, name, deleted_at) "
+                   "SELECT id, user_id, name, datetime('now') FROM tbl_habit WHERE id IN (SELECT value FROM json_each(?))",
+                   (habit_ids,))
+        db.execute("DELETE FROM tbl_habit WHERE id IN (SELECT value FROM json_each(?))", (habit_ids,))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.execute(f"PRAGMA foreign_keys = {foreign_keys}")
+    if rows:
+        touch(db, [row[0] for row in rows], user_id, listing=True)
+    return len(rows)
+
+
+# Completions and runs of deleted habits, at most {limit}. The tombstones drive the join, so every
+# chunk only reads the index entries it deletes.
+PURGE_SQL = {
+    "tbl_tracker": """
+    DELETE FROM tbl_tracker WHERE rowid IN (
+        SELECT t.rowid FROM tbl_habit_tombstones d CROSS JOIN tbl_tracker t ON t.habit_id = d.habit_id LIMIT ?)
+    """,
+    "tbl_completion_runs": """
+    DELETE FROM tbl_completion_runs WHERE (habit_id, start_day) IN (
+        SELECT r.habit_id, r.start_day FROM tbl_habit_tombstones d CROSS JOIN tbl_completion_runs r ON r.habit_id = d.habit_id LIMIT ?)
+    """,
+}
+
+
+@profiled
+def purge_deleted(db, chunk_size=PURGE_CHUNK_SIZE, max_chunks=None):
+    """
+    Remove the completions and runs of deleted habits, at most `chunk_size` rows per transaction, so
+    that writers on other connections only wait for one chunk. With `max_chunks`, returns after that
+    many full chunks. Tombstones are dropped once nothing of their habit is left.
+    Returns the number of rows removed.
+    """
+    removed = chunks = 0
+    for sql in PURGE_SQL.values():
+        while True:
+            try:
+                count = db.execute(sql, (chunk_size,)).rowcount
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            removed += count
+            if count < chunk_size:
+                break
+            chunks += 1
+            if max_chunks is not None and chunks >= max_chunks:
+                return removed
+    db.execute("""
+    DELETE FROM tbl_habit_tombstones WHERE NOT EXISTS (SELECT 1 FROM tbl_tracker t WHERE t.habit_id = tbl_habit_tombstones.habit_id)
+      AND NOT EXISTS (SELECT 1 FROM tbl_completion_runs r WHERE r.habit_id = tbl_habit_tombstones.habit_id)
+    """)
+    db.commit()
+    return removed
+
+
+def purge_in_background(db_name="habits.db", chunk_size=PURGE_CHUNK_SIZE, pause=0.01):
+    """
+    Run purge_deleted on its own connection in a daemon thread, one chunk at a time with `pause`
+    seconds in between for other writers. Returns the thread, which ends when nothing is left to purge.
+    """
+    def run():
+        db = get_db(db_name)
+        try:
+            while _has_tombstones(db):
+                purge_deleted(db, chunk_size, max_chunks=1)
+                time.sleep(pause)
+        finally:
+            db.close()
+    thread = threading.Thread(target=run, name="purge-deleted", daemon=True)
+    thread.start()
+    return thread
@@ -1,39 +1,121 @@
-from db import add_habit, increment_habit
-from datetime import datetime, timedelta
+from array import array
+from bisect import bisect_left, bisect_right
+from cache import touch
+from db import DEFAULT_USER, _to_date, add_habit, increment_habit, next_streak
+from datetime import date, datetime, timedelta
+
+
+def _ordinal(value):
+    """Day ordinal (date.toordinal) of a date, a datetime, a 'YYYY-MM-DD' string or an ordinal."""
+    if isinstance(value, int):
+        return value
+    if isinstance(value, datetime):
+        return value.date().toordinal()
+    if isinstance(value, date):
+        return value.toordinal()
+    return datetime.strptime(value, "%Y-%m-%d").toordinal()
+
 
 class Habit:
-    def __init__(self, name, frequency, streak=0, last_completed=None, completed = 0): #hasi: completed added here
+    # no per-instance __dict__, and the history is a sorted array of 4-byte day ordinals instead of date objects
+    __slots__ = ("id", "user_id", "name", "frequency", "streak", "last_completed", "completed_tasks", "_days")
+
+    def __init__(self, name, frequency, streak=0, last_completed=None, completed = 0, habit_id=None, user_id=DEFAULT_USER): #hasi: completed added here
         """Habit: to track the habit of users"""
+        self.id = habit_id  # id in tbl_habit, set once the habit is stored
+        self.user_id = user_id
         self.name = name
         self.frequency = frequency
         self.streak = streak
         self.last_completed = last_completed
         self.completed_tasks = completed
-        self.completed_dates = []  # To save the completed dates
+        self._days = array("i")  # To save the completed dates, as sorted day ordinals
 
-    def mark_completed(self, db):
-        """Mark the habit as completed and update streak"""
-        completed_date = datetime.now().date()  # Record the current date when marking the habit as completed
-        self.completed_tasks += 1
-        self.completed_dates.append(completed_date)
-        self.streak += 1
-        self.last_completed = completed_date
+    @property
+    def completed_dates(self):
+        """The completed dates as a list of datetime.date, oldest first."""
+        return [date.fromordinal(day) for day in self._days]
+
+    @completed_dates.setter
+    def completed_dates(self, dates):
+        self._days = array("i", sorted({_ordinal(value) for value in dates}))
+
+    @property
+    def completion_days(self):
+        """The completed dates as a sorted array of day ordinals, without creating date objects."""
+        return self._days
+
+    def add_completion(self, value):
+        """Add a completed date to the history, keeping it sorted. Returns False if it was already there."""
+        day = _ordinal(value)
+        index = bisect_left(self._days, day)
+        if index < len(self._days) and self._days[index] == day:
+            return False
+        self._days.insert(index, day)
+        return True
 
-        # Save to the database
-        increment_habit(db, self.name)
+    def is_completed_on(self, value):
+        """True if the habit was completed on the given date, O(log n)."""
+        day = _ordinal(value)
+        index = bisect_left(self._days, day)
+        return index < len(self._days) and self._days[index] == day
+
+    def count_completed_between(self, start, end):
+        """Number of completions from `start` to `end`, both included, O(log n)."""
+        return bisect_right(self._days, _ordinal(end)) - bisect_left(self._days, _ordinal(start))
+
+    def completed_between(self, start, end):
+        """The completed dates from `start` to `end`, both included."""
+        days = self._days[bisect_left(self._days, _ordinal(start)):bisect_right(self._days, _ordinal(end))]
+        return [date.fromordinal(day) for day in days]
+
+    def mark_completed(self, db, write_behind=None, completed_date=None):
+        """
+        Mark the habit as completed, today unless `completed_date` is given, and update streak.
+        Returns True if a completion was recorded.
+        With a writebehind.WriteBehindQueue, the completion is only queued and the streak is updated here.
+        """
+        # Record the current date when marking the habit as completed
+        completed_date = _to_date(completed_date) if completed_date else datetime.now().date()
+
+        if write_behind is not None:
+            already = self.is_completed_on(completed_date) or str(self.last_completed) == completed_date.isoformat()
+            if already or not write_behind.submit(self.name, completed_date, self.user_id):
+                return False
+            if self.last_completed and completed_date < _to_date(self.last_completed):
+                # backdated: the database repairs the streak from the history, keep ours until the habit is reloaded
+                streak = self.streak
+            else:
+                streak = next_streak(self.frequency, self.streak, self.last_completed, completed_date)
+        else:
+            # Save to the database, it returns None if the habit was already completed today
+            streak = increment_habit(db, self.name, completed_date, self.user_id)
+        if streak is None:
+            return False
+        self.record(streak, completed_date)
+        return True
+
+    def record(self, streak, completed_date):
+        """Update the object after a completion on `completed_date` was stored, `streak` is the new streak."""
+        self.completed_tasks += 1
+        self.add_completion(completed_date)
+        self.streak = streak
+        if self.last_completed is None or str(self.last_completed) < str(completed_date):
+            self.last_completed = completed_date
 
 
     def __str__(self):
-        dates = ", ".join(map(str, self.completed_dates))  # Get date into str
         return f"Habit: {self.name}, Frequency: {self.frequency}, Completed: {self.completed_tasks}, Streak: {self.streak}, Last Completed: {self.last_completed}"#, Dates: [{dates}] #hasi: self.last_completed added here and [{dates}] commented out
 
     def store(self, db):
         """Store habit in the database"""
-        add_habit(db, self.name, self.frequency)
+        self.id = add_habit(db, self.name, self.frequency, self.user_id)
 
     def add_event(self, db, date: str = None):
-        """Add a completed event to the habit"""
-        increment_habit(db, self.name, date)
+        """Add a completed event to the habit, `date` defaults to today"""
+        streak = increment_habit(db, self.name, date, self.user_id)
+        if streak is not None:
+            self.record(streak, _to_date(date) if date else datetime.now().date())
 
     def reset_streak(self, db):
         """Reset the habit streak in the database and the object"""
@@ -41,8 +123,9 @@ class Habit:
         self.last_completed = None
         # Update the database
         cur = db.cursor()
-        cur.execute("UPDATE tbl_habit SET streak = ?, last_completed = ? WHERE name = ?", (0, None, self.name))
+        cur.execute("UPDATE tbl_habit SET streak = ?, last_completed = ? WHERE user_id = ? AND name = ?", (0, None, self.user_id, self.name))
         db.commit()
+        touch(db, None if self.id is None else [self.id], self.user_id)
 
     def get_current_streak(self):
         """Returns the current streak from the database"""
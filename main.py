@@ -1,6 +1,8 @@
-from db import get_db, get_all_habits, delete_habit
-from habit import Habit
+import sys
+from db import get_db, purge_in_background
+from registry import HabitRegistry
 from analyse import plot_streaks_as_table
+from parallel import database_file
 
 
 def display_menu():
@@ -17,15 +19,13 @@ def display_menu():
 
 def main():
 
-    db = get_db()
+    db = get_db(cache=True)
 
-    ls_habits = []
     # Load existing habits from the database
-    for habit_data in get_all_habits(db):
-        habit_name, frequency, streak, completed, last_completed = habit_data
-        ls_habits.append(Habit(habit_name, frequency, streak, last_completed, completed))
+    habits = HabitRegistry(db)
+    purge = None  # the purge thread, one at a time; a running one also purges later deletes
 
-    print(f"Loaded habits: {get_all_habits(db)}")
+    print(f"Loaded habits: {[habit.name for habit in habits]}")
 
     default_choices = [
         "1. English learning",
@@ -58,40 +58,49 @@ def main():
                 except ValueError:
                     print("Invalid input. Please enter a number or type 'new'.")
                     continue
-            existing_habits = get_all_habits(db)
-            habit_names = [habit[0] for habit in existing_habits]
-            if custom_habit in habit_names:
+            if custom_habit in habits:
                 print(f"Habit '{custom_habit}' already exists! Please choose a different name.")
                 continue
             frequency = input("Enter the frequency (daily, weekly, monthly, yearly): ").lower()
             if frequency in ['daily', 'weekly', 'monthly', 'yearly']:
-                new_habit = Habit(custom_habit, frequency)
-                new_habit.store(db)
-                ls_habits.append(new_habit)
+                habits.add(custom_habit, frequency)
                 print(f"Habit '{custom_habit}' added with frequency '{frequency}'.")
             else:
                 print("Invalid frequency. Please choose from daily, weekly, monthly, or yearly.")
 
         elif choice == '2':  # Mark a Habit as Completed
+            ls_habits = list(habits)
             if not ls_habits:
                 print("No habits to mark as completed.")
                 continue
-            print("Select a habit to mark as completed:")
+            print("Select the habits to mark as completed:")
             for index, habit in enumerate(ls_habits):
                 print(f"{index + 1}. {habit.name} (Frequency: {habit.frequency})")
-            habit_index = int(input("Enter the habit number: ")) - 1
-            if 0 <= habit_index < len(ls_habits):
-                ls_habits[habit_index].mark_completed(db)
-
-
+            selection = input("Enter habit numbers separated by commas, or 'due' for all daily habits due today: ").strip()
+            if selection.lower() == 'due':
+                selected = habits.due('daily')
             else:
-                print("Invalid habit number.")
+                try:
+                    indexes = [int(part) - 1 for part in selection.split(',') if part.strip()]
+                except ValueError:
+                    print("Invalid input. Please enter numbers separated by commas.")
+                    continue
+                if not indexes or not all(0 <= index < len(ls_habits) for index in indexes):
+                    print("Invalid habit number.")
+                    continue
+                selected = [ls_habits[index] for index in indexes]
+
+            # 一个事务记录所有选中的习惯
+            recorded = habits.check_in([habit.name for habit in selected])
+            for habit in recorded:
+                print(f"Habit '{habit.name}' marked as completed, streak: {habit.streak}.")
+            print(f"Checked in {len(recorded)} habits, {len(selected) - len(recorded)} were already completed today.")
 
         elif choice == '3':  # View Habits
-            if not ls_habits:
+            if not len(habits):
                 print("No habits to display.")
             else:
-                for habit in ls_habits:
+                for habit in habits:
                     print(habit)
                     if habit.frequency == 'daily' and habit.get_current_streak() >= 21:
                         print("  → You've developed a good habit! Keep it up!")
@@ -101,6 +110,7 @@ def main():
 
 
         elif choice == '5':  # Delete a Habit
+            ls_habits = list(habits)
 
             if not ls_habits:
                 print("No habits to delete.")
@@ -118,11 +128,12 @@ def main():
 
                 if 0 <= habit_index < len(ls_habits):
 
-                    habit_to_delete = ls_habits.pop(habit_index)
-
-                    # 使用 delete_habit 函数删除数据库中的习惯和跟踪数据
+                    # 删除数据库中的习惯和跟踪数据
 
-                    delete_habit(db, habit_to_delete.name)
+                    habit_to_delete = habits.remove(ls_habits[habit_index].name)
+                    # the completions are removed while the menu stays usable
+                    if purge is None or not purge.is_alive():
+                        purge = purge_in_background(database_file(db))
 
                     print(f"Habit '{habit_to_delete.name}' has been deleted.")
 
@@ -144,4 +155,7 @@ def main():
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        import cli
+        sys.exit(cli.main(sys.argv[1:]))
     main()
@@ -0,0 +1,115 @@
+"""
+Process-parallel analysis across habits.
+
+Habits are split into shards of consecutive ids with about the same number of completions each.
+Every shard is analysed in a worker of a ProcessPoolExecutor that opens its own read-only
+connection to the database file, so only habit ids go to the workers and only the per-habit
+results come back. Results are merged in shard order (by habit id), so they do not depend on the
+number of workers or on which worker finishes first.
+In-memory databases can not be shared between processes and are always analysed serially.
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from db import connect, history_stats
+from periods import day_number
+
+
+def database_file(db):
+    """Return the file of the main database of a connection, or None for an in-memory database."""
+    for _, name, path in db.execute("PRAGMA database_list").fetchall():
+        if name == "main":
+            return path or None
+    return None
+
+
+def default_workers():
+    """One worker per CPU core."""
+    return os.cpu_count() or 1
+
+
+def shard_habits(db, shards, habit_ids=None):
+    """
+    Split all habits, or `habit_ids`, into at most `shards` lists of consecutive ids with about
+    the same number of completions, based on the materialized total_completions.
+    """
+    if habit_ids is None:
+        rows = db.execute("SELECT id, COALESCE(total_completions, 0) FROM tbl_habit ORDER BY id").fetchall()
+    else:
+        # only the rows of `habit_ids`, looked up by id, not all habits of all users
+        rows = db.execute("SELECT id, COALESCE(total_completions, 0) FROM tbl_habit "
+                          "WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id",
+                          (json.dumps(sorted(int(habit_id) for habit_id in habit_ids)),)).fetchall()
+    if not rows:
+        return []
+    ids, totals = (np.array(column, dtype=np.int64) for column in zip(*rows))
+    # +1 per habit, so habits without completions are spread out as well
+    weight = np.cumsum(totals + 1)
+    bounds = np.searchsorted(weight, weight[-1] * np.arange(1, shards) / shards, side="right")
+    return [shard.tolist() for shard in np.split(ids, bounds) if len(shard)]
+
+
+def _open_reader(db_name):
+    conn = connect(db_name)
+    conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+def _history_stats_shard(db_name, habit_ids):
+    conn = _open_reader(db_name)
+    try:
+        return history_stats(conn, habit_ids)
+    finally:
+        conn.close()
+
+
+def _matrix_shard(db_name, habit_ids, start, end, packed):
+    from activity import completion_matrix
+    conn = _open_reader(db_name)
+    try:
+        return completion_matrix(conn, start, end, habit_ids, packed).bits
+    finally:
+        conn.close()
+
+
+def map_shards(db, func, shards, *args):
+    """
+    Call func(db_name, shard, *args) for every shard of habit ids, each in its own worker process.
+    `func` must be a module level function. Returns the results in shard order.
+    """
+    db_name = database_file(db)
+    if db_name is None:
+        raise ValueError("an in-memory database can not be analysed in parallel")
+    if not shards:
+        return []
+    with ProcessPoolExecutor(max_workers=len(shards)) as pool:
+        return list(pool.map(func, [db_name] * len(shards), shards, *([arg] * len(shards) for arg in args)))
+
+
+def parallel_history_stats(db, workers, habit_ids=None):
+    """history_stats computed by `workers` processes, falls back to one process for in-memory databases."""
+    if workers <= 1 or database_file(db) is None:
+        return history_stats(db, habit_ids)
+    stats = {}
+    for shard_stats in map_shards(db, _history_stats_shard, shard_habits(db, workers, habit_ids)):
+        stats.update(shard_stats)
+    return stats
+
+
+def parallel_completion_matrix(db, workers, start, end, habit_ids=None, packed=None):
+    """activity.completion_matrix built by `workers` processes, each filling the rows of one shard."""
+    from activity import CompletionMatrix, PACK_DAYS, completion_matrix
+    if workers <= 1 or database_file(db) is None:
+        return completion_matrix(db, start, end, habit_ids, packed)
+    start, end = day_number(start), day_number(end)
+    days = max(end - start + 1, 0)
+    packed = days > PACK_DAYS if packed is None else packed
+    shards = shard_habits(db, workers, habit_ids)
+    ids = np.array([habit_id for shard in shards for habit_id in shard], dtype=np.int64)
+    blocks = map_shards(db, _matrix_shard, shards, start, end, packed)
+    width = -(-days // 8) if packed else days
+    bits = np.concatenate(blocks) if blocks else np.zeros((0, width), dtype=np.uint8 if packed else bool)
+    return CompletionMatrix(ids, start, days, bits, packed)
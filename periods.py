@@ -0,0 +1,109 @@
+"""
+Period calendars for habit frequencies.
+
+A calendar maps day numbers (days since 1970-01-01, the integer value of NumPy datetime64[D])
+to integer period ordinals, so that two consecutive periods always differ by exactly one.
+Streaks of daily, weekly, monthly and yearly habits are all computed by the same vectorized code
+over those ordinals.
+"""
+import numpy as np
+from datetime import date
+
+
+def _daily(days):
+    return days
+
+def _iso_week(days):
+    # 1970-01-01 was a Thursday, shifting by 3 days makes every ISO week start on a Monday
+    return (days + 3) // 7
+
+def _monthly(days):
+    return days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+
+def _yearly(days):
+    return days.astype("datetime64[D]").astype("datetime64[Y]").astype(np.int64)
+
+
+CALENDARS = {
+    "daily": _daily,
+    "weekly": _iso_week,
+    "monthly": _monthly,
+    "yearly": _yearly,
+}
+
+
+def register_calendar(frequency, calendar):
+    """Register a calendar for a new frequency. `calendar` maps an int64 array of day numbers to period ordinals."""
+    CALENDARS[frequency] = calendar
+
+
+def get_calendar(frequency):
+    """Return the calendar of a frequency. Habits without a known frequency are treated as daily."""
+    return CALENDARS.get(frequency, _daily)
+
+
+def day_number(value):
+    """Convert a date or an ISO date string to its day number."""
+    return int(np.datetime64(value, "D").astype(np.int64))
+
+
+def to_periods(frequencies, days):
+    """
+    Map day numbers to period ordinals, `frequencies` is the frequency of each day (array of str).
+    Each calendar is applied once to all days that use it.
+    """
+    periods = np.empty_like(days)
+    for frequency in np.unique(frequencies):
+        mask = frequencies == frequency
+        periods[mask] = get_calendar(frequency)(days[mask])
+    return periods
+
+
+def period_of(frequency, day):
+    """Return the period ordinal of a single day number."""
+    return int(get_calendar(frequency)(np.array([day], dtype=np.int64))[0])
+
+
+def streaks_from_periods(ids, periods):
+    """
+    Vectorized gaps-and-islands over completions sorted by (habit id, period).
+    A run continues while consecutive periods differ by exactly one, several completions
+    in the same period extend a run only once.
+    Returns (habit_ids, totals, last_runs, longests, last_periods) with one entry per habit, where
+    totals counts the completions and last_runs is the length of the run ending with the latest one.
+    """
+    n = len(ids)
+    new_habit = np.ones(n, dtype=bool)
+    new_habit[1:] = ids[1:] != ids[:-1]
+    habit_starts = np.flatnonzero(new_habit)
+    totals = np.diff(np.append(habit_starts, n))
+    last_periods = periods[np.append(habit_starts[1:], n) - 1]
+
+    keep = new_habit.copy()
+    keep[1:] |= periods[1:] != periods[:-1]
+    new_habit, periods = new_habit[keep], periods[keep]
+    new_run = new_habit.copy()
+    new_run[1:] |= np.diff(periods) != 1
+
+    run_starts = np.flatnonzero(new_run)
+    run_lengths = np.diff(np.append(run_starts, len(periods)))
+    run_first_of_habit = np.flatnonzero(new_habit[run_starts])
+    last_runs = run_lengths[np.append(run_first_of_habit[1:], len(run_starts)) - 1]
+    longests = np.maximum.reduceat(run_lengths, run_first_of_habit)
+    return ids[habit_starts], totals, last_runs, longests, last_periods
+
+
+def current_streaks(last_runs, last_periods, current_periods):
+    """The latest run only counts as current if it reaches the current or the previous period."""
+    return np.where(last_periods >= current_periods - 1, last_runs, 0)
+
+
+def habit_streaks(frequency, days, today=None):
+    """Return (total, current, longest) streak of one habit from its sorted day numbers."""
+    if len(days) == 0:
+        return 0, 0, 0
+    calendar = get_calendar(frequency)
+    periods = calendar(np.asarray(days, dtype=np.int64))
+    _, totals, last_runs, longests, last_periods = streaks_from_periods(np.zeros(len(periods), dtype=np.int64), periods)
+    current = current_streaks(last_runs, last_periods, period_of(frequency, day_number(today or date.today())))
+    return int(totals[0]), int(current[0]), int(longests[0])
@@ -0,0 +1,302 @@
+"""
+Opt-in profiling of the database layer.
+
+    profiler = profiling.enable(slow_ms=20)
+    db = get_db()           # connections opened now are instrumented
+    ...
+    print(profiler.report())
+    profiler.dump("profile.prom")  # or profile.json
+
+While enabled, every db.py function decorated with @profiled records its latency, and connections
+opened by db.connect record for every SQL statement the latency of execute(), the time spent
+fetching, the rows returned and changed, and the SQLite VM steps (counted by a progress handler
+every STEPS_PER_TICK instructions, a measure of the rows scanned). Statements slower than `slow_ms` get their EXPLAIN QUERY PLAN
+captured once. Commits are counted and timed, their time includes the syncs SQLite does on commit
+(with WAL and synchronous=NORMAL those only happen at checkpoints).
+Latencies are kept in histograms with power of two buckets, so memory does not grow with the calls.
+Disabled, the decorator costs one global lookup per call and connections are plain db.Connection objects.
+"""
+import functools
+import json
+import re
+import sqlite3
+import threading
+import time
+
+BUCKETS_US = [2 ** exponent for exponent in range(27)]  # upper bounds, 1 µs to about 67 s
+STEPS_PER_TICK = 100  # VM instructions between two calls of the progress handler
+
+_active = None  # the Profiler while profiling is enabled
+
+
+class Histogram:
+    """Latency histogram with power of two buckets in µs."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_US) + 1)  # the last bucket is +Inf
+        self.count = 0
+        self.total = 0.0  # seconds
+        self.max = 0.0
+
+    def add(self, seconds):
+        micros = seconds * 1e6
+        self.counts[min(max(int(micros) - 1, 0).bit_length(), len(BUCKETS_US))] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding quantile `q`, in seconds."""
+        rank, seen = q * self.count, 0
+        for bound, count in zip(BUCKETS_US, self.counts):
+            seen += count
+            if seen >= rank and seen:
+                return min(bound / 1e6, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {"count": self.count, "total_s": self.total, "mean_s": self.total / self.count if self.count else 0.0,
+                "p50_s": self.quantile(0.5), "p95_s": self.quantile(0.95), "p99_s": self.quantile(0.99), "max_s": self.max,
+                "buckets_us": dict(zip(map(str, BUCKETS_US + ["+Inf"]), self.counts))}
+
+
+class QueryStats:
+    """What was measured for one SQL statement."""
+
+    def __init__(self):
+        self.latency = Histogram()  # execute() and executemany()
+        self.fetch = 0.0  # seconds spent fetching the rows
+        self.rows = 0  # rows returned
+        self.changes = 0  # rows inserted, updated or deleted
+        self.steps = 0  # VM instructions, in steps of STEPS_PER_TICK
+        self.plan = None  # EXPLAIN QUERY PLAN, captured the first time the statement was slow
+
+    def as_dict(self):
+        return {"latency": self.latency.as_dict(), "fetch_s": self.fetch, "rows_returned": self.rows,
+                "rows_changed": self.changes, "vm_steps": self.steps, "plan": self.plan}
+
+
+def _normalize(sql):
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+class Profiler:
+    """Collects the measurements of all instrumented functions and connections of the process."""
+
+    def __init__(self, slow_ms=50):
+        self.slow_ms = slow_ms
+        self.calls = {}  # function name -> Histogram
+        self.queries = {}  # normalized SQL -> QueryStats
+        self._statements = {}  # SQL as executed -> QueryStats, saves normalizing it on every execute
+        self.commits = Histogram()
+        self._lock = threading.Lock()
+
+    def record_call(self, name, seconds):
+        with self._lock:
+            self.calls.setdefault(name, Histogram()).add(seconds)
+
+    def query(self, sql):
+        """The QueryStats of a statement, created on first use."""
+        stats = self._statements.get(sql)
+        if stats is None:
+            with self._lock:
+                stats = self._statements[sql] = self.queries.setdefault(_normalize(sql), QueryStats())
+        return stats
+
+    def record_commit(self, seconds):
+        with self._lock:
+            self.commits.add(seconds)
+
+    def as_dict(self):
+        with self._lock:
+            return {"functions": {name: histogram.as_dict() for name, histogram in self.calls.items()},
+                    "queries": {sql: stats.as_dict() for sql, stats in self.queries.items()},
+                    "commits": self.commits.as_dict(), "slow_ms": self.slow_ms}
+
+    def report(self, top=10):
+        """The `top` functions and statements by total time, and the commits, as text."""
+        lines = [f"{'function':<28} {'calls':>8} {'total ms':>10} {'mean µs':>10} {'p95 µs':>10}"]
+        for name, histogram in sorted(self.calls.items(), key=lambda item: -item[1].total)[:top]:
+            lines.append(f"{name:<28} {histogram.count:>8,} {histogram.total * 1e3:>10,.1f} "
+                         f"{histogram.total / histogram.count * 1e6:>10,.0f} {histogram.quantile(0.95) * 1e6:>10,.0f}")
+        lines.append(f"\n{'calls':>8} {'total ms':>10} {'rows':>10} {'changed':>8} {'vm steps':>10}  statement")
+        for sql, stats in sorted(self.queries.items(), key=lambda item: -(item[1].latency.total + item[1].fetch))[:top]:
+            lines.append(f"{stats.latency.count:>8,} {(stats.latency.total + stats.fetch) * 1e3:>10,.1f} {stats.rows:>10,} "
+                         f"{stats.changes:>8,} {stats.steps:>10,}  {sql[:100]}")
+            if stats.plan:
+                lines.extend(f"{'':>52}plan: {step}" for step in stats.plan)
+        lines.append(f"\ncommits: {self.commits.count:,}, {self.commits.total * 1e3:,.1f} ms in total")
+        return "\n".join(lines)
+
+    def prometheus(self):
+        """The histograms in the Prometheus text exposition format."""
+        lines = []
+
+        def histogram(metric, labels, data):
+            cumulative = 0
+            for bound, count in zip(BUCKETS_US + ["+Inf"], data.counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else f"{bound / 1e6:g}"
+                lines.append(f'{metric}_bucket{{{labels}le="{le}"}} {cumulative}')
+            lines.append(f"{metric}_sum{{{labels.rstrip(',')}}} {data.total:.9f}")
+            lines.append(f"{metric}_count{{{labels.rstrip(',')}}} {data.count}")
+
+        with self._lock:
+            lines.append("# TYPE habits_db_call_seconds histogram")
+            for name, data in sorted(self.calls.items()):
+                histogram("habits_db_call_seconds", f'function="{name}",', data)
+            lines.append("# TYPE habits_db_query_seconds histogram")
+            queries = sorted(self.queries.items())
+            for sql, stats in queries:
+                histogram("habits_db_query_seconds", f'statement="{_label(sql)}",', stats.latency)
+            for metric, field in (("rows_returned", "rows"), ("rows_changed", "changes"), ("vm_steps", "steps")):
+                lines.append(f"# TYPE habits_db_query_{metric}_total counter")
+                lines.extend(f'habits_db_query_{metric}_total{{statement="{_label(sql)}"}} {getattr(stats, field)}'
+                             for sql, stats in queries)
+            lines.append("# TYPE habits_db_commit_seconds histogram")
+            histogram("habits_db_commit_seconds", "", self.commits)
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """Write the measurements to `path`, as JSON if it ends in .json, otherwise in the Prometheus text format."""
+        content = json.dumps(self.as_dict(), indent=2) if path.endswith(".json") else self.prometheus()
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+
+def _label(sql):
+    return sql[:200].replace("\\", "\\\\").replace('"', '\\"')
+
+
+def enable(slow_ms=50):
+    """Start profiling, returns the Profiler. Only connections opened from now on are instrumented."""
+    global _active
+    _active = Profiler(slow_ms)
+    return _active
+
+
+def disable():
+    """Stop profiling, returns the Profiler that was active."""
+    global _active
+    profiler, _active = _active, None
+    return profiler
+
+
+def active():
+    """The active Profiler, or None."""
+    return _active
+
+
+def profiled(func):
+    """Record the latency of every call of `func` while profiling is enabled."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = _active
+        if profiler is None:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.record_call(name, time.perf_counter() - start)
+    return wrapper
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Cursor that reports to the profiler of its connection."""
+    _stats = None
+
+    def _measure(self, run, sql, parameters):
+        connection = self.connection
+        self._stats = connection.current = stats = connection.profiler.query(sql)
+        changes = connection.total_changes
+        start = time.perf_counter()
+        try:
+            return run()
+        finally:
+            elapsed = time.perf_counter() - start
+            stats.latency.add(elapsed)
+            stats.changes += connection.total_changes - changes
+            if elapsed * 1e3 >= connection.profiler.slow_ms and stats.plan is None:
+                stats.plan = connection.explain(sql, parameters)
+
+    def execute(self, sql, parameters=()):
+        return self._measure(lambda: super(ProfiledCursor, self).execute(sql, parameters), sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        rows = seq_of_parameters if isinstance(seq_of_parameters, (list, tuple)) else list(seq_of_parameters)
+        return self._measure(lambda: super(ProfiledCursor, self).executemany(sql, rows), sql, rows[0] if rows else ())
+
+    def _fetched(self, fetch, *args):
+        stats = self.connection.current = self._stats
+        start = time.perf_counter()
+        rows = fetch(*args)
+        if stats is not None:
+            stats.fetch += time.perf_counter() - start
+            stats.rows += len(rows) if isinstance(rows, list) else rows is not None
+        return rows
+
+    def fetchone(self):
+        return self._fetched(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._fetched(super().fetchmany, size or self.arraysize)
+
+    def fetchall(self):
+        return self._fetched(super().fetchall)
+
+    def __next__(self):
+        stats = self.connection.current = self._stats
+        start = time.perf_counter()
+        row = super().__next__()
+        if stats is not None:
+            stats.fetch += time.perf_counter() - start
+            stats.rows += 1
+        return row
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """Connection whose cursors, execute() and commit() report to the profiler active when it was opened."""
+    query_cache = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.profiler = _active
+        self.current = None  # QueryStats of the statement SQLite is running
+        self.set_progress_handler(self._tick, STEPS_PER_TICK)
+
+    def _tick(self):
+        if self.current is not None:
+            self.current.steps += STEPS_PER_TICK
+        return 0
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            self.profiler.record_commit(time.perf_counter() - start)
+
+    def explain(self, sql, parameters):
+        """EXPLAIN QUERY PLAN of a statement as a list of steps, None for statements that can not be explained."""
+        if not re.match(r"\s*(WITH|SELECT|INSERT|UPDATE|DELETE|REPLACE)\b", sql, re.IGNORECASE):
+            return None
+        current, self.current = self.current, None
+        try:
+            return [row[-1] for row in super().execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()]
+        except sqlite3.Error:
+            return None
+        finally:
+            self.current = current
@@ -0,0 +1,150 @@
+from collections import OrderedDict
+from datetime import date
+
+from db import DEFAULT_USER, _to_date, check_in, delete_habit, due_habits, get_habit, get_habit_rows, get_habit_tracking_data
+from habit import Habit
+
+
+def _habit_from_row(row, user_id=DEFAULT_USER):
+    habit_id, name, frequency, streak, completed, last_completed = row
+    return Habit(name, frequency, streak or 0, last_completed, completed or 0, habit_id=habit_id, user_id=user_id)
+
+
+class HabitRegistry:
+    """
+    In-memory index of Habit objects by name and by id, writing through to the database.
+
+    By default all habits are loaded once and every lookup, duplicate check and removal is a
+    dict operation. With `max_size`, at most that many habits are kept in memory in LRU order:
+    habits missing from the cache are loaded from the database when they are accessed, and
+    their completion history is only read when it is asked for.
+    A registry holds the habits of one user. With `write_behind`, a writebehind.WriteBehindQueue,
+    completions are queued and written in batches instead of one transaction each.
+    """
+
+    def __init__(self, db, max_size=None, user_id=DEFAULT_USER, write_behind=None):
+        self.db = db
+        self.max_size = max_size
+        self.user_id = user_id
+        self.write_behind = write_behind
+        self._by_name = OrderedDict()
+        self._by_id = {}
+        if max_size is None:
+            for row in get_habit_rows(db, user_id):
+                self._remember(_habit_from_row(row, user_id))
+
+    def _remember(self, habit):
+        self._by_name[habit.name] = habit
+        self._by_name.move_to_end(habit.name)
+        if habit.id is not None:
+            self._by_id[habit.id] = habit
+        if self.max_size is not None:
+            while len(self._by_name) > self.max_size:
+                _, evicted = self._by_name.popitem(last=False)
+                self._by_id.pop(evicted.id, None)
+
+    def _forget(self, habit):
+        self._by_name.pop(habit.name, None)
+        self._by_id.pop(habit.id, None)
+
+    def _load(self, name=None, habit_id=None):
+        if self.max_size is None:
+            return None  # everything is loaded already
+        row = get_habit(self.db, name=name, habit_id=habit_id, user_id=self.user_id)
+        if row is None:
+            return None
+        habit = _habit_from_row(row, self.user_id)
+        self._remember(habit)
+        return habit
+
+    def get(self, name, history=False):
+        """Return the habit called `name`, or None. With `history`, its completed dates are loaded too."""
+        habit = self._by_name.get(name)
+        if habit is not None:
+            if self.max_size is not None:
+                self._by_name.move_to_end(name)
+        else:
+            habit = self._load(name=name)
+        if habit is not None and history:
+            self.load_history(habit)
+        return habit
+
+    def get_by_id(self, habit_id):
+        """Return the habit with the given id, or None."""
+        habit = self._by_id.get(habit_id)
+        if habit is not None:
+            if self.max_size is not None:
+                self._by_name.move_to_end(habit.name)
+            return habit
+        return self._load(habit_id=habit_id)
+
+    def load_history(self, habit):
+        """Fill habit.completed_dates from the database unless it is loaded already."""
+        if len(habit.completion_days) < habit.completed_tasks:
+            habit.completed_dates = [date.fromisoformat(row[0]) for row in get_habit_tracking_data(self.db, habit.name, self.user_id)]
+        return habit.completed_dates
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __len__(self):
+        if self.max_size is None:
+            return len(self._by_name)
+        return self.db.execute("SELECT COUNT(*) FROM tbl_habit WHERE user_id = ?", (self.user_id,)).fetchone()[0]
+
+    def __iter__(self):
+        """Iterate over all habits ordered by name. In LRU mode cached objects are reused but not added."""
+        if self.max_size is None:
+            return iter(sorted(self._by_name.values(), key=lambda habit: habit.name))
+        return (self._by_name.get(row[1]) or _habit_from_row(row, self.user_id) for row in get_habit_rows(self.db, self.user_id))
+
+    def add(self, name, frequency):
+        """Store a new habit and return it. Raises sqlite3.IntegrityError if the name is taken."""
+        habit = Habit(name, frequency, user_id=self.user_id)
+        habit.store(self.db)
+        self._remember(habit)
+        return habit
+
+    def remove(self, name):
+        """Delete a habit with its completions. Returns the removed habit, or None if it does not exist."""
+        habit = self.get(name)
+        if habit is None:
+            return None
+        delete_habit(self.db, name, self.user_id)
+        self._forget(habit)
+        return habit
+
+    def mark_completed(self, name):
+        """Mark a habit as completed today. Returns the habit, or None if it does not exist."""
+        habit = self.get(name)
+        if habit is not None:
+            habit.mark_completed(self.db, self.write_behind)
+        return habit
+
+    def check_in(self, names, completed_date=None):
+        """
+        Mark several habits as completed on `completed_date` (default: today) in one transaction,
+        the Habit objects are updated in place. Returns the habits that were recorded; habits that
+        were already completed that day or do not exist are left out.
+        """
+        completed_date = _to_date(completed_date) if completed_date else date.today()
+        if self.write_behind is not None:
+            habits = [self.get(name) for name in names]
+            return [habit for habit in habits if habit is not None and habit.mark_completed(self.db, self.write_behind, completed_date)]
+        recorded = []
+        for name, streak in check_in(self.db, names, completed_date, self.user_id).items():
+            if streak is None or streak is False:
+                continue
+            habit = self.get(name)
+            if habit is None:
+                # added by another connection after the habits were loaded, its row already counts this completion
+                habit = _habit_from_row(get_habit(self.db, name=name, user_id=self.user_id), self.user_id)
+                self._remember(habit)
+            else:
+                habit.record(streak, completed_date)
+            recorded.append(habit)
+        return recorded
+
+    def due(self, frequency=None, today=None):
+        """The habits that are not completed in their current period yet, ordered by name."""
+        return [habit for habit in map(self.get, due_habits(self.db, today, frequency, self.user_id)) if habit is not None]
@@ -0,0 +1,113 @@
+"""
+Rendering of streak tables as text, HTML and matplotlib images.
+
+matplotlib is only imported when a table is actually drawn, so starting the tracker or running a
+CLI command does not pay its import cost. Tables are either shown in a window or, headless with
+the Agg backend, written to an image file whose format follows the extension (.png, .svg, .pdf).
+Text and HTML tables are built as one string, their cost only depends on the number of rows given.
+"""
+import html
+import os
+from datetime import timedelta
+
+IMAGE_FORMATS = (".png", ".svg", ".pdf")
+
+
+def _pyplot(headless):
+    import matplotlib
+    if headless:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def render_table(rows, columns, title, path=None):
+    """
+    Draw `rows` below the header `columns` as a table.
+    Without `path` the table is shown with plt.show(), otherwise it is saved to `path`.
+    """
+    plt = _pyplot(headless=path is not None)
+    fig, ax = plt.subplots(figsize=(8, max(len(rows), 1) * 0.5))
+    ax.axis("tight")
+    ax.axis("off")
+
+    table_data = [list(columns)] + [list(row) for row in rows]
+    table = ax.table(cellText=table_data, colLabels=None, loc="center", cellLoc="center")
+    table.auto_set_font_size(False)
+    table.set_fontsize(10)
+    table.auto_set_column_width(col=list(range(len(columns))))
+
+    plt.title(title, pad=10)
+    if path is None:
+        plt.show()
+    else:
+        fig.savefig(path, bbox_inches="tight")
+        plt.close(fig)
+    return path
+
+
+def render_heatmap(grid, first_day, title, path=None):
+    """
+    Draw a 7 × weeks calendar heatmap (see activity.calendar_heatmap) whose first cell is the Monday
+    of the week of `first_day`. Shown with plt.show() without `path`, otherwise saved to `path`.
+    """
+    plt = _pyplot(headless=path is not None)
+    weeks = grid.shape[1]
+    fig, ax = plt.subplots(figsize=(max(weeks * 0.18, 4), 2.2))
+    image = ax.imshow(grid, cmap="Greens", aspect="equal", interpolation="nearest", vmin=0)
+    ax.set_yticks(range(7), ["Mon", "", "Wed", "", "Fri", "", "Sun"])
+    # one label per month, at the first week that starts in it
+    monday = first_day - timedelta(days=first_day.weekday())
+    mondays = [monday + timedelta(weeks=week) for week in range(weeks)]
+    months = [week for week in range(weeks) if week == 0 or mondays[week].month != mondays[week - 1].month]
+    ax.set_xticks(months, [mondays[week].strftime("%b %Y" if mondays[week].month == 1 else "%b") for week in months])
+    ax.tick_params(length=0, labelsize=8)
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    fig.colorbar(image, ax=ax, shrink=0.6, label="completions")
+    ax.set_title(title, pad=10)
+    if path is None:
+        plt.show()
+    else:
+        fig.savefig(path, bbox_inches="tight")
+        plt.close(fig)
+    return path
+
+
+def render_text(rows, columns, title=None, footer=None):
+    """Return `rows` as a fixed width text table, columns are as wide as their longest cell."""
+    cells = [[str(cell) for cell in row] for row in rows]
+    widths = [max([len(column)] + [len(row[i]) for row in cells]) for i, column in enumerate(columns)]
+    lines = [title] if title else []
+    lines.append("  ".join(column.ljust(width) for column, width in zip(columns, widths)).rstrip())
+    lines.append("=" * (sum(widths) + 2 * (len(widths) - 1)))
+    lines.extend("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in cells)
+    if footer:
+        lines.append(footer)
+    return "\n".join(lines)
+
+
+def render_html(rows, columns, title, footer=None):
+    """Return `rows` as a standalone HTML page with one table."""
+    head = "".join(f"<th>{html.escape(str(column))}</th>" for column in columns)
+    body = "\n".join("<tr>" + "".join(f"<td>{html.escape(str(cell))}</td>" for cell in row) + "</tr>" for row in rows)
+    footer = f"<p>{html.escape(footer)}</p>\n" if footer else ""
+    return (f"<!DOCTYPE html>\n<html>\n<head><meta charset=\"utf-8\"><title>{html.escape(title)}</title></head>\n<body>\n"
+            f"<h1>{html.escape(title)}</h1>\n<table>\n<thead><tr>{head}</tr></thead>\n<tbody>\n{body}\n</tbody>\n</table>\n"
+            f"{footer}</body>\n</html>\n")
+
+
+def render_report(rows, columns, title, path=None, footer=None):
+    """
+    Render a report to `path`, the format follows the extension: .html, an image format or text.
+    Without `path` the text table is returned instead of written.
+    """
+    extension = os.path.splitext(path)[1].lower() if path else ""
+    if extension in IMAGE_FORMATS:
+        return render_table(rows, columns, f"{title}, {footer}" if footer else title, path)
+    content = render_html(rows, columns, title, footer) if extension in (".html", ".htm") else render_text(rows, columns, title, footer)
+    if path is None:
+        return content
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return path
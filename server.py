@@ -0,0 +1,267 @@
+"""
+Asyncio JSON API over the habit store, using only the standard library.
+
+    python main.py serve --port 8080
+
+    GET    /habits               list the habits of the user
+    POST   /habits               add a habit, body {"name": ..., "frequency": ...}
+    POST   /habits/<name>/done   mark a habit as completed, body {"date": "YYYY-MM-DD"} is optional
+    GET    /stats                total, current and longest streak of every habit
+    DELETE /habits/<name>        delete a habit, its completions are purged in the background
+
+The user is chosen with the `user` query parameter (default: 0). SQLite calls run in a bounded pool
+of reader threads with read-only connections and in a single writer thread. Completions that arrive
+while the writer is busy are collected and written together in one transaction (group commit),
+so a burst of check-ins costs one commit per batch instead of one per request.
+"""
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from db import DEFAULT_USER, PURGE_CHUNK_SIZE, ConnectionPool, delete_habit, get_habit, get_habit_rows, purge_deleted, record_completions
+from habit import Habit
+
+FREQUENCIES = ["daily", "weekly", "monthly", "yearly"]
+MAX_BODY = 1 << 20  # bytes
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class HabitServer:
+    """
+    The API on top of one database file. `readers` bounds the threads (and connections) used for
+    reads, at most `batch_size` completions are group committed in one transaction.
+    """
+
+    def __init__(self, db_name="habits.db", readers=4, batch_size=1_000):
+        self.pool = ConnectionPool(db_name, readers)
+        self.batch_size = batch_size
+        self._readers = ThreadPoolExecutor(readers, thread_name_prefix="habit-reader")
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix="habit-writer")
+        self._completions = None
+        self._commit_task = None
+        self._purge_task = None
+        self._purge_again = False
+        self.batches = 0  # committed completion batches, to see how well requests are coalesced
+
+    # -- SQLite, in the executors
+
+    async def _read(self, func, *args):
+        def run():
+            with self.pool.reader() as db:
+                return func(db, *args)
+        return await asyncio.get_running_loop().run_in_executor(self._readers, run)
+
+    async def _write(self, func, *args):
+        def run():
+            with self.pool.writer() as db:
+                return func(db, *args)
+        return await asyncio.get_running_loop().run_in_executor(self._writer, run)
+
+    async def _commit_completions(self):
+        """
+        Write all queued completions in one transaction, while it commits the next batch queues up.
+        Stops after the batch in which it finds None.
+        """
+        stop = False
+        while not stop:
+            batch = [await self._completions.get()]
+            while len(batch) < self.batch_size and not self._completions.empty():
+                batch.append(self._completions.get_nowait())
+            if None in batch:
+                stop = True
+                batch = [item for item in batch if item is not None]
+                if not batch:
+                    break
+            try:
+                results = await self._write(record_completions, [completion for completion, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                self.batches += 1
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+
+    async def complete(self, user_id, name, completed_date):
+        """Queue a completion for the next group commit and wait until it is committed."""
+        future = asyncio.get_running_loop().create_future()
+        await self._completions.put(((user_id, name, completed_date), future))
+        return await future
+
+    async def _purge(self):
+        """Remove the completions of deleted habits one chunk per writer task, so queued writes run in between."""
+        while self._purge_again:
+            self._purge_again = False
+            while await self._write(purge_deleted, PURGE_CHUNK_SIZE, 1):
+                pass
+
+    def _start_purge(self):
+        self._purge_again = True  # also picked up by a purge that is finishing
+        if self._purge_task is None or self._purge_task.done():
+            self._purge_task = asyncio.create_task(self._purge())
+
+    # -- routes
+
+    async def list_habits(self, user_id, body):
+        rows = await self._read(get_habit_rows, user_id)
+        return 200, [dict(zip(["id", "name", "frequency", "streak", "completed", "last_completed"], row)) for row in rows]
+
+    async def add_habit(self, user_id, body):
+        name, frequency = body.get("name"), body.get("frequency", "daily")
+        if not isinstance(name, str) or not name or frequency not in FREQUENCIES:
+            raise HTTPError(400, f"expected {{'name': str, 'frequency': one of {FREQUENCIES}}}")
+
+        def add(db):
+            if get_habit(db, name=name, user_id=user_id) is not None:
+                return None
+            habit = Habit(name, frequency, user_id=user_id)
+            habit.store(db)
+            return habit.id
+        habit_id = await self._write(add)
+        if habit_id is None:
+            raise HTTPError(409, f"habit '{name}' already exists")
+        return 201, {"id": habit_id, "name": name, "frequency": frequency}
+
+    async def complete_habit(self, user_id, body, name):
+        try:
+            completed_date = date.fromisoformat(body["date"]) if "date" in body else date.today()
+        except (TypeError, ValueError):
+            raise HTTPError(400, "date must be YYYY-MM-DD")
+        streak = await self.complete(user_id, name, completed_date)
+        if streak is False:
+            raise HTTPError(404, f"habit '{name}' does not exist")
+        return 200, {"name": name, "date": completed_date.isoformat(), "recorded": streak is not None, "streak": streak}
+
+    async def stats(self, user_id, body):
+        from analyse import get_streaks
+        streaks = await self._read(lambda db: get_streaks(db, user_id=user_id))
+        return 200, [habit._asdict() for habit in streaks]
+
+    async def delete_habit(self, user_id, body, name):
+        def delete(db):
+            if get_habit(db, name=name, user_id=user_id) is None:
+                return False
+            delete_habit(db, name, user_id)
+            return True
+        if not await self._write(delete):
+            raise HTTPError(404, f"habit '{name}' does not exist")
+        self._start_purge()
+        return 200, {"deleted": name}
+
+    async def dispatch(self, method, target, body):
+        """Route one request, returns (status, JSON payload)."""
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        try:
+            user_id = int(parse_qs(url.query).get("user", [DEFAULT_USER])[0])
+        except ValueError:
+            raise HTTPError(400, "user must be an integer")
+        try:
+            body = json.loads(body) if body else {}
+        except ValueError:
+            raise HTTPError(400, "the body is not valid JSON")
+        if not isinstance(body, dict):
+            raise HTTPError(400, "the body must be a JSON object")
+
+        routes = {
+            ("GET", 1, "habits"): self.list_habits,
+            ("POST", 1, "habits"): self.add_habit,
+            ("GET", 1, "stats"): self.stats,
+            ("DELETE", 2, "habits"): self.delete_habit,
+        }
+        if len(parts) == 3 and parts[0] == "habits" and parts[2] == "done":
+            if method != "POST":
+                raise HTTPError(405, "use POST")
+            return await self.complete_habit(user_id, body, parts[1])
+        handler = routes.get((method, len(parts), parts[0]))
+        if handler is None:
+            if any(key[1:] == (len(parts), parts[0]) for key in routes):
+                raise HTTPError(405, f"{method} is not allowed here")
+            raise HTTPError(404, f"no route for {url.path}")
+        return await handler(user_id, body, *parts[1:])
+
+    # -- HTTP/1.1 with keep-alive
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                    length = int(headers.get("content-length", 0))
+                    if length > MAX_BODY:
+                        raise HTTPError(413, f"the body is larger than {MAX_BODY} bytes")
+                    body = await reader.readexactly(length)
+                    status, payload = await self.dispatch(method, target, body)
+                except HTTPError as e:
+                    version = "HTTP/1.0" if e.status == 413 else version  # the unread body ends the connection
+                    status, payload = e.status, {"error": str(e)}
+                except ValueError:
+                    status, payload, version = 400, {"error": "malformed request"}, "HTTP/1.0"
+                except asyncio.IncompleteReadError:
+                    break
+                except Exception as e:
+                    status, payload = 500, {"error": str(e)}
+
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                data = json.dumps(payload, default=str).encode()
+                connection = "" if keep_alive else "Connection: close\r\n"
+                writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\n{connection}\r\n".encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=8080):
+        """Start listening, returns the asyncio server. Port 0 picks a free port."""
+        self._completions = asyncio.Queue()
+        self._commit_task = asyncio.create_task(self._commit_completions())
+        self._start_purge()  # what an earlier run left behind
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def stop(self, server):
+        server.close()
+        await server.wait_closed()
+        await self._completions.put(None)  # commit what is queued, then stop
+        await self._commit_task
+        if self._purge_task is not None:
+            self._purge_task.cancel()  # the tombstones stay, the next start continues
+            try:
+                await self._purge_task
+            except asyncio.CancelledError:
+                pass
+        self._readers.shutdown()
+        self._writer.shutdown()
+        self.pool.close()
+
+
+async def serve(db_name="habits.db", host="127.0.0.1", port=8080, readers=4):
+    """Run the API until cancelled (Ctrl+C)."""
+    app = HabitServer(db_name, readers)
+    server = await app.start(host, port)
+    print(f"Serving {db_name} on http://{host}:{server.sockets[0].getsockname()[1]}")
+    try:
+        await server.serve_forever()
+    finally:
+        await app.stop(server)
@@ -0,0 +1,86 @@
+"""
+Deterministic synthetic habit data for benchmarks.
+
+generate(db, rows) fills tbl_habit and tbl_tracker with exactly `rows` completions. Habits follow
+realistic patterns instead of one row per day: most are daily, some weekly or monthly, each has a
+discipline that sets how long its runs last and how long it pauses in between, habits start at
+different times and some are given up. The same `seed` always produces the same database, so
+benchmark runs on different commits compare the same data.
+
+    db = get_db("bench.db")
+    generate(db, 1_000_000)
+"""
+from datetime import date
+
+import numpy as np
+
+from db import BULK_CHUNK_SIZE, archive_completions, get_storage, rebuild_streaks
+
+FREQUENCY_MIX = {"daily": 0.7, "weekly": 0.2, "monthly": 0.1}
+HISTORY_DAYS = 3 * 365  # completions fall into the HISTORY_DAYS days before `end`
+ABANDON_RATE = 0.2  # share of habits that are given up at some point
+
+
+def _periods(rng, span):
+    """Completed periods 0..span-1 of one habit: runs of geometric length with geometric pauses in between."""
+    discipline = rng.beta(5, 2)  # chance to keep a run going for one more period
+    start = int(rng.integers(0, max(span // 2, 1)))
+    stop = int(rng.integers(start + 1, span + 1)) if rng.random() < ABANDON_RATE else span
+    runs = rng.geometric(1 - discipline, size=span)
+    pauses = rng.geometric(discipline, size=span)  # disciplined habits also resume sooner
+    run_starts = start + np.concatenate([[0], np.cumsum(runs + pauses)[:-1]])
+    keep = run_starts < stop
+    run_starts, runs = run_starts[keep], np.minimum(runs[keep], stop - run_starts[keep])
+    offsets = np.arange(runs.sum()) - np.repeat(np.cumsum(runs) - runs, runs)
+    return np.repeat(run_starts, runs) + offsets
+
+
+def _days(rng, frequency, first_day, last_day):
+    """Day numbers of the completions of one habit between first_day and last_day."""
+    if frequency == "weekly":
+        first_monday = first_day + (-(first_day - 4)) % 7  # 1970-01-05 (day 4) was a Monday
+        weeks = _periods(rng, (last_day - first_monday) // 7)
+        return first_monday + 7 * weeks + rng.integers(0, 7, size=len(weeks))
+    if frequency == "monthly":
+        first_month = np.datetime64(int(first_day), "D").astype("datetime64[M]") + 1
+        months = _periods(rng, int(np.datetime64(int(last_day), "D").astype("datetime64[M]") - first_month))
+        month_starts = (first_month + months).astype("datetime64[D]").astype(np.int64)
+        return month_starts + rng.integers(0, 28, size=len(months))
+    return first_day + _periods(rng, last_day - first_day + 1)
+
+
+def generate(db, rows, seed=1, end=None, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Add habits "habit <n>", n counting on from the largest habit id, with exactly `rows` completions
+    in total, ending at `end` (default: 2025-01-01, fixed so that the data does not depend on the day
+    it is generated).
+    Streak columns are rebuilt at the end, databases with the "runs" storage engine get their
+    completions as runs. Returns the number of habits added.
+    """
+    rng = np.random.default_rng(seed)
+    last_day = int(np.datetime64(end or "2025-01-01", "D").astype(np.int64)) - 1
+    first_day = last_day - HISTORY_DAYS + 1
+    frequencies, weights = list(FREQUENCY_MIX), list(FREQUENCY_MIX.values())
+    offset = db.execute("SELECT COALESCE(MAX(id), 0) FROM tbl_habit").fetchone()[0]
+    cur = db.cursor()
+    habit_ids, written = [], 0
+    completions = []
+    while written < rows:
+        frequency = frequencies[rng.choice(len(frequencies), p=weights)]
+        days = _days(rng, frequency, first_day, last_day)[:rows - written]
+        if not len(days):
+            continue
+        name = f"habit {offset + len(habit_ids)}"
+        # AUTOINCREMENT assigns the id, so it is never one of a deleted habit that still has a tombstone
+        cur.execute("INSERT INTO tbl_habit (name, frequency) VALUES (?, ?)", (name, frequency))
+        habit_ids.append(cur.lastrowid)
+        completions.extend((name, day, cur.lastrowid) for day in np.array(days, dtype="datetime64[D]").astype(str).tolist())
+        written += len(days)
+        if len(completions) >= chunk_size or written >= rows:
+            db.executemany("INSERT INTO tbl_tracker (habitname, completed_date, habit_id) VALUES (?, ?, ?)", completions)
+            db.commit()
+            completions = []
+    if get_storage(db) == "runs":
+        archive_completions(db, date.max)
+    rebuild_streaks(db, habit_ids)
+    return len(habit_ids)
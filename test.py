@@ -1,10 +1,21 @@
 import pytest
 from unittest.mock import patch
 import sqlite3
-from datetime import datetime
-from db import add_habit, increment_habit,get_habit_tracking_data, get_all_habits,delete_habit
+from datetime import datetime, date, timedelta
+import random
+from db import add_habit, increment_habit,get_habit_tracking_data, get_all_habits,delete_habit, create_tables, SCHEMA_VERSION
+from db import rebuild_streaks, verify_streaks, remove_completion, bulk_record_completions
 from habit import Habit
-from analyse import plot_streaks_as_table  # 假设该函数已经存在
+from analyse import plot_streaks_as_table, compute_streaks, get_streaks  # 假设该函数已经存在
+from periods import day_number, habit_streaks
+from db import get_db, ConnectionPool
+import threading
+from transfer import export_table, import_table
+from registry import HabitRegistry
+import cli
+import json
+import os
+import numpy as np
 
 
 # 设置数据库的模拟数据
@@ -71,6 +82,8 @@ def setup_mock_db():
     ])
 
     conn.commit()
+    # 像打开旧的 habits.db 一样执行迁移
+    create_tables(conn)
     yield conn  # 返回真实的 SQLite 连接
 
     # 测试完成后清理数据库
@@ -100,6 +113,28 @@ def test_add_habit(setup_mock_db):
     count = cursor.fetchone()[0]
     assert count == 1  # 确保'English learning' 只存在一个条目
 
+def test_migration_backfills_habit_id(setup_mock_db):
+    db = setup_mock_db
+    cursor = db.cursor()
+
+    assert cursor.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    cursor.execute("SELECT COUNT(*) FROM tbl_tracker WHERE habit_id IS NULL")
+    assert cursor.fetchone()[0] == 0  # 所有记录都有 habit_id
+
+    # 唯一索引阻止同一天重复记录
+    habit_id = cursor.execute("SELECT id FROM tbl_habit WHERE name = 'Financial review'").fetchone()[0]
+    with pytest.raises(sqlite3.IntegrityError):
+        cursor.execute("INSERT INTO tbl_tracker (habitname, completed_date, habit_id) VALUES (?, ?, ?)",
+                       ('Financial review', '2024-11-01', habit_id))
+
+    # 查询使用索引而不是全表扫描
+    plan = cursor.execute("EXPLAIN QUERY PLAN SELECT completed_date FROM tbl_tracker WHERE habit_id = ? ORDER BY completed_date", (habit_id,)).fetchall()
+    assert any("idx_tracker_habit_date" in row[-1] for row in plan)
+
+    # 再次迁移不会改变数据
+    create_tables(db)
+    assert len(get_habit_tracking_data(db, 'English learning')) == 30
+
 def test_increment_habit_with_mock_data(setup_mock_db):
     db = setup_mock_db
     today = datetime.now().date()
@@ -120,7 +155,7 @@ def test_increment_habit_with_mock_data(setup_mock_db):
     # 验证 streak 是否更新
     cursor.execute("SELECT streak FROM tbl_habit WHERE name = ?", ('English learning',))
     updated_streak = cursor.fetchone()[0]
-    assert updated_streak == 31
+    assert updated_streak == 1  # 上次完成是 2024-11-30, 中断后重新开始计算
 
     # 验证 tbl_tracker 中记录是否新增
     cursor.execute("SELECT COUNT(*) FROM tbl_tracker WHERE habitname = ?", ('English learning',))
@@ -138,6 +173,14 @@ def test_increment_habit_with_mock_data(setup_mock_db):
     repeated_count = cursor.fetchone()[0]
     assert repeated_count == 31
 
+    # 昨天也完成了, streak 连续增加
+    yesterday = today - timedelta(days=1)
+    cursor.execute("INSERT INTO tbl_tracker (habitname, completed_date, habit_id) SELECT name, ?, id FROM tbl_habit WHERE name = ?",
+                   (yesterday.isoformat(), 'Financial review'))
+    cursor.execute("UPDATE tbl_habit SET frequency = 'daily' WHERE name = 'Financial review'")
+    rebuild_streaks(db)
+    assert increment_habit(db, 'Financial review') == 2
+
 def test_get_habit_tracking_data(setup_mock_db):
     db = setup_mock_db
 
@@ -182,7 +225,7 @@ def test_get_all_habits(setup_mock_db):
     Elmex_gelee = next(habit for habit in result if habit[0] == 'Teeth protection with Elmex gelee')
     assert Elmex_gelee[0] == 'Teeth protection with Elmex gelee'  # 名称
     assert Elmex_gelee[1] == 'weekly'
-    assert Elmex_gelee[2] == 6  # streak
+    assert Elmex_gelee[2] == 4  # streak, 迁移时根据历史记录重新计算 (连续 4 周)
     assert Elmex_gelee[3] == 4  # completed (4 completed dates)
     assert Elmex_gelee[4] == '2024-11-27'  # last_completed
 
@@ -243,7 +286,7 @@ def test_mark_completed_with_mock_data(setup_mock_db):
 
     assert habit.completed_tasks == 31  # 完成的任务数应增加1
     assert len(habit.completed_dates) == 31  # 完成日期列表长度应增加1
-    assert habit.streak == 31  # 连续完成天数应增加1
+    assert habit.streak == 1  # 与 2024-11-30 之间有间断, 重新开始计算
     assert habit.last_completed == datetime.now().date()  # The last completion date should be updated to today
 
  # Verify the number of consecutive completion days returned
@@ -261,6 +304,21 @@ def test_get_last_completed_with_mock_data(setup_mock_db):
     assert last_completed == habit.last_completed  # 返回值应该是 habit 对象中的 last_completed
 
 
+def test_habit_completion_history():
+    habit = Habit(name="English learning", frequency="daily")
+    assert not hasattr(habit, '__dict__')  # __slots__
+
+    habit.completed_dates = ['2024-11-03', date(2024, 11, 1), '2024-11-3']
+    assert habit.completed_dates == [date(2024, 11, 1), date(2024, 11, 3)]  # 排序并去重
+    assert habit.add_completion(date(2024, 11, 2))
+    assert not habit.add_completion('2024-11-02')
+    assert list(habit.completion_days) == [date(2024, 11, d).toordinal() for d in (1, 2, 3)]
+
+    assert habit.is_completed_on('2024-11-02')
+    assert not habit.is_completed_on(date(2024, 11, 4))
+    assert habit.count_completed_between('2024-11-02', '2024-11-30') == 2
+    assert habit.completed_between(date(2024, 10, 1), date(2024, 11, 1)) == [date(2024, 11, 1)]
+
 def test_plot_streaks_as_table(setup_mock_db, capfd):
     db = setup_mock_db
 
@@ -292,3 +350,837 @@ def test_plot_streaks_as_table(setup_mock_db, capfd):
         assert "Financial review" in captured.out
         assert "Total Streak (Days)" in captured.out
         assert "Longest Streak (Days)" in captured.out
+
+
+def test_compute_streaks_matches_day_loop(setup_mock_db):
+    db = setup_mock_db
+    # 随机的完成记录, 包含间断
+    rng = random.Random(42)
+    add_habit(db, 'Random habit', 'daily')
+    habit_id = db.execute("SELECT id FROM tbl_habit WHERE name = 'Random habit'").fetchone()[0]
+    days = [date(2024, 1, 1) + timedelta(days=i) for i in range(200) if rng.random() < 0.7]
+    db.executemany("INSERT INTO tbl_tracker (habitname, completed_date, habit_id) VALUES (?, ?, ?)",
+                   [('Random habit', d.isoformat(), habit_id) for d in days])
+    db.commit()
+
+    result = {habit.name: habit for habit in compute_streaks(db, today=date(2024, 12, 1))}
+    for name, frequency, _, _, _ in get_all_habits(db):
+        if frequency != 'daily':
+            continue
+        # 原来的逐日循环
+        dates = [datetime.strptime(row[0], "%Y-%m-%d").date() for row in get_habit_tracking_data(db, name)]
+        streaks, current, last = [], 0, None
+        for d in dates:
+            if last is None or d == last + timedelta(days=1):
+                current += 1
+            else:
+                streaks.append(current)
+                current = 1
+            last = d
+        streaks.append(current)
+        assert result[name].total == sum(streaks)
+        assert result[name].longest == max(streaks)
+
+    # 分块读取时结果不变
+    with patch('db.CHUNK_SIZE', 1):
+        assert compute_streaks(db, today=date(2024, 12, 1)) == list(result.values())
+
+    # 昨天完成时, 当前连续天数仍然有效
+    assert result['English learning'].current == 30
+    assert {h.name: h for h in compute_streaks(db, today=date(2024, 12, 5))}['English learning'].current == 0
+
+
+def test_compute_streaks_uses_habit_frequency(setup_mock_db):
+    db = setup_mock_db
+    result = {habit.name: habit for habit in compute_streaks(db, today=date(2024, 12, 3))}
+
+    # 每周一次, 连续 4 周
+    teeth = result['Teeth protection with Elmex gelee']
+    assert (teeth.total, teeth.current, teeth.longest) == (4, 4, 4)
+    # 每月一次, 11 月完成, 12 月还没结束
+    financial = result['Financial review']
+    assert (financial.total, financial.current, financial.longest) == (1, 1, 1)
+
+    # 同一周内多次完成只算一次
+    assert habit_streaks('weekly', [day_number('2024-11-04'), day_number('2024-11-10'), day_number('2024-11-11')],
+                         today=date(2024, 11, 11)) == (3, 2, 2)
+    # 中间漏了一个月
+    assert habit_streaks('monthly', [day_number(d) for d in ('2024-01-31', '2024-02-01', '2024-04-15')],
+                         today=date(2024, 7, 1)) == (3, 0, 2)
+    assert habit_streaks('yearly', [day_number(d) for d in ('2022-12-31', '2023-01-01', '2024-06-01')],
+                         today=date(2025, 1, 1)) == (3, 3, 3)
+
+
+def test_materialized_streaks(setup_mock_db):
+    db = setup_mock_db
+    # 迁移后, 存储的值与历史记录一致
+    assert verify_streaks(db) == []
+    assert get_streaks(db, today=date(2024, 12, 1)) == compute_streaks(db, today=date(2024, 12, 1))
+
+    # 删除中间的一天, 连续记录被拆开
+    assert remove_completion(db, 'English learning', '2024-11-10')
+    row = db.execute("SELECT streak, longest_streak, total_completions, last_completed FROM tbl_habit WHERE name = 'English learning'").fetchone()
+    assert tuple(row) == (20, 20, 29, '2024-11-30')
+    assert not remove_completion(db, 'English learning', '2024-11-10')
+
+    # 直接修改 tbl_tracker 后, verify 能发现差异, rebuild 修复
+    db.execute("DELETE FROM tbl_tracker WHERE completed_date = '2024-11-30'")
+    db.commit()
+    mismatches = verify_streaks(db)
+    assert [name for name, _, _ in mismatches] == ['English learning']
+    assert mismatches[0][2] == (19, 19, 28, '2024-11-29')
+    rebuild_streaks(db)
+    assert verify_streaks(db) == []
+
+
+def test_bulk_record_completions(setup_mock_db, capfd):
+    db = setup_mock_db
+    events = [('Financial review', date(2024, 12, 1)), ('Financial review', '2025-01-15'),
+              ('Financial review', '2024-12-01'),  # 重复
+              ('English learning', '2024-10-31'),  # 补录过去的日期, 与 11 月连起来
+              ('English learning', '2024-11-05'),  # 已经存在
+              ('Unknown habit', '2024-11-01')]
+    assert bulk_record_completions(db, events, chunk_size=2) == 3
+    assert "Unknown habit" in capfd.readouterr().out
+
+    result = {habit.name: habit for habit in get_streaks(db, today=date(2025, 1, 20))}
+    assert (result['Financial review'].total, result['Financial review'].current, result['Financial review'].longest) == (3, 3, 3)
+    assert (result['English learning'].total, result['English learning'].longest) == (31, 31)
+    assert verify_streaks(db) == []
+
+    # 单个补录的完成记录也会修复 streak
+    habit = Habit('English learning', 'daily', completed=31)
+    habit.add_event(db, '2024-10-30')
+    assert habit.completed_tasks == 32
+    assert verify_streaks(db) == []
+    assert db.execute("SELECT longest_streak FROM tbl_habit WHERE name = 'English learning'").fetchone()[0] == 32
+
+    # add_event 同步更新 last_completed, 补录的日期不会覆盖更晚的日期
+    habit = Habit('Teeth protection with Elmex gelee', 'weekly', 4, date(2024, 11, 27), 4)
+    habit.add_event(db, '2024-12-02')
+    assert habit.last_completed == date(2024, 12, 2) and habit.streak == 5
+    habit.add_event(db, '2024-10-15')
+    assert habit.last_completed == date(2024, 12, 2) and habit.completed_tasks == 6
+    stored = db.execute("SELECT last_completed FROM tbl_habit WHERE name = 'Teeth protection with Elmex gelee'").fetchone()[0]
+    assert stored == habit.last_completed.isoformat()
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".jsonl.gz"])
+def test_export_import_round_trip(setup_mock_db, tmp_path, suffix):
+    db = setup_mock_db
+    assert export_table(db, 'habits', str(tmp_path / ('habits' + suffix))) == 3
+    statements = []
+    db.set_trace_callback(statements.append)
+    assert export_table(db, 'tracker', str(tmp_path / ('tracker' + suffix))) == 35
+    db.set_trace_callback(None)
+    # 导出沿索引流式读取, 不在临时 B 树里排序
+    plans = [row[-1] for sql in statements if sql.lstrip().startswith('SELECT') for row in db.execute('EXPLAIN QUERY PLAN ' + sql)]
+    assert plans and not any('TEMP B-TREE' in step for step in plans)
+
+    copy = get_db(str(tmp_path / 'copy.db'))
+    assert import_table(copy, 'habits', str(tmp_path / ('habits' + suffix))) == 3
+    assert import_table(copy, 'tracker', str(tmp_path / ('tracker' + suffix))) == 35
+    assert [tuple(row) for row in get_all_habits(copy)] == [tuple(row) for row in get_all_habits(db)]
+
+    # 再次导入不会产生重复记录
+    assert import_table(copy, 'tracker', str(tmp_path / ('tracker' + suffix))) == 0
+    copy.close()
+
+
+def test_connection_pool_readers_and_writer(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'pool.db'), readers=3)
+    with pool.writer() as db:
+        assert db.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        for n in range(5):
+            add_habit(db, f'habit {n}', 'daily')
+
+    errors = []
+    done = threading.Event()
+
+    def read():
+        try:
+            while not done.is_set():
+                with pool.reader() as db:
+                    assert len(get_all_habits(db)) == 5
+                    get_streaks(db)
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for thread in readers:
+        thread.start()
+    start = date(2024, 1, 1)
+    for day in range(200):
+        with pool.writer() as db:
+            bulk_record_completions(db, [(f'habit {n}', start + timedelta(days=day)) for n in range(5)])
+    done.set()
+    for thread in readers:
+        thread.join()
+
+    assert errors == []
+    with pool.reader() as db:
+        assert all(habit.total == 200 and habit.longest == 200 for habit in get_streaks(db))
+        with pytest.raises(sqlite3.OperationalError):
+            db.execute("DELETE FROM tbl_habit")  # 只读连接
+    pool.close()
+
+
+@pytest.mark.parametrize("max_size", [None, 2])
+def test_habit_registry(setup_mock_db, max_size):
+    db = setup_mock_db
+    registry = HabitRegistry(db, max_size=max_size)
+    assert len(registry) == 3
+    assert [habit.name for habit in registry] == ['English learning', 'Financial review', 'Teeth protection with Elmex gelee']
+
+    english = registry.get('English learning')
+    assert english.streak == 30 and english.completed_tasks == 30
+    assert registry.get_by_id(english.id) is english
+    assert 'English learning' in registry
+    assert 'Morning yoga' not in registry
+
+    # 写入数据库
+    yoga = registry.add('Morning yoga', 'daily')
+    assert yoga.id is not None
+    assert get_habit_tracking_data(db, 'Morning yoga') == []
+    with pytest.raises(sqlite3.IntegrityError):
+        registry.add('English learning', 'daily')
+    registry.mark_completed('Morning yoga')
+    assert registry.get('Morning yoga').streak == 1
+
+    # 完成记录在访问时才加载
+    history = registry.get('English learning', history=True).completed_dates
+    assert len(history) == 30 and history[0] == date(2024, 11, 1)
+
+    assert registry.remove('English learning').name == 'English learning'
+    assert registry.remove('English learning') is None
+    assert 'English learning' not in registry
+    assert len(registry) == 3
+    assert not any(habit[0] == 'English learning' for habit in get_all_habits(db))
+    if max_size:
+        assert len(registry._by_name) <= max_size
+
+
+def test_cli_commands(tmp_path, capsys):
+    db_path = str(tmp_path / 'cli.db')
+    assert cli.main(['add', 'Reading', 'Gym training', '--db', db_path]) == 0
+    assert cli.main(['add', 'Reading', '--frequency', 'weekly', '--db', db_path, '--json']) == 0
+    assert json.loads(capsys.readouterr().out.splitlines()[-1]) == {'added': 0, 'existing': ['Reading']}
+
+    assert cli.main(['done', 'Reading', 'Gym training', '--date', '2024-11-30', '--db', db_path]) == 0
+    assert cli.main(['done', 'Reading', 'Swimming', '--db', db_path, '--json']) == 1
+    out = json.loads(capsys.readouterr().out.splitlines()[-1])
+    assert out['recorded'] == 1 and out['unknown'] == ['Swimming']
+
+    assert cli.main(['list', '--db', db_path, '--json']) == 0
+    habits = json.loads(capsys.readouterr().out)
+    assert [(h['name'], h['completed']) for h in habits] == [('Gym training', 1), ('Reading', 2)]
+
+    assert cli.main(['stats', '--db', db_path]) == 0
+    assert 'Reading' in capsys.readouterr().out
+
+    assert cli.main(['delete', 'Gym training', '--db', db_path, '--json']) == 0
+    assert json.loads(capsys.readouterr().out) == {'deleted': 1, 'unknown': []}
+    assert cli.main(['verify', '--db', db_path]) == 0
+
+
+def test_startup_does_not_import_matplotlib():
+    # 启动和 CLI 命令不应加载 matplotlib，只有绘图时才导入
+    import benchmark
+    _, packages = benchmark._import_times("import main, cli", repeat=1)
+    assert "matplotlib" not in packages
+    assert "db" in packages
+
+
+@pytest.mark.parametrize("suffix", ["png", "svg"])
+def test_cli_stats_plot_to_file(tmp_path, suffix):
+    db_path = str(tmp_path / 'plot.db')
+    path = tmp_path / f'streaks.{suffix}'
+    cli.main(['add', 'Reading', '--db', db_path])
+    cli.main(['done', 'Reading', '--db', db_path])
+    assert cli.main(['stats', '--plot', str(path), '--db', db_path]) == 0
+    assert path.stat().st_size > 0
+
+    # 习惯很多时只绘制前 PLOT_ROWS 个, 图片大小有上限
+    from analyse import PLOT_ROWS
+    cli.main(['add', *[f'habit {n}' for n in range(PLOT_ROWS + 10)], '--db', db_path])
+    with patch('render.render_table') as render_table:
+        assert cli.main(['stats', '--plot', str(path), '--db', db_path]) == 0
+    rows, _, title = render_table.call_args[0][:3]
+    assert len(rows) == PLOT_ROWS and f'of {PLOT_ROWS + 11:,} habits' in title
+
+
+def test_streak_report(setup_mock_db, tmp_path, capsys):
+    from analyse import select_streaks, streak_table
+    db = setup_mock_db
+    table = streak_table(db, today=date(2024, 12, 1))
+    # 按最长连续排序、取前两名并分页，同分时按名称排序
+    by_longest = select_streaks(table, sort="longest")
+    assert [habit.longest for habit in by_longest] == sorted((habit.longest for habit in by_longest), reverse=True)
+    assert select_streaks(table, sort="longest", top=2) == by_longest[:2]
+    assert select_streaks(table, sort="longest", top=2, page=2, page_size=1) == by_longest[1:2]
+    assert select_streaks(table) == get_streaks(db, today=date(2024, 12, 1))
+    assert all(habit.frequency == 'weekly' for habit in select_streaks(streak_table(db, frequency='weekly')))
+
+    db_path = str(tmp_path / 'report.db')
+    cli.main(['add', 'A', 'B', 'C', '--db', db_path])
+    cli.main(['done', 'B', '--db', db_path])
+    capsys.readouterr()
+    assert cli.main(['report', '--sort', 'total', '--page-size', '2', '--db', db_path, '--json']) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert (report['pages'], report['habits']) == (2, 3)
+    assert [row['name'] for row in report['rows']] == ['B', 'A']
+    assert cli.main(['report', '--output', str(tmp_path / 'report.html'), '--db', db_path]) == 0
+    assert '<td>C</td>' in (tmp_path / 'report.html').read_text()
+
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_completion_matrix_analyses(setup_mock_db, packed):
+    import activity
+    db = setup_mock_db
+    matrix = activity.completion_matrix(db, date(2024, 11, 1), date(2024, 11, 30), packed=packed)
+    names = [db.execute("SELECT name FROM tbl_habit WHERE id = ?", (habit_id,)).fetchone()[0] for habit_id in matrix.habit_ids.tolist()]
+    english, elmex, finance = (names.index(name) for name in ['English learning', 'Teeth protection with Elmex gelee', 'Financial review'])
+    block = activity.dense(matrix)
+    assert block.shape == (3, 30) and block[english].all()
+    assert [activity.day_of(matrix, column) for column in block[elmex].nonzero()[0]] == [date(2024, 11, day) for day in (6, 13, 20, 27)]
+
+    # 滚动完成率：前几天按已覆盖的天数计算
+    rates = activity.rolling_rates(matrix, 7)
+    assert rates[english].tolist() == [1.0] * 30
+    assert rates[finance][0] == 1.0 and rates[finance][1] == 0.5 and rates[finance][7] == 0.0
+    assert activity.completion_rates(matrix, (7, 30))[30][elmex] == pytest.approx(4 / 30)
+
+    # 2024-11-06 是星期三，2024-11-01 是星期五
+    histogram = activity.weekday_histogram(matrix)
+    assert histogram[elmex].tolist() == [0, 0, 4, 0, 0, 0, 0]
+    assert histogram[finance].tolist() == [0, 0, 0, 0, 1, 0, 0]
+
+    heatmap = activity.calendar_heatmap(matrix)
+    assert heatmap.shape == (7, 5)
+    assert heatmap[4, 0] == 2 and heatmap[2, 1] == 2  # 第一周周五、第二周周三
+    assert np.isnan(heatmap[0, 0]) and np.nansum(heatmap) == 35
+
+
+def test_parallel_analysis_matches_serial(tmp_path):
+    import activity
+    from parallel import shard_habits
+    db = get_db(str(tmp_path / 'parallel.db'))
+    random.seed(3)
+    for number in range(12):
+        add_habit(db, f'habit {number:02}', random.choice(['daily', 'weekly', 'monthly']))
+    bulk_record_completions(db, [(f'habit {number:02}', date(2024, 1, 1) + timedelta(days=day))
+                                 for number in range(12) for day in range(400) if random.random() < 0.6])
+
+    # 分片按 id 连续、互不重叠，并覆盖所有习惯
+    shards = shard_habits(db, 3)
+    assert len(shards) == 3 and sum(shards, []) == sorted(sum(shards, []))
+    assert len(sum(shards, [])) == 12
+    # 指定 habit_ids 时按 id 查找, 不扫描所有习惯
+    statements = []
+    db.set_trace_callback(statements.append)
+    assert sum(shard_habits(db, 2, [9, 3, 4]), []) == [3, 4, 9]
+    db.set_trace_callback(None)
+    assert all('SCAN tbl_habit' not in row[-1] for row in db.execute('EXPLAIN QUERY PLAN ' + statements[-1]))
+
+    today = date(2025, 2, 4)
+    assert compute_streaks(db, today=today, workers=3) == compute_streaks(db, today=today)
+    serial = activity.completion_matrix(db, date(2024, 1, 1), date(2025, 2, 3))
+    parallel = activity.completion_matrix(db, date(2024, 1, 1), date(2025, 2, 3), workers=3)
+    assert parallel.habit_ids.tolist() == serial.habit_ids.tolist() and (parallel.bits == serial.bits).all()
+
+    db.execute("UPDATE tbl_habit SET streak = 0, longest_streak = 0")
+    db.commit()
+    assert len(verify_streaks(db, workers=2)) == 12
+    assert rebuild_streaks(db, workers=2) == 12
+    assert verify_streaks(db) == []
+    db.close()
+
+
+def test_habits_are_scoped_by_user(setup_mock_db):
+    db = setup_mock_db
+    # 迁移后旧数据属于默认用户 0，不同用户可以使用相同的习惯名称
+    assert len(get_all_habits(db)) == 3
+    add_habit(db, 'English learning', 'weekly', user_id=7)
+    assert [row[0] for row in get_all_habits(db, 7)] == ['English learning']
+
+    assert increment_habit(db, 'English learning', '2024-12-01', user_id=7) == 1
+    assert increment_habit(db, 'Financial review', '2024-12-01', user_id=7) is None
+    # 一个用户的写入只读取涉及的习惯, 不扫描所有用户的 tbl_habit
+    statements = []
+    db.set_trace_callback(statements.append)
+    assert bulk_record_completions(db, [('English learning', '2024-12-02')], user_id=7) == 1
+    db.set_trace_callback(None)
+    plans = [row[-1] for sql in statements if sql.lstrip().startswith('SELECT') for row in db.execute('EXPLAIN QUERY PLAN ' + sql)]
+    assert not any(step.startswith('SCAN tbl_habit') for step in plans)
+    assert len(get_habit_tracking_data(db, 'English learning', user_id=7)) == 2
+    assert len(get_habit_tracking_data(db, 'English learning')) == 30
+    assert db.execute("SELECT user_id FROM tbl_tracker WHERE completed_date = '2024-12-01'").fetchone()[0] == 7
+
+    registry = HabitRegistry(db, user_id=7)
+    assert [habit.name for habit in registry] == ['English learning']
+    registry.add('Gym training', 'daily')
+    assert 'Gym training' in registry and 'Gym training' not in HabitRegistry(db)
+
+    delete_habit(db, 'English learning', user_id=7)
+    assert len(get_habit_tracking_data(db, 'English learning')) == 30
+    assert [row[0] for row in get_all_habits(db, 7)] == ['Gym training']
+
+    # 按用户查询走以 user_id 开头的索引
+    plan = db.execute("EXPLAIN QUERY PLAN SELECT name FROM tbl_habit WHERE user_id = ? ORDER BY name", (7,)).fetchall()
+    assert 'INDEX' in plan[-1][-1]
+
+
+def test_user_shards(tmp_path, capsys):
+    from db import UserShards
+    shards = UserShards(str(tmp_path / 'habits.db'), shards=3)
+    for user in range(6):
+        add_habit(shards.for_user(user), 'Reading', 'daily', user_id=user)
+    assert sorted(path.name for path in tmp_path.glob('habits.*.db')) == ['habits.0.db', 'habits.1.db', 'habits.2.db']
+    assert [len(conn.execute("SELECT * FROM tbl_habit").fetchall()) for conn in shards] == [2, 2, 2]
+    shards.close()
+
+    db_path = str(tmp_path / 'habits.db')
+    assert cli.main(['done', 'Reading', '--user', '4', '--shards', '3', '--db', db_path, '--date', '2024-11-30']) == 0
+    capsys.readouterr()
+    assert cli.main(['list', '--user', '4', '--shards', '3', '--db', db_path, '--json']) == 0
+    assert [(h['name'], h['completed']) for h in json.loads(capsys.readouterr().out)] == [('Reading', 1)]
+
+
+def test_http_api(tmp_path):
+    import asyncio
+    from server import HabitServer
+
+    async def request(port, method, path, body=None):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        data = json.dumps(body).encode() if body is not None else b''
+        writer.write(f"{method} {path} HTTP/1.1\r\nContent-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data)
+        response = await reader.read()
+        writer.close()
+        head, _, payload = response.partition(b'\r\n\r\n')
+        return int(head.split()[1]), json.loads(payload)
+
+    async def scenario():
+        app = HabitServer(str(tmp_path / 'api.db'), readers=2)
+        server = await app.start(port=0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            assert (await request(port, 'POST', '/habits', {'name': 'Reading'}))[0] == 201
+            assert (await request(port, 'POST', '/habits?user=2', {'name': 'Reading'}))[0] == 201
+            assert (await request(port, 'POST', '/habits', {'name': 'Reading'}))[0] == 409
+            assert (await request(port, 'POST', '/habits', {'name': 'Gym', 'frequency': 'hourly'}))[0] == 400
+
+            # 并发的打卡请求合并到少数几个事务中提交
+            days = [date(2024, 1, 1) + timedelta(days=offset) for offset in range(30)]
+            responses = await asyncio.gather(*(request(port, 'POST', '/habits/Reading/done', {'date': day.isoformat()}) for day in days))
+            assert all(status == 200 and body['recorded'] for status, body in responses)
+            assert app.batches < len(days)
+            status, body = await request(port, 'POST', '/habits/Reading/done', {'date': '2024-01-30'})
+            assert status == 200 and body['recorded'] is False
+            assert (await request(port, 'POST', '/habits/Swimming/done'))[0] == 404
+
+            status, habits = await request(port, 'GET', '/habits')
+            assert status == 200 and [(h['name'], h['completed'], h['streak']) for h in habits] == [('Reading', 30, 30)]
+            status, stats = await request(port, 'GET', '/stats?user=2')
+            assert stats == [{'name': 'Reading', 'frequency': 'daily', 'total': 0, 'current': 0, 'longest': 0}]
+            assert (await request(port, 'DELETE', '/habits/Reading'))[0] == 200
+            assert (await request(port, 'DELETE', '/habits/Reading'))[0] == 404
+            assert (await request(port, 'PUT', '/habits'))[0] == 405
+        finally:
+            await app.stop(server)
+
+    asyncio.run(scenario())
+
+
+def test_write_behind_queue(tmp_path):
+    from db import get_habit
+    from writebehind import WriteBehindQueue
+    db_path = str(tmp_path / 'queue.db')
+    db = get_db(db_path)
+    add_habit(db, 'Reading', 'daily')
+    registry = HabitRegistry(db, write_behind=None)
+
+    with WriteBehindQueue(db_path, interval=60) as queue:
+        days = [date(2024, 1, 1) + timedelta(days=offset) for offset in range(10)]
+        assert all(queue.submit('Reading', day) for day in days)
+        assert not queue.submit('Reading', days[0])  # 内存中去重
+        assert len(queue) == 10 and get_habit_tracking_data(db, 'Reading') == []
+        assert queue.flush() == 10 and queue.flushes == 1
+        queue.submit('Reading', date(2024, 1, 11))
+        # 同一数据库的第二个队列被拒绝, 不会重放或删除第一个队列的日志
+        with pytest.raises(RuntimeError):
+            WriteBehindQueue(db_path)
+        assert len(queue) == 1 and os.path.getsize(queue.journal) > 0
+        assert len(get_habit_tracking_data(db, 'Reading')) == 10
+        # 通过 registry 打卡时只入队，Habit 对象立即更新
+        registry.write_behind = queue
+        habit = registry.mark_completed('Reading')
+        assert habit.last_completed == date.today() and len(queue) == 2
+        # 补打卡 (字符串日期) 不改变当前连续天数
+        streak = habit.streak
+        assert habit.mark_completed(db, queue, '2024-01-12') and habit.streak == streak
+        assert habit.last_completed == date.today() and len(queue) == 3
+    # 关闭时写入所有剩余事件并删除日志
+    assert len(get_habit_tracking_data(db, 'Reading')) == 13
+    assert get_habit(db, 'Reading')[3] == habit.streak
+    assert not (tmp_path / 'queue.db.journal').exists()
+    assert verify_streaks(db) == []
+    db.close()
+
+
+def test_write_behind_recovers_after_crash(tmp_path):
+    import subprocess
+    import sys
+    db_path = str(tmp_path / 'crash.db')
+    db = get_db(db_path)
+    add_habit(db, 'Reading', 'daily')
+    # 子进程提交事件后直接退出，不刷新也不关闭
+    script = (f"import os\nfrom writebehind import WriteBehindQueue\n"
+              f"queue = WriteBehindQueue({db_path!r}, interval=3600)\n"
+              f"for day in range(1, 6): queue.submit('Reading', f'2024-01-0{{day}}')\n"
+              f"os._exit(1)\n")
+    subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert get_habit_tracking_data(db, 'Reading') == []
+    from writebehind import WriteBehindQueue
+    queue = WriteBehindQueue(db_path)
+    assert queue.recovered == 5
+    queue.close()
+    assert len(get_habit_tracking_data(db, 'Reading')) == 5
+
+    # 事务期间提交的事件已确认, 替换日志前崩溃也不会丢失
+    import writebehind
+    queue = WriteBehindQueue(db_path, interval=3600)
+    queue.submit('Reading', '2024-02-01')
+
+    record_completions = writebehind.record_completions
+
+    def record_and_submit(db, events):
+        record_completions(db, events)
+        queue.submit('Reading', '2024-02-02')
+    with patch('writebehind.record_completions', side_effect=record_and_submit), \
+            patch('writebehind.os.replace', side_effect=OSError('crash')), pytest.raises(OSError):
+        queue.flush()
+    # 替换失败后日志句柄仍然可用
+    assert queue.submit('Reading', '2024-02-03')
+    queue._db.close()
+    queue._lock_file.close()  # 进程结束时释放锁
+    with open(queue.journal, encoding='utf-8') as f:
+        assert [json.loads(line)[2] for line in f] == ['2024-02-01', '2024-02-02', '2024-02-03']
+    queue = WriteBehindQueue(db_path)
+    queue.close()
+    assert len(get_habit_tracking_data(db, 'Reading')) == 8 and not os.path.exists(queue.journal)
+    db.close()
+
+
+def test_archive_completions_keeps_results(tmp_path):
+    from activity import completion_matrix
+    from db import archive_completions, history_stats, iter_completion_rows, purge_deleted
+    db = get_db(str(tmp_path / 'archive.db'))
+    rng = random.Random(7)
+    start = date(2022, 1, 1)
+    for number, frequency in enumerate(['daily', 'weekly', 'daily', 'monthly']):
+        add_habit(db, f'habit {number}', frequency)
+        bulk_record_completions(db, [(f'habit {number}', start + timedelta(days=offset))
+                                     for offset in range(700) if rng.random() < 0.7])
+
+    def snapshot():
+        return (history_stats(db), verify_streaks(db), list(iter_completion_rows(db)),
+                [list(map(tuple, get_habit_tracking_data(db, f'habit {number}'))) for number in range(4)],
+                completion_matrix(db, start, start + timedelta(days=699)).bits.tolist())
+    expected = snapshot()
+    live_rows = db.execute("SELECT COUNT(*) FROM tbl_tracker").fetchone()[0]
+
+    # 分两次归档, 第二次的区间与第一次的相接并合并
+    archive_completions(db, start + timedelta(days=300))
+    archived, runs = archive_completions(db, start + timedelta(days=600), chunk_size=3)
+    assert db.execute("SELECT COUNT(*) FROM tbl_tracker").fetchone()[0] < live_rows / 5
+    assert runs == db.execute("SELECT COUNT(*) FROM tbl_completion_runs").fetchone()[0] < live_rows / 3
+    assert snapshot() == expected
+    # 归档后的导出按习惯合并区间与记录, 不在临时 B 树里排序
+    statements = []
+    db.set_trace_callback(statements.append)
+    list(iter_completion_rows(db))
+    db.set_trace_callback(None)
+    plans = [row[-1] for sql in statements if sql.lstrip().startswith('SELECT') for row in db.execute('EXPLAIN QUERY PLAN ' + sql)]
+    assert any(step.startswith('SEARCH r ') for step in plans) and not any('TEMP B-TREE' in step for step in plans)
+
+    # 已归档的日期不会重复记录, 删除时拆分区间
+    archived_day = get_habit_tracking_data(db, 'habit 0')[10][0]
+    assert increment_habit(db, 'habit 0', archived_day) is None
+    assert bulk_record_completions(db, [('habit 0', archived_day)]) == 0
+    assert remove_completion(db, 'habit 0', archived_day)
+    assert archived_day not in [row[0] for row in get_habit_tracking_data(db, 'habit 0')]
+    assert increment_habit(db, 'habit 0', archived_day) is not None
+    assert verify_streaks(db) == [] and history_stats(db) == expected[0]
+    delete_habit(db, 'habit 0')
+    purge_deleted(db)
+    assert db.execute("SELECT COUNT(*) FROM tbl_completion_runs WHERE habit_id = 1").fetchone()[0] == 0
+    db.close()
+
+
+def test_run_storage_matches_rows(tmp_path):
+    from db import get_storage, set_storage, history_stats
+    rng = random.Random(3)
+    events = [(name, date(2024, 1, 1) + timedelta(days=offset))
+              for name in ('daily', 'weekly') for offset in range(200) if rng.random() < 0.8]
+    rng.shuffle(events)  # 乱序写入, 包含补录的旧日期
+    databases = {}
+    for storage in ('rows', 'runs'):
+        db = get_db(str(tmp_path / f'{storage}.db'))
+        set_storage(db, storage)
+        add_habit(db, 'daily', 'daily')
+        add_habit(db, 'weekly', 'weekly')
+        for name, day in events:
+            increment_habit(db, name, day)
+        increment_habit(db, 'daily', events[0][1])  # 重复记录被忽略
+        databases[storage] = db
+    rows, runs = databases['rows'], databases['runs']
+    assert get_storage(runs) == 'runs'
+    assert runs.execute("SELECT COUNT(*) FROM tbl_tracker").fetchone()[0] == 0
+    assert runs.execute("SELECT COUNT(*) FROM tbl_completion_runs").fetchone()[0] < len(events) / 3
+    assert verify_streaks(runs) == [] and verify_streaks(rows) == []
+    assert list(get_all_habits(runs)) == list(get_all_habits(rows))
+    assert history_stats(runs) == history_stats(rows)
+
+    # 删除区间中间的一天会拆分区间; bulk 导入也写入区间
+    day = sorted(day for name, day in events if name == 'daily')[50].isoformat()
+    for db in (rows, runs):
+        assert remove_completion(db, 'daily', day)
+        bulk_record_completions(db, [('daily', '2024-08-01'), ('daily', '2024-08-02'), ('weekly', day)])
+    assert runs.execute("SELECT COUNT(*) FROM tbl_tracker").fetchone()[0] == 0
+    assert history_stats(runs) == history_stats(rows) and verify_streaks(runs) == []
+
+    # 转回逐行存储, 结果不变
+    expected = [tuple(row) for row in get_habit_tracking_data(runs, 'daily')]
+    set_storage(runs, 'rows')
+    assert runs.execute("SELECT COUNT(*) FROM tbl_completion_runs").fetchone()[0] == 0
+    assert [tuple(row) for row in get_habit_tracking_data(runs, 'daily')] == expected
+    with pytest.raises(ValueError):
+        set_storage(runs, 'columns')
+    rows.close()
+    runs.close()
+
+
+def test_query_cache_invalidation(tmp_path):
+    from analyse import streak_table
+    path = str(tmp_path / 'cache.db')
+    db = get_db(path, cache=True)
+    for name in ('Reading', 'Gym training', 'Walking'):
+        add_habit(db, name, 'daily')
+    cache = db.query_cache
+    first = get_all_habits(db)
+    assert get_all_habits(db) == first and (cache.hits, cache.misses) == (1, 1)
+
+    # 只重新读取被写入的习惯
+    increment_habit(db, 'Reading', '2024-11-30')
+    assert cache.habit_version(1) == 2
+    rows = get_all_habits(db)
+    assert cache.refreshed == 1 and rows[1][:4] == ('Reading', 'daily', 1, 1)
+    assert rows[0] == first[0] and rows[2] == first[2]
+
+    # 统计表在同一用户的习惯被写入前保持缓存
+    table = streak_table(db, today='2024-12-01')
+    assert streak_table(db, today='2024-12-01') is table
+    Habit('Reading', 'daily', habit_id=1).reset_streak(db)
+    assert streak_table(db, today='2024-12-01') is not table
+    assert get_all_habits(db)[1][2] == 0
+
+    delete_habit(db, 'Walking')
+    add_habit(db, 'Cooking', 'weekly')
+    assert [row[0] for row in get_all_habits(db)] == ['Cooking', 'Gym training', 'Reading']
+    # 其他连接的提交通过 data_version 使缓存失效
+    other = get_db(path)
+    increment_habit(other, 'Cooking', '2024-11-30')
+    other.close()
+    assert get_all_habits(db)[0][3] == 1
+    stats = cache.stats()
+    assert stats['hits'] >= 2 and stats['misses'] >= 5 and 0 < stats['hit_rate'] < 1
+    db.close()
+
+
+def test_synthetic_data_and_benchmark_suite(tmp_path):
+    import json
+    from benchmark import compare_results, run_suite
+    from synthetic import generate
+    databases = []
+    for name in ('a.db', 'b.db'):
+        db = get_db(str(tmp_path / name))
+        assert generate(db, 3000, seed=5) > 1
+        databases.append(db)
+    # 相同的种子生成相同的数据, 行数精确
+    dump = [db.execute("SELECT habit_id, completed_date FROM tbl_tracker ORDER BY id").fetchall() for db in databases]
+    assert len(dump[0]) == 3000 and dump[0] == dump[1]
+    assert verify_streaks(databases[0]) == []
+    assert {row[0] for row in databases[0].execute("SELECT frequency FROM tbl_habit")} <= {'daily', 'weekly', 'monthly'}
+    # 已删除但未清理的习惯 id 不会被新习惯复用
+    from db import purge_deleted
+    db = databases[0]
+    last = db.execute("SELECT name, total_completions FROM tbl_habit ORDER BY id DESC LIMIT 1").fetchone()
+    delete_habit(db, last[0])
+    generate(db, 500, seed=6)
+    purge_deleted(db)
+    assert db.execute("SELECT COUNT(*) FROM tbl_tracker").fetchone()[0] == 3000 - last[1] + 500
+    assert verify_streaks(db) == []
+    for db in databases:
+        db.close()
+
+    output = tmp_path / 'results.json'
+    results, regressions = run_suite([500], repeat=3, output=str(output))
+    saved = json.loads(output.read_text())
+    assert regressions == [] and saved['scales']['500']['increment_habit']['runs'] == 3
+    assert set(saved['scales']['500']) >= {'get_all_habits', 'get_habit_tracking_data', 'increment_habit', 'delete_habit', 'streak_table'}
+    slower = json.loads(output.read_text())
+    slower['scales']['500']['get_all_habits']['median_us'] += 10_000
+    assert [regression[:2] for regression in compare_results(saved, slower)] == [(500, 'get_all_habits')]
+
+
+def test_profiling(tmp_path, capsys):
+    import profiling
+    path = str(tmp_path / 'profile.db')
+    profiler = profiling.enable(slow_ms=0)
+    try:
+        db = get_db(path, cache=True)
+        add_habit(db, 'Reading', 'daily')
+        for day in ('2024-11-28', '2024-11-29', '2024-11-30'):
+            increment_habit(db, 'Reading', day)
+        assert len(get_habit_tracking_data(db, 'Reading')) == 3
+        assert len(get_all_habits(db)) == 1 and db.query_cache is not None
+        db.close()
+    finally:
+        assert profiling.disable() is profiler
+
+    assert profiler.calls['increment_habit'].count == 3 and profiler.calls['add_habit'].count == 1
+    insert = next(stats for sql, stats in profiler.queries.items() if sql.startswith('INSERT OR IGNORE INTO tbl_tracker'))
+    assert insert.latency.count == 3 and insert.changes == 3
+    tracking = next(stats for sql, stats in profiler.queries.items() if sql.startswith('SELECT completed_date FROM tbl_tracker'))
+    assert tracking.rows == 3 and any('idx_tracker_habit_date' in step for step in tracking.plan)
+    assert profiler.commits.count >= 4
+    assert 'increment_habit' in profiler.report()
+
+    data = json.loads(open(profiler.dump(str(tmp_path / 'profile.json'))).read())
+    assert data['functions']['increment_habit']['count'] == 3
+    prometheus = open(profiler.dump(str(tmp_path / 'profile.prom'))).read()
+    assert 'habits_db_call_seconds_count{function="increment_habit"} 3' in prometheus
+    assert 'habits_db_call_seconds_bucket{function="increment_habit",le="+Inf"} 3' in prometheus
+
+    # 关闭后不再记录,连接也不再被包装
+    db = get_db(path)
+    get_all_habits(db)
+    assert type(db).__name__ == 'Connection' and profiler.calls['get_all_habits'].count == 1
+    db.close()
+
+    # 命令行:--profile 把报告打印到 stderr
+    assert cli.main(['list', '--db', path, '--profile', '--profile-output', str(tmp_path / 'cli.prom')]) == 0
+    assert 'get_habit_rows' in capsys.readouterr().err
+    assert 'function="get_habit_rows"' in open(tmp_path / 'cli.prom').read()
+
+
+def test_soft_delete_and_purge(tmp_path):
+    from db import archive_completions, delete_habits, history_stats, purge_deleted, purge_in_background
+    path = str(tmp_path / 'delete.db')
+    db = get_db(path)
+    start = date(2024, 1, 1)
+    for name in ('Reading', 'Gym training', 'Walking'):
+        add_habit(db, name, 'daily')
+        bulk_record_completions(db, [(name, start + timedelta(days=offset)) for offset in range(40)])
+    archive_completions(db, start + timedelta(days=20))
+    expected = history_stats(db)
+
+    # 删除后立即不可见, 名字可以重新使用, 但记录还在等待清理
+    assert delete_habits(db, ['Reading', 'Walking', 'Unknown']) == 2
+    assert [row[0] for row in get_all_habits(db)] == ['Gym training']
+    assert history_stats(db) == {2: expected[2]} and verify_streaks(db) == []
+    add_habit(db, 'Reading', 'weekly')
+    assert get_habit_tracking_data(db, 'Reading') == []
+    assert db.execute("SELECT COUNT(*) FROM tbl_tracker WHERE habit_id IN (1, 3)").fetchone()[0] == 40
+
+    # 分块清理: 每个事务最多 chunk_size 行
+    assert purge_deleted(db, chunk_size=10, max_chunks=1) == 10
+    assert purge_deleted(db, chunk_size=10) == 30 + 2
+    assert db.execute("SELECT COUNT(*) FROM tbl_habit_tombstones").fetchone()[0] == 0
+    assert db.execute("PRAGMA foreign_key_check").fetchall() == []
+    assert len(get_habit_tracking_data(db, 'Gym training')) == 40
+
+    # 后台线程清理, 写入不受影响
+    delete_habit(db, 'Gym training')
+    purge_in_background(path, chunk_size=5, pause=0).join()
+    assert db.execute("SELECT COUNT(*) FROM tbl_tracker").fetchone()[0] == 0
+    assert db.execute("SELECT COUNT(*) FROM tbl_completion_runs").fetchone()[0] == 0
+    db.close()
+
+
+def test_purge_on_migrated_database(setup_mock_db):
+    from db import purge_deleted
+    db = setup_mock_db
+    # 旧格式的 tbl_tracker 没有 id 列, 按 rowid 清理
+    delete_habit(db, 'English learning')
+    assert db.execute("SELECT COUNT(*) FROM tbl_tracker").fetchone()[0] == 35
+    assert purge_deleted(db, chunk_size=7) == 30
+    assert db.execute("SELECT COUNT(*) FROM tbl_tracker").fetchone()[0] == 5
+    assert db.execute("SELECT COUNT(*) FROM tbl_habit_tombstones").fetchone()[0] == 0
+    assert len(get_habit_tracking_data(db, 'Teeth protection with Elmex gelee')) == 4
+
+def test_check_in_many_habits(tmp_path):
+    from db import check_in, get_habit_rows
+    from registry import HabitRegistry
+    db = get_db(str(tmp_path / 'check_in.db'))
+    habits = HabitRegistry(db)
+    for name, frequency in (('Reading', 'daily'), ('Gym training', 'daily'), ('Walking', 'daily'), ('Review', 'weekly')):
+        habits.add(name, frequency)
+    habits.get('Walking').add_event(db, '2024-11-30')
+    assert [habit.name for habit in habits.due('daily', today='2024-11-30')] == ['Gym training', 'Reading']
+    assert [habit.name for habit in habits.due(today='2024-11-30')] == ['Gym training', 'Reading', 'Review']
+
+    # 一次查询判断哪些已完成, 一个事务写入
+    statements = []
+    db.set_trace_callback(statements.append)
+    recorded = habits.check_in(['Reading', 'Walking', 'Review', 'Swimming'], date(2024, 11, 30))
+    db.set_trace_callback(None)
+    assert [habit.name for habit in recorded] == ['Reading', 'Review']
+    assert sum('json_each' in sql for sql in statements) == 1 and statements.count('COMMIT') == 1
+
+    # Habit 对象在内存中更新, 与数据库一致
+    reading = habits.get('Reading')
+    assert (reading.streak, reading.completed_tasks, reading.last_completed) == (1, 1, date(2024, 11, 30))
+    assert reading.is_completed_on('2024-11-30')
+    stored = {row[1]: (row[3], row[4]) for row in get_habit_rows(db)}
+    assert {habit.name: (habit.streak, habit.completed_tasks) for habit in habits} == stored
+    assert habits.due('daily', today='2024-11-30')[0].name == 'Gym training'
+    assert check_in(db, ['Gym training', 'Reading'], '2024-12-01') == {'Gym training': 1, 'Reading': 2}
+
+    # 其他连接新增的习惯也能打卡; 字符串日期转换为 date
+    add_habit(db, 'Swimming', 'daily')
+    recorded = habits.check_in(['Swimming', 'Walking'], '2024-12-02')
+    assert [(habit.name, habit.streak, habit.completed_tasks) for habit in recorded] == [('Swimming', 1, 1), ('Walking', 1, 2)]
+    assert habits.get('Swimming') is recorded[0] and habits.get('Walking').last_completed == date(2024, 12, 2)
+    assert verify_streaks(db) == []
+    db.close()
+
+
+def test_due_and_overdue_habits(tmp_path, capsys):
+    from db import due_habits, get_due_habits
+    db_path = str(tmp_path / 'due.db')
+    db = get_db(db_path)
+    for name, frequency, completed_date, user_id in (
+            ('Reading', 'daily', '2024-11-28', 0), ('Walking', 'daily', '2024-11-29', 0), ('Review', 'weekly', '2024-11-24', 0),
+            ('Budget', 'monthly', '2024-11-02', 0), ('Taxes', 'yearly', '2022-04-30', 0), ('Gym training', 'daily', None, 0),
+            ('Cooking', 'daily', '2024-11-27', 7)):
+        add_habit(db, name, frequency, user_id)
+        if completed_date:
+            increment_habit(db, name, completed_date, user_id)
+    due = lambda **kwargs: [row[1] for row in get_due_habits(db, '2024-11-30', **kwargs)]
+    # 按 next_due 排序, 从未完成的排在最后; 逾期指整整错过一个周期
+    assert due() == ['Taxes', 'Review', 'Reading', 'Walking', 'Gym training']
+    assert due(overdue=True) == ['Taxes', 'Reading']
+    assert due(overdue=True, user_id=None) == ['Taxes', 'Cooking', 'Reading']
+    assert due(frequency='weekly') == ['Review'] and due_habits(db, '2024-11-30', 'daily') == ['Gym training', 'Reading', 'Walking']
+
+    # next_due 随每次写入更新, 查询走索引
+    increment_habit(db, 'Reading', '2024-11-30')
+    db.execute("UPDATE tbl_habit SET last_completed = '2024-11-25' WHERE name = 'Review'")
+    assert due() == ['Taxes', 'Walking', 'Gym training']
+    plan = db.execute("EXPLAIN QUERY PLAN SELECT name FROM tbl_habit WHERE next_due <= ? AND user_id = ?", ('2024-11-30', 0)).fetchall()
+    assert 'idx_habit_user_due' in plan[0][-1]
+    db.close()
+
+    assert cli.main(['due', '--db', db_path, '--date', '2024-12-01', '--overdue', '--json']) == 0
+    assert [habit['name'] for habit in json.loads(capsys.readouterr().out.splitlines()[-1])] == ['Taxes', 'Walking']
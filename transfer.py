@@ -0,0 +1,116 @@
+"""
+Streaming import and export of habits and completions as CSV or JSONL, optionally gzip compressed.
+
+The format follows the file name: habits.csv, tracker.jsonl, tracker.jsonl.gz, ...
+Rows are streamed in both directions, so memory use does not depend on the size of the tables.
+
+Usage:
+    python main.py export habits habits.csv
+    python main.py export tracker tracker.jsonl.gz
+    python main.py import habits habits.csv
+    python main.py import tracker tracker.jsonl.gz
+"""
+import csv
+import gzip
+import json
+import sys
+import time
+
+from db import DEFAULT_USER, bulk_add_habits, bulk_record_completions, iter_completion_rows, iter_habit_rows
+
+TABLES = {
+    "habits": ["name", "frequency", "streak", "longest_streak", "total_completions", "last_completed"],
+    "tracker": ["habit", "completed_date"],
+}
+
+
+class Progress:
+    """Count streamed rows and report the throughput every `every` rows and at the end."""
+
+    def __init__(self, label, every=100_000, out=sys.stderr):
+        self.label = label
+        self.every = every
+        self.out = out
+        self.count = 0
+        self.start = time.perf_counter()
+
+    def track(self, rows):
+        """Pass `rows` through while counting them."""
+        for row in rows:
+            self.count += 1
+            if self.count % self.every == 0:
+                self.report()
+            yield row
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        rate = self.count / elapsed if elapsed else 0
+        print(f"{self.label}: {self.count:,} rows, {rate:,.0f} rows/s", file=self.out)
+
+
+def file_format(path):
+    """Return (format, compressed) for a file name, format is 'csv' or 'jsonl'."""
+    compressed = path.endswith(".gz")
+    name = path[:-3] if compressed else path
+    for fmt in ("csv", "jsonl"):
+        if name.endswith("." + fmt):
+            return fmt, compressed
+    raise ValueError(f"Unknown file format: {path} (expected .csv, .jsonl, optionally with .gz)")
+
+
+def _open(path, mode):
+    _, compressed = file_format(path)
+    if compressed:
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def write_rows(path, columns, rows):
+    """Write tuples to a CSV or JSONL file. Returns the number of rows written."""
+    fmt, _ = file_format(path)
+    count = 0
+    with _open(path, "w") as f:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n")
+                count += 1
+    return count
+
+
+def read_rows(path):
+    """Yield the records of a CSV or JSONL file as dicts."""
+    fmt, _ = file_format(path)
+    with _open(path, "r") as f:
+        if fmt == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def export_table(db, table, path, progress=None, user_id=DEFAULT_USER):
+    """Export the 'habits' or 'tracker' rows of a user to a file. Returns the number of rows written."""
+    rows = iter_habit_rows(db, user_id=user_id) if table == "habits" else iter_completion_rows(db, user_id=user_id)
+    if progress:
+        rows = progress.track(rows)
+    return write_rows(path, TABLES[table], rows)
+
+
+def import_table(db, table, path, progress=None, user_id=DEFAULT_USER):
+    """
+    Import 'habits' or 'tracker' of a user from a file. Habits are matched by name and existing ones are kept,
+    completions of unknown habits are skipped. Returns the number of rows added.
+    """
+    records = read_rows(path)
+    if progress:
+        records = progress.track(records)
+    if table == "habits":
+        return bulk_add_habits(db, ((record["name"], record["frequency"]) for record in records), user_id=user_id)
+    return bulk_record_completions(db, ((record["habit"], record["completed_date"]) for record in records), user_id=user_id)
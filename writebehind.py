@@ -0,0 +1,199 @@
+"""
+Write-behind buffer for completions.
+
+Completions are accepted immediately, deduplicated in memory by (user, habit, date) and written
+by a background thread in one transaction every `interval` seconds, or as soon as `max_events`
+are waiting. A burst of check-ins then costs one commit per flush instead of one per check-in.
+
+Durability: every accepted event is first appended to a journal file next to the database
+(habits.db.journal). After each committed flush the journal is replaced, through a synced temporary
+file and a rename, by one that only holds the events that are not in the database yet.
+close() flushes everything; after a crash, the next WriteBehindQueue on the same database replays
+the journal. Replaying is idempotent, events that were committed just before the crash are ignored by the unique (habit_id, completed_date) index.
+Journal lines reach the operating system before submit() returns, which survives a crash of the
+process; with fsync=True they are also synced to disk, which survives a power loss but costs an
+fsync per event.
+A queue holds an exclusive lock on habits.db.journal.lock while it is open; a second queue on the
+same database, in this or another process, is refused instead of replaying and removing the journal
+of the first. The lock is released when the process ends, so a crash never leaves it held.
+
+    with WriteBehindQueue("habits.db") as queue:
+        queue.submit("Reading")
+"""
+import json
+import os
+import threading
+from datetime import date, datetime
+
+from db import DEFAULT_USER, get_db, record_completions
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _iso_date(value):
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.isoformat() if isinstance(value, date) else date.fromisoformat(value).isoformat()
+
+
+def _lock(path):
+    """Open `path` and lock it exclusively without waiting. Returns the file, or None if it is locked already."""
+    f = open(path, "a+b")
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+class WriteBehindQueue:
+    """Buffer completions for one database file, see the module docstring."""
+
+    def __init__(self, db_name="habits.db", journal=None, interval=0.05, max_events=1_000, fsync=False):
+        self.db_name = db_name
+        self.journal = journal or db_name + ".journal"
+        self.interval = interval
+        self.max_events = max_events
+        self.fsync = fsync
+        self.flushes = 0  # committed transactions
+        self.written = 0  # events written, including those that were already in the database
+        self._pending = {}  # (user_id, name, ISO date) -> None, in submission order
+        self._lock = threading.Lock()  # guards _pending and the journal file
+        self._flush_lock = threading.Lock()  # one flush at a time
+        # the lock file is left in place: removing it would let two queues lock different files
+        self._lock_file = _lock(self.journal + ".lock")
+        if self._lock_file is None:
+            raise RuntimeError(f"{self.journal} is in use by another write-behind queue")
+        self._db = get_db(db_name, check_same_thread=False)
+        self.recovered = self._recover()
+        self._file = open(self.journal, "a", encoding="utf-8")
+        self._closed = False
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def _recover(self):
+        """Write the events a previous process left in the journal. Returns their number."""
+        if not os.path.exists(self.journal):
+            return 0
+        events = []
+        with open(self.journal, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    events.append(tuple(json.loads(line)))
+                except ValueError:
+                    break  # the last line was torn by the crash
+        if events:
+            record_completions(self._db, events)
+            self._db.commit()
+        os.remove(self.journal)
+        return len(events)
+
+    def submit(self, name, completed_date=None, user_id=DEFAULT_USER):
+        """
+        Accept a completion, today unless `completed_date` is given. Returns False if the same
+        completion is already waiting to be written, True otherwise.
+        """
+        key = (user_id, name, _iso_date(completed_date or date.today()))
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("the write-behind queue is closed")
+            if key in self._pending:
+                return False
+            self._pending[key] = None
+            self._file.write(json.dumps(key) + "\n")
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            full = len(self._pending) >= self.max_events
+        if full:
+            self._wake.set()
+        return True
+
+    def __len__(self):
+        """Number of events waiting to be written."""
+        return len(self._pending)
+
+    def flush(self):
+        """Write all waiting events in one transaction. Returns the number of events written."""
+        with self._flush_lock:
+            with self._lock:
+                events = list(self._pending)
+            if not events:
+                return 0
+            try:
+                record_completions(self._db, events)
+                self._db.commit()
+            except Exception:
+                self._db.rollback()
+                raise  # the events stay pending and in the journal
+            with self._lock:
+                for key in events:
+                    del self._pending[key]
+                self._rewrite_journal()
+            self.flushes += 1
+            self.written += len(events)
+            return len(events)
+
+    def _rewrite_journal(self):
+        """
+        Replace the journal by one that holds only the events submitted during the last transaction.
+        They are written to a temporary file that is synced and renamed over the journal, so a crash
+        or power loss leaves either the old or the new journal, never one without acknowledged events.
+        """
+        temporary = self.journal + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(key) + "\n" for key in self._pending)
+            f.flush()
+            os.fsync(f.fileno())
+        # if the rename fails, the old journal stays in place and its handle stays open for submit()
+        os.replace(temporary, self.journal)
+        try:
+            if self.fsync:
+                # the rename itself only survives a power loss once the directory is synced
+                directory = os.open(os.path.dirname(os.path.abspath(self.journal)), os.O_RDONLY)
+                try:
+                    os.fsync(directory)
+                finally:
+                    os.close(directory)
+        finally:
+            old, self._file = self._file, open(self.journal, "a", encoding="utf-8")
+            old.close()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Write-behind flush failed, retrying: {e}")
+
+    def close(self):
+        """Stop the background thread and write everything that is waiting."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+        self._file.close()
+        if not self._pending:
+            os.remove(self.journal)
+        self._db.close()
+        self._lock_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()